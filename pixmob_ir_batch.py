@@ -0,0 +1,331 @@
+"""
+Vectorized batch encoding and decoding of PixMob IR commands using NumPy.
+"""
+import enum
+
+import numpy as np
+
+from pixmob_ir_protocol import (
+    Command,
+    FieldKeyException,
+    FieldReadOnlyException,
+    FieldValueException,
+    GenericCommand,
+)
+
+
+_encoding_table = np.array(Command._encoding_map, dtype=np.uint8)
+_decoding_table = np.array([-1 if b is None else b for b in Command._decoding_table], dtype=np.int16)
+
+
+class DecodeError(enum.IntEnum):
+    """
+    Per-frame error codes of decode_batch(), replacing the exceptions raised by Command.decode().
+    """
+    NONE                = 0
+    INVALID_SIZE        = 1 # CommandDecodeException("Invalid command size")
+    INVALID_BYTE        = 2 # CommandDecodeException("Invalid byte at offset")
+    CHECKSUM_MISMATCH   = 3 # CommandDecodeException("Checksum mismatch")
+    INVALID_FIELDS      = 4 # Decoded fields rejected by the command class constructor
+
+
+def _field_column(field, values):
+    """
+    Convert a column of field values (bools, ints or enum members) to raw integers.
+    """
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.vectorize(int, otypes=[np.int64])(values)
+    if field.value_type is bool:
+        values = values.astype(bool)
+    return values.astype(np.int64)
+
+
+def _check_row(cls, field_names, row):
+    """
+    Run the regular constructor checks on one row of field values.
+    """
+    command = cls.__new__(cls)
+    command._populate_fields({
+        name: cls._fields[name].value_type(int(value)) for name, value in zip(field_names, row)
+    })
+    command._validate_fields()
+
+
+def _validate_rows(cls, columns, raise_errors=True) -> np.ndarray:
+    """
+    Run the constructor checks on columns of field values.
+
+    Read-only fields, enum values and the class's _field_checks are checked on whole
+    columns. Rows that fail are checked again with the regular constructor checks to raise
+    their exception. Classes that override _validate_fields also get the regular checks
+    for the rows that pass, once for every distinct row.
+
+    Returns which rows passed the checks when raise_errors is False.
+    """
+    field_names = list(columns)
+    num_rows = next(iter(columns.values())).size if columns else 1
+    if not field_names or num_rows == 0:
+        return np.ones(num_rows, dtype=bool)
+
+    valid = np.ones(num_rows, dtype=bool)
+    for name, field in cls._fields.items():
+        if field.read_only:
+            valid &= columns[name] == int(field.default)
+        elif issubclass(field.value_type, enum.Enum):
+            valid &= np.isin(columns[name], [member.value for member in field.value_type])
+    for _, check in cls._field_checks:
+        valid &= np.broadcast_to(np.asarray(check(columns), dtype=bool), valid.shape)
+
+    if raise_errors and not valid.all():
+        i = np.argmin(valid)
+        _check_row(cls, field_names, [columns[name][i] for name in field_names])
+        raise FieldValueException(f"Invalid field values in row {i}")
+
+    if cls._validate_fields is not Command._validate_fields:
+        rows = np.flatnonzero(valid)
+        unique_rows, inverse = np.unique(np.stack([columns[name][rows] for name in field_names], axis=1),
+                                         axis=0, return_inverse=True)
+        unique_valid = np.ones(len(unique_rows), dtype=bool)
+        for i, row in enumerate(unique_rows):
+            try:
+                _check_row(cls, field_names, row)
+            except (FieldValueException, FieldReadOnlyException, ValueError):
+                if raise_errors:
+                    raise
+                unique_valid[i] = False
+        valid[rows] = unique_valid[inverse.reshape(-1)]
+    return valid
+
+
+def pack_batch(cls, **field_arrays) -> np.ndarray:
+    """
+    Pack columnar field values into an array of command buffers, one row per command.
+
+    Field arrays are broadcast against each other. Missing fields use the field default
+    and enum fields accept either enum members or their integer values.
+    """
+    fields = cls._fields
+    unexpected_fields = set(field_arrays).difference(fields)
+    if unexpected_fields:
+        raise FieldKeyException(f"Unexpected fields: {', '.join(sorted(unexpected_fields))}")
+    missing_fields = [name for name, field in fields.items()
+                      if name not in field_arrays and field.default is None]
+    if missing_fields:
+        raise FieldKeyException(f"Missing fields: {', '.join(sorted(missing_fields))}")
+
+    columns = {name: _field_column(field, field_arrays.get(name, field.default))
+               for name, field in fields.items()}
+    columns = {name: column.reshape(-1)
+               for name, column in zip(columns, np.broadcast_arrays(*columns.values()))}
+    _validate_rows(cls, columns)
+
+    num_commands = next(iter(columns.values())).size if columns else 1
+    buffers = np.tile(np.array(cls._header, dtype=np.int64), (num_commands, 1))
+    for name, field in fields.items():
+        for fragment in field.fragments:
+            mask = (1 << fragment.width) - 1
+            buffers[:, fragment.byte] |= ((columns[name] >> fragment.src_offset) & mask) << fragment.offset
+    return buffers.astype(np.uint8)
+
+
+def encode_buffers(buffers) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode an array of command buffers (one command per row) into IR sequences.
+
+    Returns a 2-D array of bits, one left-aligned IR sequence per row padded with 0's,
+    and the length of each IR sequence.
+    """
+    buffers = np.asarray(buffers, dtype=np.uint8)
+    if buffers.ndim != 2 or buffers.shape[1] not in [6, 9]:
+        raise ValueError(f"Expected an array of 6 or 9-byte buffers, got shape {buffers.shape}")
+    if len(buffers) == 0:
+        return np.zeros((0, 0), dtype=np.uint8), np.zeros(0, dtype=np.int64)
+
+    # Perform encoding and calculate final checksum
+    encoded_bytes = buffers.copy()
+    encoded_bytes[:, 2:] = _encoding_table[buffers[:, 2:]]
+    checksum = encoded_bytes[:, 2:].sum(axis=1, dtype=np.int64)
+    encoded_bytes[:, 1] = _encoding_table[(checksum >> 2) & 0x3F]
+
+    # Separate bits into IR sequence and trim leading and trailing 0's
+    bits = np.unpackbits(encoded_bytes, axis=1, bitorder='little')
+    first = bits.argmax(axis=1)
+    last = bits.shape[1] - 1 - bits[:, ::-1].argmax(axis=1)
+    lengths = last - first + 1
+    if np.all(first == first[0]):
+        encoded_bits = bits[:, first[0]:first[0] + lengths.max()]
+    else:
+        index = first[:, None] + np.arange(lengths.max())
+        encoded_bits = np.take_along_axis(bits, np.minimum(index, bits.shape[1] - 1), axis=1)
+    encoded_bits = encoded_bits * (np.arange(encoded_bits.shape[1]) < lengths[:, None])
+    return encoded_bits.astype(np.uint8), lengths
+
+
+def encode_batch(cls, commands=None, **field_arrays) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Encode many commands of one class at once.
+
+    Takes either a list of commands of a single class, or columnar field values for
+    `cls` (see pack_batch()). Returns the IR sequences and lengths from encode_buffers();
+    row i trimmed to lengths[i] matches the list returned by Command.encode().
+    """
+    if commands is not None:
+        if field_arrays:
+            raise ValueError("Pass either commands or field arrays, not both")
+        commands = list(commands)
+        if cls is Command:
+            if not commands:
+                return encode_buffers(np.zeros((0, 6), dtype=np.uint8))
+            cls = type(commands[0])
+        for command in commands:
+            if type(command) is not cls:
+                raise TypeError(f"Expected commands of type {cls.__name__}, " +
+                    f"received {type(command).__name__}")
+        buffers = np.array([command._buffer for command in commands], dtype=np.uint8)
+        buffers = buffers.reshape(len(commands), cls._num_bytes)
+    else:
+        buffers = pack_batch(cls, **field_arrays)
+    return encode_buffers(buffers)
+
+
+def _class_table() -> np.ndarray:
+    """
+    Dense lookup of Command._commands indices by [size is 9 bytes, flags type, action id].
+    """
+    table = np.full((2, 8, 32), -1, dtype=np.int16)
+    # Fill classes without an action id first so classes with one take precedence
+    for (num_bytes, flags_type, action_id), cls in sorted(Command._command_index.items(),
+                                                          key=lambda x: x[0][2] is not None):
+        action_ids = slice(None) if action_id is None else action_id
+        table[int(num_bytes == 9), flags_type, action_ids] = Command._commands.index(cls)
+    return table
+
+
+def _result_dtype() -> np.dtype:
+    field_names = list(dict.fromkeys(name for cls in Command._commands for name in cls._fields))
+    return np.dtype([
+        ('class_id', np.int16),
+        ('error', np.uint8),
+        ('num_bytes', np.uint8),
+        ('bytes', np.uint8, 9),
+        *((name, np.int16) for name in field_names),
+    ])
+
+
+def decode_frames(encoded_bytes, num_bytes, verify_checksum=True) -> np.ndarray:
+    """
+    Decode an array of encoded frames, one frame per row padded with 0's to 9 bytes.
+
+    num_bytes holds the size of each frame. Returns a structured array with one record
+    per frame: the index into Command._commands of the matching class (-1 when no class
+    matches or the frame has an error), a DecodeError code, the decoded bytes, and one
+    column per field name (-1 for fields the matching class does not have).
+    """
+    encoded_bytes = np.asarray(encoded_bytes, dtype=np.uint8).reshape(-1, 9)
+    num_bytes = np.broadcast_to(np.asarray(num_bytes, dtype=np.int64), (len(encoded_bytes),))
+    result = np.zeros(len(encoded_bytes), dtype=_result_dtype())
+    for name in result.dtype.names[4:]:
+        result[name] = -1
+    result['class_id'] = -1
+    result['num_bytes'] = num_bytes
+    error = np.full(len(encoded_bytes), DecodeError.NONE, dtype=np.uint8)
+    error[(num_bytes != 6) & (num_bytes != 9)] = DecodeError.INVALID_SIZE
+
+    # Perform decoding starting from 3rd byte, ignoring the padding of 6-byte frames
+    in_frame = np.arange(9) < num_bytes[:, None]
+    decoded = _decoding_table[encoded_bytes]
+    decoded[:, 0] = encoded_bytes[:, 0]
+    decoded[:, 1] = 0
+    decoded[~in_frame] = 0
+    invalid_byte = (decoded < 0).any(axis=1)
+    error[(error == DecodeError.NONE) & invalid_byte] = DecodeError.INVALID_BYTE
+    result['bytes'] = np.where(decoded < 0, 0, decoded)
+
+    # Verify the checksum is correct
+    checksum = np.where(in_frame, encoded_bytes, 0)[:, 2:].sum(axis=1, dtype=np.int64)
+    expected_checksum = _encoding_table[(checksum >> 2) & 0x3F]
+    if verify_checksum:
+        mismatch = expected_checksum != encoded_bytes[:, 1]
+        error[(error == DecodeError.NONE) & mismatch] = DecodeError.CHECKSUM_MISMATCH
+
+    # Look up the matching command class
+    ok = error == DecodeError.NONE
+    decoded = result['bytes']
+    flags_type = (decoded[:, 2] >> 1) & 0b111
+    action_id = decoded[:, 7] & 0x1F
+    class_id = _class_table()[(num_bytes == 9).astype(np.intp), flags_type, action_id]
+    result['class_id'] = np.where(ok, class_id, -1)
+
+    # Extract fields from decoded bytes based on command field definitions
+    for i, cls in enumerate(Command._commands):
+        rows = np.flatnonzero(result['class_id'] == i)
+        if rows.size == 0:
+            continue
+        columns = {}
+        for name, field in cls._fields.items():
+            column = np.zeros(rows.size, dtype=np.int64)
+            for fragment in field.fragments:
+                mask = (1 << fragment.width) - 1
+                column |= ((decoded[rows, fragment.byte].astype(np.int64) >> fragment.offset) & mask) \
+                    << fragment.src_offset
+            columns[name] = column
+            result[name][rows] = column
+        invalid_rows = rows[~_validate_rows(cls, columns, raise_errors=False)]
+        error[invalid_rows] = DecodeError.INVALID_FIELDS
+        result['class_id'][invalid_rows] = -1
+
+    result['error'] = error
+    return result
+
+
+def decode_batch(encoded_bits, lengths=None, verify_checksum=True) -> np.ndarray:
+    """
+    Decode a 2-D array of IR sequences, one sequence per row.
+
+    lengths holds the number of bits in each row (by default, the full row). As with
+    Command.decode(), leading 0's are skipped and trailing 0's within the length count
+    toward the frame size. Returns the structured array from decode_frames().
+    """
+    encoded_bits = np.asarray(encoded_bits) != 0
+    if encoded_bits.ndim != 2:
+        raise ValueError(f"Expected a 2-D array of bits, got shape {encoded_bits.shape}")
+    num_frames, max_bits = encoded_bits.shape
+    if lengths is None:
+        lengths = np.full(num_frames, max_bits, dtype=np.int64)
+    lengths = np.minimum(np.asarray(lengths, dtype=np.int64), max_bits)
+    encoded_bits = encoded_bits & (np.arange(max_bits) < lengths[:, None])
+
+    # Skip leading 0's; commands are stored starting at bit 7 of byte 0
+    has_bits = encoded_bits.any(axis=1)
+    num_leading_zeroes = np.where(has_bits, encoded_bits.argmax(axis=1), lengths)
+    num_bytes = (lengths - num_leading_zeroes + 6) // 8 + 1
+
+    # Assemble bytes from the bits of each sequence that fit into a 9-byte frame
+    index = num_leading_zeroes[:, None] + np.arange(-7, 65)
+    in_range = (index >= num_leading_zeroes[:, None]) & (index < lengths[:, None])
+    frame_bits = np.take_along_axis(encoded_bits, np.clip(index, 0, max(max_bits - 1, 0)), axis=1) \
+        if max_bits else np.zeros((num_frames, 72), dtype=bool)
+    encoded_bytes = np.packbits(frame_bits & in_range, axis=1, bitorder='little')
+
+    return decode_frames(encoded_bytes, num_bytes, verify_checksum)
+
+
+def to_commands(result) -> list:
+    """
+    Build Command objects from decode_frames() or decode_batch() results.
+
+    Frames without a matching class become GenericCommand and frames with an error
+    become None.
+    """
+    commands = []
+    for record in np.atleast_1d(result):
+        decoded_bytes = record['bytes'][:record['num_bytes']].tolist()
+        if record['error'] != DecodeError.NONE:
+            commands.append(None)
+        elif record['class_id'] < 0:
+            commands.append(GenericCommand(decoded_bytes))
+        else:
+            cls = Command._commands[record['class_id']]
+            commands.append(cls._from_buffer(decoded_bytes, validate=False))
+    return commands
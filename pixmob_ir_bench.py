@@ -0,0 +1,233 @@
+"""
+Benchmarks of the PixMob IR command codec.
+
+Measures the throughput of construction, encoding, decoding and batch encoding and decoding
+for every Command subclass, on random commands drawn from the field space of the class.
+Run it as:
+
+    python pixmob_ir_bench.py [--output results.json] [--compare baseline.json]
+
+The field space of a class is every combination of the values its fields can encode: both
+bools, every enum member, and every integer whose set bits are all carried by the field's
+fragments (so 8-bit colors with 6 encoded bits step by 4). The round trip of the field
+spaces is checked by tests/test_round_trip.py.
+
+Results are written as JSON, and --compare reports the operations that got slower than a
+saved result by more than --tolerance, to catch regressions between commits.
+"""
+import argparse
+import enum
+import itertools
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+import pixmob_ir_batch
+from pixmob_ir_protocol import Command, FieldValueException, encode_cache
+
+
+def field_values(field) -> list:
+    """
+    Return every value a field can encode, in ascending order.
+    """
+    if field.read_only:
+        return [field.default]
+    if field.value_type is bool:
+        return [False, True]
+    if issubclass(field.value_type, enum.Enum):
+        return list(field.value_type)
+    # Integers made of any combination of the bits carried by the fragments
+    bits = [fragment.src_offset + i for fragment in field.fragments for i in range(fragment.width)]
+    return sorted(sum(1 << bit for bit, on in zip(bits, combination) if on)
+                  for combination in itertools.product((0, 1), repeat=len(bits)))
+
+
+def field_space(cls) -> dict:
+    """
+    Return the values of every field of a command class, by field name.
+    """
+    return {name: field_values(field) for name, field in cls._fields.items()}
+
+
+def field_space_size(cls) -> int:
+    size = 1
+    for values in field_space(cls).values():
+        size *= len(values)
+    return size
+
+
+def random_field_values(cls, count, rng) -> list:
+    """
+    Return count random field values of a command class that pass its field checks.
+    """
+    space = field_space(cls)
+    field_sets = []
+    while len(field_sets) < count:
+        field_values = {name: rng.choice(values) for name, values in space.items()}
+        try:
+            cls(**field_values)
+        except FieldValueException:
+            # Rejected by the class's field checks
+            continue
+        field_sets.append(field_values)
+    return field_sets
+
+
+def _time_per_op(run, count, repeat, setup=None) -> float:
+    """
+    Return the best time per operation in seconds of repeat runs over count operations.
+    setup() runs before each run, untimed, and its result is passed to run().
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        run(state)
+        best = min(best, time.perf_counter() - start)
+    return best / count
+
+
+def benchmark_class(cls, count=1000, repeat=5, seed=0) -> dict:
+    """
+    Measure the codec operations of a command class over count random commands, returning
+    the best time per operation in microseconds, by operation.
+
+    Encodes start from freshly built commands and an empty encode_cache, so they measure
+    the full encode; 'encode_cached' measures encode_int() of commands already encoded.
+    """
+    field_sets = random_field_values(cls, count, random.Random(seed))
+    commands = [cls(**field_values) for field_values in field_sets]
+    bits = [command.encode() for command in commands]
+    packed = [command.encode_packed() for command in commands]
+    ints = [command.encode_int() for command in commands]
+    encoded_bits, lengths = pixmob_ir_batch.encode_batch(cls, commands)
+
+    def fresh_commands():
+        encode_cache.clear()
+        return [cls(**field_values) for field_values in field_sets]
+
+    def run_each(method):
+        def run(state):
+            for command in state:
+                method(command)
+        return run
+
+    def run_decode(encoded, **kwargs):
+        def run(state):
+            decode = Command.decode
+            for e in encoded:
+                decode(e, **kwargs)
+        return run
+
+    timings = {
+        'construct': _time_per_op(lambda state: [cls(**f) for f in field_sets], count, repeat),
+        'encode': _time_per_op(run_each(cls.encode), count, repeat, fresh_commands),
+        'encode_packed': _time_per_op(run_each(cls.encode_packed), count, repeat, fresh_commands),
+        'encode_int': _time_per_op(run_each(cls.encode_int), count, repeat, fresh_commands),
+        'encode_cached': _time_per_op(run_each(cls.encode_int), count, repeat, lambda: commands),
+        'decode': _time_per_op(run_decode(bits), count, repeat),
+        'decode_packed': _time_per_op(run_decode(packed), count, repeat),
+        'decode_int': _time_per_op(run_decode(ints), count, repeat),
+        'decode_lazy': _time_per_op(run_decode(packed, lazy=True), count, repeat),
+        'batch_encode': _time_per_op(lambda state: pixmob_ir_batch.encode_batch(cls, commands),
+                                     count, repeat),
+        'batch_decode': _time_per_op(lambda state: pixmob_ir_batch.decode_batch(encoded_bits, lengths),
+                                     count, repeat),
+    }
+    return {op: round(seconds * 1e6, 4) for op, seconds in timings.items()}
+
+
+def run_benchmarks(classes=None, count=1000, repeat=5, seed=0) -> dict:
+    """
+    Benchmark every command class; see benchmark_class().
+    """
+    return {cls.__name__: benchmark_class(cls, count, repeat, seed)
+            for cls in classes or Command._commands}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> dict:
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+    }
+
+
+def compare(baseline, results, tolerance=0.1) -> list:
+    """
+    Return (class name, operation, baseline us, current us) for every benchmark that is
+    slower than in baseline by more than the tolerance (a fraction of the baseline time).
+    """
+    regressions = []
+    for class_name, timings in results.get('benchmarks', {}).items():
+        baseline_timings = baseline.get('benchmarks', {}).get(class_name, {})
+        for op, us in timings.items():
+            baseline_us = baseline_timings.get(op)
+            if baseline_us and us > baseline_us * (1 + tolerance):
+                regressions.append((class_name, op, baseline_us, us))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the PixMob IR codec.")
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--compare', help="report regressions against results saved by --output")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="slowdown tolerated by --compare, as a fraction (default: 0.1)")
+    parser.add_argument('--classes', nargs='+', metavar='CLASS',
+                        help="command classes to run (default: all)")
+    parser.add_argument('--count', type=int, default=1000,
+                        help="commands per benchmark run (default: 1000)")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="benchmark runs, of which the best is kept (default: 5)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args(argv)
+
+    classes = None
+    if args.classes:
+        by_name = {cls.__name__: cls for cls in Command._commands}
+        unknown = [name for name in args.classes if name not in by_name]
+        if unknown:
+            parser.error(f"unknown command classes: {', '.join(unknown)}")
+        classes = [by_name[name] for name in args.classes]
+
+    results = {
+        'environment': environment(),
+        'benchmarks': run_benchmarks(classes, args.count, args.repeat, args.seed),
+    }
+    ops = list(next(iter(results['benchmarks'].values())))
+    print(f"{'us per command':28} " + ' '.join(f"{op:>13}" for op in ops))
+    for class_name, timings in results['benchmarks'].items():
+        print(f"{class_name:28} " + ' '.join(f"{timings[op]:>13.3f}" for op in ops))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), results, args.tolerance)
+        for class_name, op, baseline_us, us in regressions:
+            print(f"Regression: {class_name}.{op} {baseline_us:.3f}us -> {us:.3f}us", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Vectorized quantization of 8-bit RGB colors to the values PixMob color fields can encode.
+
+Most commands carry 6 bits per color channel (src_offset=2), and the group and firmware
+commands compact colors to 12-bit RGB (4 bits per channel, src_offset=4). Packing a color
+drops its low bits, which makes slow fades step visibly. A ColorQuantizer instead rounds
+every color to the nearest encodable value through a precomputed lookup table, optionally
+with a gamma curve, and can carry the rounding error over to the next frame so that fades
+average out to the intended color.
+"""
+import numpy as np
+
+from pixmob_ir_protocol import CommandSingleColor
+
+
+class ColorQuantizer:
+    """
+    Converts arrays of RGB colors (last axis of size 3, values 0-255) to the colors a color
+    field encodes, in one vectorized call per frame.
+
+    bits: Bits of each color channel in the command (6 or 4 for the current commands).
+    gamma: Exponent applied to input colors before quantizing, e.g. 2.2 to map perceptual
+           lighting desk levels to LED PWM levels. 1.0 leaves colors unchanged.
+    dither: Add the rounding error of each color to the same color of the next frame, so
+            that a sequence of frames averages to the intended colors. The error is kept
+            per element, so frames must keep the same shape and order.
+    """
+    def __init__(self, bits=6, gamma=1.0, dither=False):
+        self.bits = bits
+        self.gamma = gamma
+        self.dither = dither
+        self.step = 1 << (8 - bits)
+        self.max_value = ((1 << bits) - 1) * self.step
+        # Target color of each 8-bit input, and its nearest encodable value
+        self.target_table = (255.0 * (np.arange(256) / 255.0) ** gamma).astype(np.float32)
+        self.quantize_table = self._round(self.target_table)
+        self.error_table = self.quantize_table - self.target_table
+        self._residual = None
+
+    def _round(self, target):
+        steps = np.clip(np.rint(target / self.step), 0, (1 << self.bits) - 1)
+        return (steps * self.step).astype(np.uint8)
+
+    def target(self, rgb) -> np.ndarray:
+        """
+        Return the color each input maps to before quantization, as float32.
+        """
+        rgb = np.asarray(rgb)
+        if rgb.dtype == np.uint8:
+            return self.target_table[rgb]
+        return (255.0 * (np.clip(rgb, 0, 255) / 255.0) ** self.gamma).astype(np.float32)
+
+    def quantize(self, rgb) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Quantize an array of colors. Integer inputs are looked up in the precomputed tables;
+        float inputs (e.g. interpolated fades) are computed directly.
+
+        Returns the encodable colors as uint8 and the error of each value (quantized minus
+        target, in 8-bit units) as float32.
+        """
+        rgb = np.asarray(rgb)
+        if rgb.dtype == np.uint8 and not self.dither:
+            return self.quantize_table[rgb], self.error_table[rgb]
+
+        target = self.target(rgb)
+        if self.dither:
+            if self._residual is None or self._residual.shape != target.shape:
+                self._residual = np.zeros(target.shape, dtype=np.float32)
+            quantized = self._round(target - self._residual)
+            error = quantized - target
+            self._residual = quantized - (target - self._residual)
+        else:
+            quantized = self._round(target)
+            error = quantized - target
+        return quantized, error
+
+    def reset(self):
+        """
+        Forget the rounding error carried over by dithering.
+        """
+        self._residual = None
+
+
+def color_bits(cls) -> int:
+    """
+    Return the bits per color channel of a command class, from the layout of its color fields.
+    """
+    field = cls._fields.get('red', cls._fields.get('red1'))
+    if field is None:
+        raise ValueError(f"{cls.__name__} has no color fields")
+    return sum(fragment.width for fragment in field.fragments)
+
+
+def quantizer_for(cls=CommandSingleColor, gamma=1.0, dither=False) -> ColorQuantizer:
+    """
+    Return a ColorQuantizer for the color fields of a command class.
+    """
+    return ColorQuantizer(color_bits(cls), gamma, dither)
+
+
+def quantize_colors(cls, rgb, gamma=1.0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize an array of colors to the color fields of a command class. See
+    ColorQuantizer.quantize().
+    """
+    return quantizer_for(cls, gamma).quantize(rgb)
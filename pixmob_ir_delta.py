@@ -0,0 +1,169 @@
+"""
+Streaming delta encoding of per-group color frames (e.g. from a lighting desk) into IR
+commands.
+
+A frame holds one color for each of the 31 group ids. Only groups whose quantized color
+changed by more than a threshold since it was last sent get a command, and when enough
+groups share one color, a single group 0 command sets them all. The IR channel carries less
+than one 9-byte command per frame at 30fps, so updates that do not fit in the airtime of a
+frame are deferred to the next one, oldest and largest changes first.
+"""
+import numpy as np
+
+from pixmob_ir_color import ColorQuantizer
+from pixmob_ir_protocol import CommandSetColor, CommandSingleColorExt, Time
+from pixmob_ir_pulse import DEFAULT_CONFIG
+
+
+# Number of group ids, not counting the universal group 0
+NUM_GROUPS = 31
+
+
+def _single_color_ext(group_id, red, green, blue):
+    # A 0ms release leaves the color on as the background color until the next update
+    return CommandSingleColorExt(red=red, green=green, blue=blue, group_id=group_id,
+                                 attack=Time.TIME_0_MS, sustain=Time.TIME_0_MS, release=Time.TIME_0_MS)
+
+
+def set_background(group_id, red, green, blue):
+    """
+    DeltaEncoder make_command that sends colors as background colors with CommandSetColor.
+    """
+    return CommandSetColor(red=red, green=green, blue=blue, group_id=group_id,
+                           is_background=True, skip_display=True)
+
+
+class DeltaEncoder:
+    """
+    Keeps the last color sent to every group and turns color frames into the commands that
+    bring the groups up to date.
+
+    frame_rate: Frames per second, which sets the airtime available to each frame.
+    threshold: Largest change of any channel (in 8-bit units, after quantization) that is
+               not sent.
+    make_command: Function of (group_id, red, green, blue) returning the command to send.
+                  Defaults to a CommandSingleColorExt that holds the color; pass
+                  set_background to send CommandSetColor background colors instead.
+    quantizer: ColorQuantizer for the command colors. Defaults to 6 bits per channel.
+    config: PulseTrainConfig giving the airtime of each command.
+    """
+    def __init__(self, frame_rate=30, threshold=0, make_command=None, quantizer=None,
+                 config=DEFAULT_CONFIG):
+        self.frame_interval_s = 1.0 / frame_rate
+        self.threshold = threshold
+        self.make_command = make_command or _single_color_ext
+        self.quantizer = quantizer or ColorQuantizer(bits=6)
+        self.config = config
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the sent colors, so that the next frame is sent in full.
+        """
+        # Colors never sent are out of range, so that they always differ
+        self._sent = np.full((NUM_GROUPS, 3), -256, dtype=np.int16)
+        self._pending = np.zeros(NUM_GROUPS, dtype=bool)
+        self._pending_rgb = np.zeros((NUM_GROUPS, 3), dtype=np.int16)
+        self._pending_frames = np.zeros(NUM_GROUPS, dtype=np.int64)
+        self._air_free_s = 0.0
+        self.num_frames = 0
+        self.num_commands = 0
+        self.num_updates = 0
+        self.num_suppressed = 0
+        self.num_deferred = 0
+        self.num_dropped = 0
+        self.airtime_s = 0.0
+
+    def _airtime_s(self, command):
+        return self.config.airtime_us(len(command.encode())) / 1e6
+
+    def encode_frame(self, frame, time_s=None) -> list:
+        """
+        Return the commands to send for a frame of colors, an array of shape (31, 3) whose
+        row i is the color of group id i + 1.
+
+        time_s: Time of the frame, by default frame count / frame_rate. Commands go out
+                back to back, starting no later than the end of the frame.
+        """
+        time_s = self.num_frames * self.frame_interval_s if time_s is None else time_s
+        self.num_frames += 1
+        target = self.quantizer.quantize(frame)[0].astype(np.int16)
+        delta = np.abs(target - self._sent).max(axis=1)
+        dirty = delta > self.threshold
+        self.num_suppressed += np.count_nonzero((delta > 0) & ~dirty)
+
+        # Deferred updates replaced by a newer color, or no longer needed, are dropped
+        self.num_dropped += np.count_nonzero(self._pending & (~dirty |
+                                             (target != self._pending_rgb).any(axis=1)))
+        self._pending_frames = np.where(self._pending & dirty, self._pending_frames + 1, 0)
+        self._pending = dirty
+        self._pending_rgb = target
+
+        queue = self._plan(target, dirty, delta)
+        commands = []
+        self._air_free_s = max(self._air_free_s, time_s)
+        while queue and self._air_free_s < time_s + self.frame_interval_s:
+            group_id, rgb = queue.pop(0)
+            command = self.make_command(group_id, *map(int, rgb))
+            commands.append(command)
+            airtime_s = self._airtime_s(command)
+            self._air_free_s += airtime_s
+            self.airtime_s += airtime_s
+            if group_id == 0:
+                self._sent[:] = rgb
+                self.num_updates += np.count_nonzero(self._pending)
+            else:
+                self._sent[group_id - 1] = rgb
+                self.num_updates += 1
+            self._pending = np.abs(target - self._sent).max(axis=1) > self.threshold
+
+        self.num_deferred += np.count_nonzero(self._pending)
+        self.num_commands += len(commands)
+        return commands
+
+    def _plan(self, target, dirty, delta) -> list:
+        """
+        Return the (group id, color) updates for the dirty groups, oldest and largest changes
+        first, led by a group 0 update when that saves commands.
+        """
+        num_dirty = np.count_nonzero(dirty)
+        if num_dirty == 0:
+            return []
+        order = np.lexsort((-delta, -self._pending_frames))
+        updates = [(int(i) + 1, target[i]) for i in order if dirty[i]]
+        if num_dirty == 1:
+            return updates
+
+        # Common color of the most groups, and the groups that would still differ from it
+        colors, counts = np.unique(target, axis=0, return_counts=True)
+        common = colors[np.argmax(counts)]
+        differ = np.abs(target - common).max(axis=1) > self.threshold
+        if 1 + np.count_nonzero(differ) < num_dirty:
+            return [(0, common)] + [(int(i) + 1, target[i]) for i in order if differ[i]]
+        return updates
+
+    def stream(self, frames):
+        """
+        Generate (time in seconds, commands) for every frame of an iterable of frames.
+        """
+        for frame in frames:
+            time_s = self.num_frames * self.frame_interval_s
+            yield time_s, self.encode_frame(frame, time_s)
+
+    def stats(self) -> dict:
+        """
+        Return counters for tuning under load: group updates sent, changes suppressed by the
+        threshold, updates deferred to a later frame (counted once per frame), and deferred
+        updates dropped because a newer color replaced them.
+        """
+        return {
+            'frames': self.num_frames,
+            'commands': self.num_commands,
+            'updates': int(self.num_updates),
+            'suppressed': int(self.num_suppressed),
+            'deferred': int(self.num_deferred),
+            'dropped': int(self.num_dropped),
+            'pending': int(np.count_nonzero(self._pending)),
+            'airtime_s': self.airtime_s,
+        }
+
@@ -0,0 +1,174 @@
+"""
+Demodulation of captured IR receiver edges (e.g. from a logic analyzer) into PixMob commands.
+"""
+import numpy as np
+
+from pixmob_ir_protocol import Command, CommandDecodeException
+from pixmob_ir_pulse import SLOT_US
+
+
+# Widest IR sequence of a valid 9-byte frame is 65 bits
+_MAX_FRAME_BITS = 72
+
+
+class DemodulatedFrame:
+    """
+    A frame found in an edge capture, with its decoded command and timing-quality metrics.
+
+    slot_us and bias_us are the slot width and mark stretch (spaces shrink by the same
+    amount) fitted to the frame. max_error and rms_error are the residuals of the run
+    durations from a whole number of slots, in slots. num_glitches counts runs shorter
+    than half a slot. command is None when the frame could not be decoded, with the reason
+    in error.
+    """
+    def __init__(self, start_us, end_us, encoded_bits, slot_us, bias_us, max_error, rms_error,
+                 num_glitches, command=None, error=None):
+        self.start_us = start_us
+        self.end_us = end_us
+        self.encoded_bits = encoded_bits
+        self.slot_us = slot_us
+        self.bias_us = bias_us
+        self.max_error = max_error
+        self.rms_error = rms_error
+        self.num_glitches = num_glitches
+        self.command = command
+        self.error = error
+
+    def __repr__(self):
+        result = self.command if self.error is None else f"error={self.error!r}"
+        return f"{type(self).__name__}(start_us={self.start_us:.0f}, " + \
+            f"slot_us={self.slot_us:.1f}, max_error={self.max_error:.2f}, {result})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+def load_edges_csv(path, time_column=0, level_column=1, skip_rows=1):
+    """
+    Load edge times (in seconds) and levels from a logic analyzer CSV export.
+    """
+    data = np.loadtxt(path, delimiter=',', skiprows=skip_rows, usecols=(time_column, level_column),
+                      ndmin=2)
+    return data[:, 0], data[:, 1].astype(np.uint8)
+
+
+def _fit_frames(durations, is_mark, frame_ids, num_frames, slot_us, max_drift):
+    """
+    Fit slot width and mark bias per frame with least squares on duration ~ slot * n + bias * sign.
+    """
+    sign = np.where(is_mark, 1.0, -1.0)
+    frame_slot = np.full(num_frames, float(slot_us))
+    frame_bias = np.zeros(num_frames)
+    for _ in range(3):
+        residual = (durations - frame_bias[frame_ids] * sign) / frame_slot[frame_ids]
+        num_slots = np.maximum(np.rint(residual), 0)
+        s_nn = np.bincount(frame_ids, num_slots * num_slots, num_frames)
+        s_ns = np.bincount(frame_ids, num_slots * sign, num_frames)
+        s_ss = np.bincount(frame_ids, sign * sign, num_frames)
+        s_nd = np.bincount(frame_ids, num_slots * durations, num_frames)
+        s_sd = np.bincount(frame_ids, sign * durations, num_frames)
+        det = s_nn * s_ss - s_ns * s_ns
+        solvable = np.abs(det) > 1e-9
+        safe_det = np.where(solvable, det, 1.0)
+        slot = np.where(solvable, (s_nd * s_ss - s_sd * s_ns) / safe_det,
+                        s_nd / np.maximum(s_nn, 1e-9))
+        bias = np.where(solvable, (s_nn * s_sd - s_ns * s_nd) / safe_det, 0.0)
+        frame_slot = np.clip(slot, slot_us * (1 - max_drift), slot_us * (1 + max_drift))
+        frame_bias = np.clip(bias, -frame_slot / 2, frame_slot / 2)
+    residual = (durations - frame_bias[frame_ids] * sign) / frame_slot[frame_ids]
+    num_slots = np.maximum(np.rint(residual), 0).astype(np.int64)
+    return num_slots, residual - num_slots, frame_slot, frame_bias
+
+
+def demodulate(times, levels=None, initial_level=1, active_low=True, time_scale=1e6,
+               slot_us=SLOT_US, gap_slots=6, max_drift=0.1, verify_checksum=True) -> list:
+    """
+    Split captured receiver edges into frames and decode each frame with Command.decode().
+
+    times: Edge times, multiplied by time_scale to get microseconds (default: seconds).
+    levels: Output level after each edge. If omitted, levels alternate after initial_level.
+    active_low: Receiver output is low while the IR carrier is present (usual for 38 kHz
+                receivers).
+    gap_slots: Spaces longer than this many slots separate frames. Frames contain at most
+               4 slots of consecutive 0's.
+    max_drift: Largest relative deviation of the fitted slot width from slot_us.
+
+    Returns a list of DemodulatedFrame in capture order.
+    """
+    times_us = np.asarray(times, dtype=np.float64) * time_scale
+    if levels is None:
+        levels = (np.arange(len(times_us)) + initial_level + 1) % 2
+    is_mark = (np.asarray(levels) == 0) if active_low else (np.asarray(levels) != 0)
+
+    # Keep only real transitions; run i lasts from edge i to edge i + 1
+    keep = np.ones(len(times_us), dtype=bool)
+    keep[1:] = is_mark[1:] != is_mark[:-1]
+    times_us = times_us[keep]
+    is_mark = is_mark[keep][:-1]
+    durations = np.diff(times_us)
+    if len(durations) == 0:
+        return []
+
+    # Split frames on idle gaps; idle before the first mark is a gap as well
+    is_gap = ~is_mark & (durations > gap_slots * slot_us)
+    is_gap[0] |= ~is_mark[0]
+    frame_ids = np.cumsum(is_gap)
+    runs = np.flatnonzero(~is_gap)
+    if len(runs) == 0:
+        return []
+    frame_ids = np.unique(frame_ids[runs], return_inverse=True)[1].reshape(-1)
+    durations = durations[runs]
+    is_mark = is_mark[runs]
+    num_frames = frame_ids[-1] + 1
+
+    # Quantize runs to slots with a per-frame fit for clock drift and mark stretching
+    num_slots, error, frame_slot, frame_bias = _fit_frames(
+        durations, is_mark, frame_ids, num_frames, slot_us, max_drift)
+    max_error = np.zeros(num_frames)
+    np.maximum.at(max_error, frame_ids, np.abs(error))
+    rms_error = np.sqrt(np.bincount(frame_ids, error * error, num_frames) /
+                        np.bincount(frame_ids, minlength=num_frames))
+    num_glitches = np.bincount(frame_ids, num_slots == 0, num_frames).astype(np.int64)
+
+    # Expand runs into a bit matrix, one frame per row
+    num_bits = np.bincount(frame_ids, num_slots, num_frames).astype(np.int64)
+    bit_frames = np.repeat(frame_ids, num_slots)
+    bit_offsets = np.arange(len(bit_frames)) - np.repeat(np.cumsum(num_bits) - num_bits, num_bits)
+    bit_values = np.repeat(is_mark, num_slots)
+    fits = bit_offsets < _MAX_FRAME_BITS
+    encoded_bits = np.zeros((num_frames, _MAX_FRAME_BITS), dtype=np.uint8)
+    encoded_bits[bit_frames[fits], bit_offsets[fits]] = bit_values[fits]
+    packed = np.packbits(encoded_bits, axis=1, bitorder='little')
+
+    first_run = np.searchsorted(frame_ids, np.arange(num_frames))
+    last_run = np.searchsorted(frame_ids, np.arange(num_frames), side='right') - 1
+    start_us = times_us[runs[first_run]]
+    end_us = times_us[runs[last_run] + 1]
+
+    frames = []
+    for i in range(num_frames):
+        if num_bits[i] > _MAX_FRAME_BITS:
+            frame_bits = np.repeat(is_mark[first_run[i]:last_run[i] + 1],
+                                   num_slots[first_run[i]:last_run[i] + 1]).astype(int).tolist()
+        else:
+            frame_bits = encoded_bits[i, :num_bits[i]].tolist()
+        encoded = frame_bits if num_bits[i] > _MAX_FRAME_BITS else packed[i].tobytes()
+        command = None
+        error = None
+        try:
+            command = Command.decode(encoded, verify_checksum=verify_checksum)
+        except CommandDecodeException as e:
+            error = str(e) or type(e).__name__
+        frames.append(DemodulatedFrame(
+            start_us=float(start_us[i]),
+            end_us=float(end_us[i]),
+            encoded_bits=frame_bits,
+            slot_us=float(frame_slot[i]),
+            bias_us=float(frame_bias[i]),
+            max_error=float(max_error[i]),
+            rms_error=float(rms_error[i]),
+            num_glitches=int(num_glitches[i]),
+            command=command,
+            error=error,
+        ))
+    return frames
@@ -0,0 +1,317 @@
+"""
+Model of the 88 used bytes of the PixMob EEPROM (see docs/eeprom.md) and the commands that
+change them.
+
+EepromImage.apply() updates an image the way a device would on receiving a command, and
+EepromImage.plan() returns the fewest commands that take a device from one known image to
+another, so that re-provisioning only sends what changed.
+"""
+from pixmob_ir_protocol import (
+    CommandDoReset,
+    CommandSetColor,
+    CommandSetConfig,
+    CommandSetGroupId,
+    CommandSetGroupSel,
+    CommandSetRepeatCount,
+    CommandSetRepeatDelayTime,
+    CommandSingleColorExt,
+    CommandView,
+    Time,
+)
+
+
+# Number of used EEPROM bytes
+EEPROM_SIZE = 88
+NUM_GROUP_SELS = 8
+NUM_PROFILES = 16
+
+# Value of EEPROM:on_start that enables the on-start effect
+ON_START_ENABLED = 0x11
+
+# Bits of cfg.mode
+CFG_MODE_RPEN       = 0x01
+CFG_MODE_DYNAMIC    = 0x02
+CFG_MODE_RANDOM     = 0x04
+CFG_MODE_NBGEN      = 0x10
+
+# Timer value in 16ms increments of each 3-bit Time key
+_TIME_VALUES = [0x00, 0x02, 0x06, 0x0C, 0x1E, 0x3C, 0x96, 0xF0]
+
+# Named fields of the image as (name, address, length)
+_LAYOUT = [
+    ('version',             0x00, 1),
+    ('group_sel',           0x01, 1),
+    ('repeat_delay',        0x02, 1),
+    ('repeat_count',        0x03, 1),
+    ('on_start',            0x04, 1),
+    ('unused',              0x05, 3),
+] + [
+    (f"group_sel_{i}_id",   0x08 + i, 1) for i in range(NUM_GROUP_SELS)
+] + [
+    (f"profile_{i}",        0x10 + 4 * i, 4) for i in range(NUM_PROFILES)
+] + [
+    ('cfg_rgb',             0x50, 3),
+    ('cfg_attack',          0x53, 1),
+    ('cfg_sustain',         0x54, 1),
+    ('cfg_release',         0x55, 1),
+    ('cfg_profile_range',   0x56, 1),
+    ('cfg_mode',            0x57, 1),
+]
+_FIELDS = {name: (address, length) for name, address, length in _LAYOUT}
+
+# Factory defaults by firmware version
+FACTORY_DEFAULTS = {
+    0x08: bytes([
+        0x09, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00,
+        0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01,
+        0x00, 0xBF, 0x00, 0xBF, 0x00, 0xBF, 0x60, 0x1F,
+        0x00, 0x60, 0xBF, 0x1F, 0x00, 0x00, 0xBF, 0xBF,
+        0xBF, 0x00, 0xBF, 0x7E, 0xBF, 0x00, 0x00, 0xBF,
+        0xBF, 0xBF, 0x00, 0x7E, 0x60, 0xBF, 0x00, 0x1F,
+    ] + [0x00] * 28 + [
+        0xBF, 0xBF, 0xBF, 0x3D, 0x00, 0x00, 0x00, 0x1E,
+        0x1E, 0x1E, 0x70, 0x06,
+    ]),
+    0x06: bytes([
+        0x07, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00,
+        0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01, 0x01,
+        0x00, 0xCC, 0x00, 0xCC, 0x00, 0xCC, 0x66, 0x32,
+        0x00, 0x66, 0xCC, 0x32, 0x00, 0x00, 0xCC, 0xCC,
+        0xCC, 0x00, 0xCC, 0x98, 0xCC, 0x00, 0x00, 0xCC,
+        0xCC, 0xCC, 0x00, 0x98, 0x66, 0xCC, 0x00, 0x32,
+    ] + [0x00] * 28 + [
+        0xCC, 0xCC, 0xCC, 0x64, 0x00, 0x00, 0x00, 0x1E,
+        0x1E, 0x1E, 0x70, 0x06,
+    ]),
+}
+
+
+class EepromImage:
+    """
+    The used bytes of one device's EEPROM, and the group id the device has cached from it.
+
+    data: 88 bytes (or a full 256-byte dump, of which the first 88 are used). Defaults to the
+          factory defaults of firmware version 0x08.
+    group_id: Cached group id of the device. Defaults to the id selected by group_sel, as read
+              at power-on.
+    """
+    def __init__(self, data=None, group_id=None):
+        data = FACTORY_DEFAULTS[0x08] if data is None else bytes(data)
+        if len(data) < EEPROM_SIZE:
+            raise ValueError(f"Expected at least {EEPROM_SIZE} bytes, got {len(data)}")
+        self.data = bytearray(data[:EEPROM_SIZE])
+        self.group_id = self.selected_group_id() if group_id is None else group_id
+
+    @classmethod
+    def factory(cls, firmware_version=0x08):
+        return cls(FACTORY_DEFAULTS[firmware_version])
+
+    def copy(self):
+        return type(self)(self.data, self.group_id)
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    def __eq__(self, other):
+        return isinstance(other, type(self)) and other.data == self.data
+
+    def __repr__(self):
+        data_str = ' '.join(f"{b:02X}" for b in self.data)
+        return f"{type(self).__name__}(group_id={self.group_id}, data={data_str})"
+
+    def __str__(self):
+        return self.__repr__()
+
+    # Fields
+
+    def get(self, name):
+        """
+        Return a named field (see docs/eeprom.md): an int for 1-byte fields, otherwise bytes.
+        """
+        address, length = _FIELDS[name]
+        if length == 1:
+            return self.data[address]
+        return bytes(self.data[address:address + length])
+
+    def selected_group_id(self) -> int:
+        return self.data[0x08 + (self.data[0x01] & 0b111)]
+
+    def profile_rgb(self, profile_id):
+        """
+        Return the (red, green, blue) color the device reads from a profile, which is black
+        when the profile checksum is invalid.
+        """
+        green, red, blue, checksum = self.get(f"profile_{profile_id}")
+        if (green + red + blue) & 0xFF != checksum:
+            return 0, 0, 0
+        return red, green, blue
+
+    def _set_profile(self, profile_id, red, green, blue):
+        address = 0x10 + 4 * profile_id
+        self.data[address:address + 4] = bytes([green, red, blue, (green + red + blue) & 0xFF])
+
+    def diff(self, other) -> dict:
+        """
+        Return the named fields that differ from another image, as {name: (ours, theirs)}.
+        """
+        return {name: (self.get(name), other.get(name)) for name, _, _ in _LAYOUT
+                if self.get(name) != other.get(name)}
+
+    # Commands
+
+    def apply(self, command) -> bool:
+        """
+        Apply a received command to the image. Returns whether the command was addressed to
+        this device; a chance field is treated as a hit.
+        """
+        if isinstance(command, CommandView):
+            command = command.to_command()
+        if not hasattr(command, '_field_values'):
+            return False
+        # Field values as received, with the low bits that are not sent on air cleared
+        fields = command._unpack(command._buffer)
+        group_id = fields.get('group_id', 0)
+        if group_id and group_id != self.group_id:
+            return False
+
+        # A command received without onstrt disables the on-start effect
+        if not fields.get('on_start', True) and self.data[0x04] == ON_START_ENABLED:
+            self.data[0x04] = 0x00
+
+        if isinstance(command, CommandSetColor):
+            if not fields['is_background']:
+                self._set_profile(fields['profile_id'], fields['red'], fields['green'], fields['blue'])
+        elif isinstance(command, CommandSetConfig):
+            if fields['on_start']:
+                self.data[0x53:0x58] = bytes(_config_bytes(fields))
+                self.data[0x04] = ON_START_ENABLED
+        elif isinstance(command, CommandSetGroupSel):
+            self.data[0x01] = fields['group_sel']
+            self.group_id = self.selected_group_id()
+        elif isinstance(command, CommandSetGroupId):
+            # The cached group id only changes with the next group sel
+            if fields['new_group_id'] != 0:
+                self.data[0x08 + fields['group_sel']] = fields['new_group_id']
+        elif isinstance(command, CommandSetRepeatDelayTime):
+            self.data[0x02] = _TIME_VALUES[int(fields['repeat_delay'])]
+        elif isinstance(command, CommandSetRepeatCount):
+            self.data[0x03] = fields['repeat_count']
+        elif isinstance(command, CommandDoReset):
+            if not fields['nreset']:
+                self.data[0x02] = 0
+                self.data[0x03] = 0
+        return True
+
+    def plan(self, target, group_id=0, allow_reset=False) -> list:
+        """
+        Return the fewest commands that change this image into target.
+
+        Commands other than CommandSetConfig are restricted to group_id, and a group change
+        is sent last so that it does not take the device out of that group early. Profile and
+        group commands skip their color display.
+
+        allow_reset: Clear repeat_delay and repeat_count together with a single
+                     CommandDoReset, which also turns the LEDs off and resets MCU state such
+                     as the background color and global sustain time.
+
+        Raises ValueError when target differs in a way no command can reach, such as the
+        version byte, cfg_rgb, or a profile with an invalid checksum.
+        """
+        differences = self.diff(target)
+        unreachable = {'version', 'unused', 'cfg_rgb'}.intersection(differences)
+        if unreachable:
+            raise ValueError(f"No command changes {', '.join(sorted(unreachable))}")
+
+        commands = []
+        repeat = {'repeat_delay', 'repeat_count'}
+        if allow_reset and repeat.issubset(differences) and \
+                target.data[0x02] == 0 and target.data[0x03] == 0:
+            commands.append(CommandDoReset(nreset=False, group_id=group_id))
+            repeat.clear()
+
+        if 'repeat_delay' in repeat and 'repeat_delay' in differences:
+            commands.append(CommandSetRepeatDelayTime(repeat_delay=_time_key(target, 'repeat_delay'),
+                                                      group_id=group_id))
+        if 'repeat_count' in repeat and 'repeat_count' in differences:
+            commands.append(CommandSetRepeatCount(repeat_count=target.data[0x03], group_id=group_id))
+
+        for group_sel in range(NUM_GROUP_SELS):
+            if f"group_sel_{group_sel}_id" in differences:
+                new_group_id = target.data[0x08 + group_sel]
+                if not 0 < new_group_id < 32:
+                    raise ValueError(f"Invalid group id {new_group_id} for group sel {group_sel}")
+                commands.append(CommandSetGroupId(group_sel=group_sel, new_group_id=new_group_id,
+                                                  skip_display=True, group_id=group_id))
+
+        for profile_id in range(NUM_PROFILES):
+            if f"profile_{profile_id}" in differences:
+                green, red, blue, checksum = target.get(f"profile_{profile_id}")
+                if (green + red + blue) & 0xFF != checksum or (green | red | blue) & 0b11:
+                    raise ValueError(f"Profile {profile_id} of target cannot be written by a command")
+                commands.append(CommandSetColor(red=red, green=green, blue=blue, profile_id=profile_id,
+                                                skip_display=True, group_id=group_id))
+
+        commands.extend(self._plan_on_start(target, differences, group_id))
+
+        if 'group_sel' in differences:
+            if target.data[0x01] >= NUM_GROUP_SELS:
+                raise ValueError(f"Invalid group sel {target.data[0x01]:#04x}")
+            commands.append(CommandSetGroupSel(group_sel=target.data[0x01], skip_display=True,
+                                               group_id=group_id))
+        return commands
+
+    def _plan_on_start(self, target, differences, group_id):
+        """
+        Return the commands for the cfg struct and on_start: a CommandSetConfig writes the cfg
+        and enables the on-start effect, and a command without onstrt disables it again.
+        """
+        cfg_names = {'cfg_attack', 'cfg_sustain', 'cfg_release', 'cfg_profile_range', 'cfg_mode'}
+        enabled = target.data[0x04] == ON_START_ENABLED
+        commands = []
+        if cfg_names.intersection(differences) or (enabled and 'on_start' in differences):
+            if group_id != 0:
+                raise ValueError("CommandSetConfig cannot be restricted to a group")
+            mode = target.data[0x57]
+            if mode & ~CFG_MODE_RANDOM != CFG_MODE_DYNAMIC:
+                raise ValueError(f"No command writes cfg mode {mode:#04x}")
+            commands.append(CommandSetConfig(
+                on_start=True,
+                gst_enable=True,
+                profile_id_lo=target.data[0x56] & 0x0F,
+                profile_id_hi=target.data[0x56] >> 4,
+                is_random=bool(mode & CFG_MODE_RANDOM),
+                attack=_time_key(target, 'cfg_attack'),
+                sustain=_time_key(target, 'cfg_sustain'),
+                release=_time_key(target, 'cfg_release'),
+            ))
+        if not enabled and (commands or 'on_start' in differences):
+            if target.data[0x04] != 0x00:
+                raise ValueError(f"No command writes on_start {target.data[0x04]:#04x}")
+            commands.append(CommandSingleColorExt(
+                on_start=False, red=0, green=0, blue=0,
+                attack=Time.TIME_0_MS, sustain=Time.TIME_0_MS, release=Time.TIME_32_MS,
+                group_id=group_id,
+            ))
+        return commands
+
+
+def _time_key(image, name):
+    value = image.get(name)
+    if value not in _TIME_VALUES:
+        raise ValueError(f"No time key for {name} {value:#04x}")
+    return Time(_TIME_VALUES.index(value))
+
+
+def _config_bytes(fields):
+    """
+    Return the attack, sustain, release, profile range and mode bytes that CommandSetConfig
+    stages into MCU:cfg0.
+    """
+    mode = CFG_MODE_DYNAMIC | (CFG_MODE_RANDOM if fields['is_random'] else 0)
+    return [
+        _TIME_VALUES[int(fields['attack'])],
+        _TIME_VALUES[int(fields['sustain'])],
+        _TIME_VALUES[int(fields['release'])],
+        (fields['profile_id_hi'] << 4) | fields['profile_id_lo'],
+        mode,
+    ]
@@ -1,5 +1,12 @@
+from __future__ import annotations
+
 import enum
+import os
 import sys
+import time
+from collections import OrderedDict
+from itertools import chain
+from types import MappingProxyType
 
 
 class Chance(enum.Enum):
@@ -85,9 +92,22 @@ class FieldKeyException(Exception):
 class FieldReadOnlyException(Exception):
     pass
 
-class CommandDecodeException(Exception):
+class FieldValueException(Exception):
     pass
 
+class CommandLayoutException(Exception):
+    pass
+
+class CommandDecodeException(Exception):
+    """
+    Raised when an IR sequence does not decode. reason is one of 'invalid_size',
+    'invalid_byte', 'checksum_mismatch', 'invalid_fields' or 'no_valid_command', for
+    counting failure modes.
+    """
+    def __init__(self, message, reason=None):
+        super().__init__(message)
+        self.reason = reason
+
 
 class GenericCommand:
     """
@@ -96,7 +116,13 @@ class GenericCommand:
     Used when a decoded command does not match any of our defined command classes.
     """
     def __init__(self, buffer):
-        self._buffer = buffer
+        object.__setattr__(self, '_buffer', tuple(buffer))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
 
     def __repr__(self):
         buffer_str = ' '.join(f"{b:02X}" for b in self._buffer)
@@ -109,9 +135,213 @@ class GenericCommand:
         return isinstance(other, type(self)) and \
             other._buffer == self._buffer
 
+    def __hash__(self):
+        return hash((type(self), self._buffer))
+
+
+class EncodeCache:
+    """
+    Bounded LRU cache of encoded IR sequences keyed by (command class, command buffer).
+
+    Counts hits and misses to help with sizing the cache. A maxsize of 0 disables caching.
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Return the cached value for key and mark it as recently used, or None on a miss.
+        """
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Add a value to the cache, evicting the least recently used entries beyond maxsize.
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+encode_cache = EncodeCache()
+
+
+class _Histogram:
+    """
+    Latency histogram with fixed upper bounds in seconds, cumulative as in Prometheus.
+    """
+    bounds = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 1e-2)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        i = 0
+        while i < len(self.bounds) and seconds > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def cumulative(self) -> list:
+        """
+        Return (upper bound, count of observations up to it), ending with infinity.
+        """
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class Metrics:
+    """
+    Counters and latency histograms for encoding and decoding, collected while installed
+    with enable_metrics().
+
+    Every call of Command.encode(), encode_packed() and encode_int() is counted per command
+    class, including calls answered from the encode caches. Decodes through Command.decode()
+    and decode_nearest() are counted per resulting class, with GenericCommand counting as a
+    fallback, and decode failures per CommandDecodeException reason ('invalid_fields' for
+    decoded fields rejected by the command class). Decoders that try frames speculatively,
+    such as pixmob_ir_stream.StreamDecoder, do not count their trials; see their own stats().
+
+    Sinks added with add_sink() are called as sink(event, name, seconds) for every event,
+    where event is 'encode', 'decode', 'decode_error' or 'generic', and name is the command
+    class name or the failure reason.
+    """
+    def __init__(self):
+        self.sinks = []
+        self.reset()
+
+    def reset(self):
+        self.encode_counts = {}
+        self.decode_counts = {}
+        self.decode_errors = {}
+        self.generic_fallbacks = 0
+        self.encode_latency = _Histogram()
+        self.decode_latency = _Histogram()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def _emit(self, event, name, seconds):
+        for sink in self.sinks:
+            sink(event, name, seconds)
+
+    def record_encode(self, class_name, seconds):
+        self.encode_counts[class_name] = self.encode_counts.get(class_name, 0) + 1
+        self.encode_latency.observe(seconds)
+        if self.sinks:
+            self._emit('encode', class_name, seconds)
+
+    def record_decode(self, class_name, seconds):
+        self.decode_counts[class_name] = self.decode_counts.get(class_name, 0) + 1
+        self.decode_latency.observe(seconds)
+        if class_name == GenericCommand.__name__:
+            self.generic_fallbacks += 1
+            if self.sinks:
+                self._emit('generic', class_name, seconds)
+        if self.sinks:
+            self._emit('decode', class_name, seconds)
+
+    def record_decode_error(self, reason, seconds):
+        self.decode_errors[reason] = self.decode_errors.get(reason, 0) + 1
+        self.decode_latency.observe(seconds)
+        if self.sinks:
+            self._emit('decode_error', reason, seconds)
+
+    def to_dict(self) -> dict:
+        def histogram(h):
+            return {'count': h.count, 'sum': h.sum,
+                    'buckets': {str(bound): count for bound, count in h.cumulative()}}
+        return {
+            'encode': dict(self.encode_counts),
+            'decode': dict(self.decode_counts),
+            'decode_errors': dict(self.decode_errors),
+            'generic_fallbacks': self.generic_fallbacks,
+            'encode_seconds': histogram(self.encode_latency),
+            'decode_seconds': histogram(self.decode_latency),
+            'encode_cache': encode_cache.info(),
+        }
+
+    def to_prometheus(self, prefix='pixmob_ir') -> str:
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        def counter(name, help_text, values, label):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for key, value in sorted(values.items()):
+                lines.append(f'{prefix}_{name}{{{label}="{key}"}} {value}')
+        def histogram(name, help_text, h):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for bound, count in h.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_{name}_bucket{{le="{le}"}} {count}')
+            lines.append(f"{prefix}_{name}_sum {h.sum!r}")
+            lines.append(f"{prefix}_{name}_count {h.count}")
+
+        counter('encode_total', "Commands encoded.", self.encode_counts, 'command')
+        counter('decode_total', "Commands decoded.", self.decode_counts, 'command')
+        counter('decode_errors_total', "Decode failures.", self.decode_errors, 'reason')
+        lines.append(f"# HELP {prefix}_decode_generic_total Decodes that fell back to GenericCommand.")
+        lines.append(f"# TYPE {prefix}_decode_generic_total counter")
+        lines.append(f"{prefix}_decode_generic_total {self.generic_fallbacks}")
+        histogram('encode_seconds', "Encode latency in seconds.", self.encode_latency)
+        histogram('decode_seconds', "Decode latency in seconds.", self.decode_latency)
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='pixmob_ir'):
+        """
+        Write to_prometheus() to a file, e.g. for the node exporter textfile collector. The
+        file is replaced atomically so that a scrape never reads a partial file.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+        os.replace(tmp_path, path)
+
 
 class Command:
     _commands = []
+    _command_index = {}
     _encoding_map = [
         0x21, 0x32, 0x54, 0x65, 0xa9, 0x9a, 0x6d, 0x29,
         0x56, 0x92, 0xa1, 0xb4, 0xb2, 0x84, 0x66, 0x2a,
@@ -123,8 +353,32 @@ class Command:
         0x36, 0xad, 0x94, 0xaa, 0x8d, 0x49, 0x99, 0x26,
     ]
     _decoding_map = { k: v for v, k in enumerate(_encoding_map) }
+    # Decoded value of every byte, None for bytes that are not in the encoding map
+    _decoding_table = list(map(_decoding_map.get, range(256)))
+    # IR bits of every byte, least significant bit first
+    _bit_table = [tuple((b >> i) & 0b1 for i in range(8)) for b in range(256)]
+    # Number of 1 bits of every byte
+    _bit_counts = [bin(b).count('1') for b in range(256)]
+    # Valid encoded bytes nearest to every byte, for decode_nearest(); see _neighbor_table()
+    _neighbor_table = None
+    # Translation of 0/1 bit values to ASCII digits for int(..., 2)
+    _bit_chars = bytes.maketrans(bytes(range(256)), b'0' + b'1' * 255)
+
+    # Field validations beyond the field types, as (description, check). A check takes the
+    # field values by name and returns whether they are valid, written with operators that
+    # work on single values as well as on NumPy columns of values, as in pixmob_ir_batch.
+    _field_checks = ()
+
+    # Encoded IR sequence, filled in on the first encode
+    _encoded = None
+    _encoded_bits = None
+    # Untrimmed encoded frame and sum of its encoded command bytes, kept for replace()
+    _frame = None
+    _encoded_sum = None
 
     def __init__(self, **field_values):
+        if '_buffer' in self.__dict__:
+            raise AttributeError(f"{type(self).__name__} is immutable")
         self._populate_fields(field_values)
         self._validate_fields()
         self._populate_buffer()
@@ -133,169 +387,448 @@ class Command:
         """
         Encode the command into IR string representation.
         """
-        encoded_bytes = list(self._buffer)
+        if self._encoded_bits is None:
+            packed = self._encode_packed()
+
+            # Separate bits into IR sequence, one precomputed LSB-first chunk per byte
+            encoded_bits = list(chain.from_iterable(map(Command._bit_table.__getitem__, packed)))
+
+            # Delete trailing 0's of the last byte
+            del encoded_bits[len(encoded_bits) - 8 + packed[-1].bit_length():]
+            object.__setattr__(self, '_encoded_bits', tuple(encoded_bits))
+
+        return list(self._encoded_bits)
+
+    def encode_int(self) -> int:
+        """
+        Encode the command into an IR sequence packed into an integer.
+
+        The first bit of the sequence is the least significant bit. The sequence length
+        is the bit length of the integer, since leading and trailing 0's are removed.
 
-        # Perform encoding and keep track of intermediate checksum
-        checksum = 0
-        for i in range(2, len(encoded_bytes)):
-            encoded_bytes[i] = Command._encoding_map[encoded_bytes[i]]
-            checksum += encoded_bytes[i]
+        Results are cached on the command and in the module-level encode_cache.
+        """
+        if self._encoded is None:
+            key = (type(self), self._buffer)
+            encoded = encode_cache.get(key)
+            if encoded is None:
+                encoded = self._encode_frame()
+                encode_cache.put(key, encoded)
+            object.__setattr__(self, '_encoded', encoded)
+        return self._encoded
+
+    def _encode_frame(self) -> int:
+        frame = self._frame
+        if frame is None:
+            # Perform encoding and calculate final checksum
+            encoded_bytes = [Command._encoding_map[b] for b in self._buffer[2:]]
+            encoded_sum = sum(encoded_bytes)
+            checksum = Command._encoding_map[(encoded_sum >> 2) & 0x3F]
+            frame = int.from_bytes(bytes([self._buffer[0], checksum, *encoded_bytes]), 'little')
+            object.__setattr__(self, '_frame', frame)
+            object.__setattr__(self, '_encoded_sum', encoded_sum)
+
+        # Drop leading 0's; trailing 0's are beyond the bit length of the frame
+        return frame >> (frame & -frame).bit_length() - 1
+
+    def encode_packed(self) -> bytes:
+        """
+        Encode the command into an IR sequence packed into bytes.
 
-        # Calculate final checksum, place into buffer
-        checksum = (checksum >> 2) & 0x3F
-        checksum = Command._encoding_map[checksum]
-        encoded_bytes[1] = checksum
+        The first bit of the sequence is the least significant bit of the first byte.
+        The last byte is padded with 0's.
+        """
+        frame = self._encode_int()
+        return frame.to_bytes((frame.bit_length() + 7) // 8, 'little')
 
-        # Separate bits into IR sequence
-        encoded_bits = []
-        for b in encoded_bytes:
-            for i in range(8):
-                # Don't insert leading 0's
-                if encoded_bits or b & 0b1:
-                    encoded_bits.append(b & 0b1)
-                b >>= 1
+    # Uninstrumented encoders for use within the class, so that enable_metrics() counts
+    # every public encode once
+    _encode_int = encode_int
+    _encode_packed = encode_packed
 
-        # Delete trailing 0's
-        while encoded_bits[-1] == 0:
-            encoded_bits.pop()
+    @classmethod
+    def encode_batch(cls, commands=None, **field_arrays):
+        """
+        Encode many commands of one class at once using NumPy.
 
-        return encoded_bits
+        See pixmob_ir_batch.encode_batch() for the accepted inputs and the return value.
+        """
+        import pixmob_ir_batch
+        return pixmob_ir_batch.encode_batch(cls, commands, **field_arrays)
 
     @staticmethod
-    def decode(encoded_bits: list[int], verify_checksum=True):
+    def decode(encoded_bits: list[int] | bytes | memoryview | int, verify_checksum=True,
+               lazy=False):
         """
         Decode an IR string and return the matching Command class.
 
+        encoded_bits: IR sequence as a list of bits, or packed as returned by encode_packed()
+                      (any bytes-like object) or encode_int(). Trailing 0's of a packed
+                      sequence are padding and do not count toward the command size.
         verify_checksum: Validate the checksum with the expected checksum. Fails if
                          there is a checksum mismatch.
+        lazy: Return a CommandView that extracts fields only when they are accessed,
+              instead of a Command. Field checks are deferred to CommandView.to_command().
         """
-        encoded_bytes = [0]
-        num_leading_zeroes = 0
-        for i, b in enumerate(encoded_bits):
-            # Skip leading 0's
-            if b == 0 and len(encoded_bytes) == 1 and encoded_bytes[0] == 0:
-                num_leading_zeroes += 1
-                continue
+        encoded_bytes = Command._read_frame(encoded_bits)
 
-            # Commands are stored starting at bit 7 of byte 0
-            bit_pos = i + 7 - num_leading_zeroes
-            byte_index = bit_pos // 8
-            while len(encoded_bytes) - 1 < byte_index:
-                encoded_bytes.append(0)
-            if b:
-                encoded_bytes[byte_index] |= 1 << (bit_pos % 8)
-
-        if len(encoded_bytes) not in [6, 9]:
-            raise CommandDecodeException(f"Invalid command size: {len(encoded_bytes)} ")
-
-        # Perform decoding and keep track of intermediate checksum starting from 3rd byte
-        checksum = 0
-        decoded_bytes = [0] * len(encoded_bytes)
-        decoded_bytes[0] = encoded_bytes[0]
-        for i, byte in enumerate(encoded_bytes[2:]):
-            checksum += byte
-            if byte not in Command._decoding_map:
-                raise CommandDecodeException(f"Invalid byte at offset {i + 2}: {byte:#04x}")
-            decoded_bytes[i + 2] = Command._decoding_map[byte]
+        # Perform decoding starting from 3rd byte
+        decoded_bytes = [encoded_bytes[0], 0]
+        decoded_bytes += map(Command._decoding_table.__getitem__, encoded_bytes[2:])
+        if None in decoded_bytes:
+            i = decoded_bytes.index(None)
+            raise CommandDecodeException(f"Invalid byte at offset {i}: {encoded_bytes[i]:#04x}",
+                                         reason='invalid_byte')
 
         # Verify the checksum is correct
-        expected_checksum = (checksum >> 2) & 0x3F
+        expected_checksum = (sum(encoded_bytes[2:]) >> 2) & 0x3F
         expected_checksum = Command._encoding_map[expected_checksum]
         if verify_checksum and encoded_bytes[1] != expected_checksum:
             raise CommandDecodeException(f"Checksum mismatch: " +
                 f"expected {expected_checksum:#04x}, " +
-                f"received {encoded_bytes[1]:#04x}")
-
-        # Try finding the matching command class
-        match_classes = []
-        for cls in Command._commands:
-            if cls._num_bytes != len(decoded_bytes) or \
-                    cls._flags_type != ((decoded_bytes[2] >> 1) & 0b111) or \
-                    (hasattr(cls, '_action_id') and cls._action_id != (decoded_bytes[7] & 0x1F)):
+                f"received {encoded_bytes[1]:#04x}", reason='checksum_mismatch')
+
+        return Command._from_decoded(decoded_bytes, lazy)
+
+    # Uninstrumented decode for decoders built on it, such as the speculative frame matching
+    # of pixmob_ir_stream, so that enable_metrics() only counts decodes asked for by callers
+    _decode = decode
+
+    @staticmethod
+    def decode_nearest(encoded_bits: list[int] | bytes | memoryview | int, max_distance=2,
+                       bit_error_rate=0.05):
+        """
+        Decode an IR string, correcting bit errors in the checksum and encoded bytes.
+
+        Returns the valid command whose encoded frame is the fewest bit flips away from the
+        received one, along with a confidence between 0 and 1. The confidence is the share
+        of that command among all valid commands within max_distance bit flips, each
+        weighted by the likelihood of its flips at the given bit_error_rate; frames whose
+        fields the command class rejects do not count. An error-free frame with no valid
+        neighbors has a confidence of 1.
+
+        Only bit flips are corrected; a frame with missing or extra bits still fails with
+        an invalid command size. Raises CommandDecodeException if no valid command is
+        within max_distance bit flips.
+        """
+        encoded_bytes = Command._read_frame(encoded_bits)
+        candidates = Command._nearest_frames(encoded_bytes, max_distance)
+
+        valid = []
+        for distance, data_bytes in sorted(candidates):
+            decoded_bytes = [encoded_bytes[0], 0]
+            decoded_bytes += map(Command._decoding_table.__getitem__, data_bytes)
+            try:
+                valid.append((distance, Command._from_decoded(decoded_bytes)))
+            except CommandDecodeException:
+                # Checksum matches, but the fields are not valid for the command
                 continue
-            match_classes.append(cls)
+        if not valid:
+            raise CommandDecodeException(f"No valid command within {max_distance} bit flips",
+                                         reason='no_valid_command')
 
-        if len(match_classes) == 0:
-            return GenericCommand(decoded_bytes)
-        elif len(match_classes) > 1:
-            raise CommandDecodeException(f"Multiple matching commands found: {match_classes}")
+        # Likelihood ratio of a frame d bit flips away to the frame as received
+        flip_odds = bit_error_rate / (1 - bit_error_rate)
+        total_weight = sum(flip_odds ** distance for distance, _ in valid)
+        distance, command = valid[0]
+        return command, flip_odds ** distance / total_weight
+
+    @staticmethod
+    def _nearest_frames(encoded_bytes, max_distance) -> list:
+        """
+        Find all frames with valid bytes and a matching checksum within max_distance bit flips.
+
+        Returns a list of (distance, encoded data bytes), starting from the 3rd byte.
+        """
+        neighbor_table = Command._neighbor_table
+        encoding_map = Command._encoding_map
+        bit_counts = Command._bit_counts
+        received_checksum = encoded_bytes[1]
+        received_bytes = encoded_bytes[2:]
+        candidates = []
+
+        def search(i, data_bytes, data_sum, distance):
+            if i == len(received_bytes):
+                checksum = encoding_map[(data_sum >> 2) & 0x3F]
+                distance += bit_counts[checksum ^ received_checksum]
+                if distance <= max_distance:
+                    candidates.append((distance, tuple(data_bytes)))
+                return
+            for byte_distance, b in neighbor_table[received_bytes[i]]:
+                if distance + byte_distance > max_distance:
+                    break
+                data_bytes.append(b)
+                search(i + 1, data_bytes, data_sum + b, distance + byte_distance)
+                data_bytes.pop()
+
+        search(0, [], 0, 0)
+        return candidates
+
+    @staticmethod
+    def _read_frame(encoded_bits) -> bytes:
+        """
+        Read an IR sequence into its encoded bytes, starting with the 0x80 magic byte.
+        """
+        # Read the IR sequence as an integer, first bit received being the LSB
+        if isinstance(encoded_bits, int):
+            frame = encoded_bits
+            num_bits = frame.bit_length()
+        elif isinstance(encoded_bits, (bytes, bytearray, memoryview)):
+            frame = int.from_bytes(encoded_bits, 'little')
+            num_bits = frame.bit_length()
+        else:
+            if not isinstance(encoded_bits, (list, tuple)):
+                # Any other sequence of bits, such as a NumPy row or a generator
+                encoded_bits = bytes(map(bool, encoded_bits))
+            frame = int(bytes(encoded_bits[::-1]).translate(Command._bit_chars) or b'0', 2)
+            num_bits = len(encoded_bits)
+
+        # Skip leading 0's; commands are stored starting at bit 7 of byte 0
+        if frame:
+            num_leading_zeroes = (frame & -frame).bit_length() - 1
         else:
-            cls = match_classes[0]
+            num_leading_zeroes = num_bits
+        num_bytes = (num_bits - num_leading_zeroes + 6) // 8 + 1
+        frame = (frame >> num_leading_zeroes) << 7
 
-        # Extract fields from decoded bytes based on command field definitions
-        field_values = {}
-        for field_name, field in cls._fields.items():
-            raw_field_value = 0
-            for fragment in field.fragments:
-                # Extract and mask the fragment from the decoded bytes
-                fragment_value = decoded_bytes[fragment.byte] >> fragment.offset
-                fragment_value &= (1 << fragment.width) - 1
-                # Add it to the field at the correct offset
-                raw_field_value |= fragment_value << fragment.src_offset
-            field_value = field.value_type(raw_field_value)
-            field_values[field_name] = field_value
+        if num_bytes not in [6, 9]:
+            raise CommandDecodeException(f"Invalid command size: {num_bytes} ", reason='invalid_size')
+        return frame.to_bytes(num_bytes, 'little')
+
+    @staticmethod
+    def _from_decoded(decoded_bytes, lazy=False):
+        """
+        Return the command (or a CommandView if lazy) for a decoded buffer, or a
+        GenericCommand if no class matches.
+        """
+        # Look up the matching command class, falling back to classes without an action id
+        flags_type = (decoded_bytes[2] >> 1) & 0b111
+        action_id = decoded_bytes[7] & 0x1F if len(decoded_bytes) == 9 else None
+        cls = Command._command_index.get((len(decoded_bytes), flags_type, action_id)) or \
+            Command._command_index.get((len(decoded_bytes), flags_type, None))
+        if cls is None:
+            return GenericCommand(decoded_bytes)
+        if lazy:
+            return CommandView(cls, decoded_bytes)
+        try:
+            return cls._from_buffer(decoded_bytes)
+        except (FieldReadOnlyException, FieldValueException) as e:
+            raise CommandDecodeException(f"Invalid fields for {cls.__name__}: {e}",
+                                         reason='invalid_fields') from e
+
+    @classmethod
+    def _from_buffer(cls, buffer, validate=True):
+        """
+        Trusted constructor for a command from its (decoded) buffer.
 
-        return cls(**field_values)
+        Field values are extracted with _unpack, so their types are not checked again and
+        the buffer is not packed again; bits outside of the header and fields are cleared.
+        With validate, read-only fields and the command's own field validations are checked.
+        """
+        command = cls.__new__(cls)
+        object.__setattr__(command, '_buffer', tuple(b & m for b, m in zip(buffer, cls._buffer_mask)))
+        object.__setattr__(command, '_field_values', MappingProxyType(cls._unpack(buffer)))
+        if validate:
+            for field_name, default in cls._read_only_fields.items():
+                if command._field_values[field_name] != default:
+                    raise FieldReadOnlyException(f"Field {field_name} may not be modified " +
+                        f"from the default value of {default}")
+            command._validate_fields()
+        return command
+
+
+    def replace(self, **changes):
+        """
+        Return a copy of the command with the given fields changed.
 
+        Only the changed fields are checked and only their fragments are rewritten in the
+        buffer. If this command was already encoded, the encoded frame and checksum of the
+        copy are patched from the changed bytes instead of being encoded from scratch.
+        """
+        cls = type(self)
+        for field_name, field_value in changes.items():
+            cls._check_field(field_name, field_value)
+        field_values = dict(self._field_values)
+        field_values.update(changes)
+
+        command = cls.__new__(cls)
+        object.__setattr__(command, '_field_values', MappingProxyType(field_values))
+        command._validate_fields()
+
+        # Rewrite the fragments of the changed fields
+        buffer = list(self._buffer)
+        for field_name, field_value in changes.items():
+            field_value = int(field_value)
+            for byte, keep_mask, src_offset, mask, offset in cls._field_fragments[field_name]:
+                buffer[byte] = (buffer[byte] & keep_mask) | (((field_value >> src_offset) & mask) << offset)
+        object.__setattr__(command, '_buffer', tuple(buffer))
+
+        # Patch the encoded frame with the changed encoded bytes and the new checksum
+        if self._frame is not None:
+            encoding_map = Command._encoding_map
+            frame = self._frame
+            encoded_sum = self._encoded_sum
+            for i in range(2, len(buffer)):
+                if buffer[i] != self._buffer[i]:
+                    old_byte = encoding_map[self._buffer[i]]
+                    new_byte = encoding_map[buffer[i]]
+                    encoded_sum += new_byte - old_byte
+                    frame ^= (old_byte ^ new_byte) << (8 * i)
+            old_checksum = encoding_map[(self._encoded_sum >> 2) & 0x3F]
+            new_checksum = encoding_map[(encoded_sum >> 2) & 0x3F]
+            frame ^= (old_checksum ^ new_checksum) << 8
+            object.__setattr__(command, '_frame', frame)
+            object.__setattr__(command, '_encoded_sum', encoded_sum)
+
+        return command
+
+    @classmethod
+    def _check_field(cls, field_name, field_value):
+        """
+        Check for an unexpected field, field type, or modification of a read-only field.
+        """
+        fields = cls._fields
+        if field_name not in fields:
+            raise FieldKeyException(f"Unexpected field: {field_name} = {field_value}")
+        field = fields[field_name]
+        if not isinstance(field_value, field.value_type):
+            raise FieldTypeException(f"Field {field_name} type mismatch: " +
+                f"expected {field.value_type.__name__}, " +
+                f"received {type(field_value).__name__} (value: {field_value})")
+        if field.read_only and field_value != field.default:
+            raise FieldReadOnlyException(f"Field {field_name} may not be modified " +
+                f"from the default value of {field.default}")
 
     def _populate_fields(self, field_values):
-        self._field_values = field_values
         fields = type(self)._fields
 
         # Check for unexpected fields, field types, and modification of read-only fields
-        for field_name, field_value in self._field_values.items():
-            if field_name not in fields:
-                raise FieldKeyException(f"Unexpected field: {field_name} = {field_value}")
-            field = fields[field_name]
-            if not isinstance(field_value, field.value_type):
-                raise FieldTypeException(f"Field {field_name} type mismatch: " +
-                    f"expected {field.value_type.__name__}, " +
-                    f"received {type(field_value).__name__} (value: {field_value})")
-            if field.read_only and field_value != field.default:
-                raise FieldReadOnlyException(f"Field {field_name} may not be modified " +
-                    f"from the default value of {field.default}")
+        for field_name, field_value in field_values.items():
+            type(self)._check_field(field_name, field_value)
 
         # Check for missing required fields
         # For missing fields with a default value defined, apply the default value
-        missing_fields = set(fields.keys()).difference(self._field_values.keys())
+        missing_fields = set(fields.keys()).difference(field_values.keys())
         for field_name in list(missing_fields):
             field = fields[field_name]
             if field.default is not None:
-                self._field_values[field_name] = field.default
+                field_values[field_name] = field.default
                 missing_fields.remove(field_name)
         if missing_fields:
             missing_fields = ", ".join(sorted(list(missing_fields)))
             raise FieldKeyException(f"Missing fields: {missing_fields}")
 
+        # Read-only view, so that the fields cannot get out of sync with the buffer
+        object.__setattr__(self, '_field_values', MappingProxyType(field_values))
+
     def _validate_fields(self):
         """
-        Allow commands to define additional field validations.
+        Run the command's _field_checks. Commands may override this for checks that cannot
+        be written as _field_checks.
         """
-        pass
+        for description, check in type(self)._field_checks:
+            if not check(self._field_values):
+                raise FieldValueException(f"Invalid field values: {description}")
 
     def _populate_buffer(self):
-        cls = type(self)
-        self._buffer = [0] * cls._num_bytes
+        object.__setattr__(self, '_buffer', type(self)._pack(self._field_values))
 
-        # Populate command type flags and magic values
-        self._buffer[0] = 0b10000000 # Magic value
-        self._buffer[2] = cls._flags_type << 1
-        if len(self._buffer) == 9 and hasattr(cls, '_action_id'):
-            self._buffer[7] = cls._action_id
+    @classmethod
+    def _compile_fields(cls):
+        """
+        Compile the field fragments into specialized _pack and _unpack functions.
 
-        # Add user-defined fields
-        for field_name, field in cls._fields.items():
-            field_value = int(self._field_values[field_name])
+        Each fragment becomes a fixed mask and shift, so packing and unpacking a command
+        does not need to walk the field definitions on every call. The per-field masks and
+        shifts are also kept in _field_fragments for patching single fields in replace(),
+        and every field gets its own getter in _field_getters for CommandView.
+        """
+        # Command type flags and magic values are constant for the class
+        header = [0] * cls._num_bytes
+        header[0] = 0b10000000 # Magic value
+        header[2] = cls._flags_type << 1
+        if len(header) == 9 and hasattr(cls, '_action_id'):
+            header[7] = cls._action_id
+
+        # Bits of each byte that belong to the header or a field
+        buffer_mask = [0] * cls._num_bytes
+        buffer_mask[0] = 0b10000000
+        buffer_mask[2] = 0b111 << 1
+        if len(header) == 9 and hasattr(cls, '_action_id'):
+            buffer_mask[7] = 0x1F
+
+        field_fragments = {}
+        namespace = {}
+        pack_values = []
+        byte_terms = [[f"{b:#04x}"] for b in header]
+        unpack_items = []
+        getter_defs = []
+        for i, (field_name, field) in enumerate(cls._fields.items()):
+            namespace[f"_type_{i}"] = field.value_type
+            pack_values.append(f"    v{i} = int(field_values[{field_name!r}])")
+            unpack_terms = []
+            field_fragments[field_name] = tuple(
+                (fragment.byte, ~(((1 << fragment.width) - 1) << fragment.offset) & 0xFF,
+                 fragment.src_offset, (1 << fragment.width) - 1, fragment.offset)
+                for fragment in field.fragments)
             for fragment in field.fragments:
-                # Extract and mask a portion of the field value
-                fragment_value = field_value >> fragment.src_offset
-                fragment_value &= (1 << fragment.width) - 1
-                # Now shift to proper place; to be ORed with command byte
-                fragment_value <<= fragment.offset
-                self._buffer[fragment.byte] |= fragment_value
+                mask = (1 << fragment.width) - 1
+                buffer_mask[fragment.byte] |= mask << fragment.offset
+                byte_terms[fragment.byte].append(
+                    f"(((v{i} >> {fragment.src_offset}) & {mask:#x}) << {fragment.offset})")
+                unpack_terms.append(
+                    f"(((b[{fragment.byte}] >> {fragment.offset}) & {mask:#x}) << {fragment.src_offset})")
+            unpack_items.append(f"        {field_name!r}: _type_{i}({' | '.join(unpack_terms)}),")
+            getter_defs.append(f"def _get_{i}(b):\n    return _type_{i}({' | '.join(unpack_terms)})")
+
+        pack_src = "\n".join([
+            "def _pack(field_values):",
+            *pack_values,
+            "    return (",
+            *(f"        {' | '.join(terms)}," for terms in byte_terms),
+            "    )",
+        ])
+        unpack_src = "\n".join([
+            "def _unpack(b):",
+            "    return {",
+            *unpack_items,
+            "    }",
+        ])
+        exec(compile("\n\n".join([pack_src, unpack_src, *getter_defs]), f"<{cls.__name__} fields>",
+                     "exec"), namespace)
+        cls._header = tuple(header)
+        cls._buffer_mask = tuple(buffer_mask)
+        cls._read_only_fields = {name: field.default for name, field in cls._fields.items()
+                                 if field.read_only}
+        cls._field_getters = {name: namespace[f"_get_{i}"] for i, name in enumerate(cls._fields)}
+        cls._field_fragments = field_fragments
+        cls._pack = staticmethod(namespace['_pack'])
+        cls._unpack = staticmethod(namespace['_unpack'])
+
+    @classmethod
+    def _register(cls):
+        """
+        Add the class to the decode index keyed by (length, flags type, action id).
+
+        Classes without an action id match any action id, so they may not share a length
+        and flags type with any other class.
+        """
+        action_id = getattr(cls, '_action_id', None)
+        key = (cls._num_bytes, cls._flags_type, action_id)
+        if action_id is None:
+            conflicts = [other for k, other in Command._command_index.items() if k[:2] == key[:2]]
+        else:
+            conflicts = [Command._command_index[k] for k in (key, key[:2] + (None,))
+                         if k in Command._command_index]
+        if conflicts:
+            raise CommandLayoutException(f"Command {cls.__name__} layout conflicts with: {conflicts}")
 
-    def __init_subclass__(cls):
         Command._commands.append(cls)
+        Command._command_index[key] = cls
+
+    def __init_subclass__(cls):
+        cls._register()
+        cls._compile_fields()
 
     def __repr__(self):
         cls = type(self)
@@ -311,6 +844,97 @@ class Command:
         return isinstance(other, type(self)) and \
             other._field_values == self._field_values
 
+    def __hash__(self):
+        return hash((type(self), self._buffer))
+
+    def __reduce__(self):
+        return _restore_command, (type(self), dict(self._field_values), self._buffer)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+def _restore_command(cls, field_values, buffer):
+    """
+    Rebuild a pickled command from its field values and buffer.
+    """
+    command = cls.__new__(cls)
+    object.__setattr__(command, '_field_values', MappingProxyType(field_values))
+    object.__setattr__(command, '_buffer', buffer)
+    return command
+
+
+def _neighbor_table(encoding_map) -> list:
+    """
+    Return the valid encoded bytes nearest to every byte, as (Hamming distance, encoded
+    byte) sorted by distance.
+    """
+    return [sorted((Command._bit_counts[b ^ e], e) for e in encoding_map) for b in range(256)]
+
+
+Command._neighbor_table = _neighbor_table(Command._encoding_map)
+
+
+class CommandView:
+    """
+    Read-only view over a decoded command buffer, returned by Command.decode(lazy=True).
+
+    Fields are extracted from the buffer when they are accessed, as attributes or with get().
+    The full Command is only built by to_command(), which also runs the field checks that
+    decode() would have run.
+    """
+    __slots__ = ('command_class', '_buffer', '_command')
+
+    def __init__(self, command_class, buffer):
+        object.__setattr__(self, 'command_class', command_class)
+        object.__setattr__(self, '_buffer', tuple(buffer))
+        object.__setattr__(self, '_command', None)
+
+    def get(self, field_name, default=None):
+        """
+        Return the value of a field, or default if the command class has no such field.
+        """
+        getter = self.command_class._field_getters.get(field_name)
+        return default if getter is None else getter(self._buffer)
+
+    def fields(self) -> dict:
+        return self.command_class._unpack(self._buffer)
+
+    def to_command(self):
+        """
+        Build the Command for this view. The result is kept for later calls.
+        """
+        if self._command is None:
+            object.__setattr__(self, '_command', self.command_class._from_buffer(self._buffer))
+        return self._command
+
+    def __getattr__(self, name):
+        getter = self.command_class._field_getters.get(name)
+        if getter is None:
+            raise AttributeError(f"{self.command_class.__name__} has no field {name!r}")
+        return getter(self._buffer)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __repr__(self):
+        buffer_str = ' '.join(f"{b:02X}" for b in self._buffer)
+        return f"{type(self).__name__}({self.command_class.__name__}, bytes={buffer_str})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+# The on-start effect needs the global sustain time
+_on_start_needs_gst_enable = ("on_start requires gst_enable",
+                              lambda f: (f['on_start'] == 0) | (f['gst_enable'] != 0))
+
 
 class CommandSingleColor(Command):
     _num_bytes  = 6
@@ -323,8 +947,7 @@ class CommandSingleColor(Command):
         'blue':             _Field([_FieldFragment(byte=5, offset=0, width=6, src_offset=2)], int),
     }
 
-    def _validate_fields(self):
-        if self._field_values['on_start']: assert self._field_values['gst_enable']
+    _field_checks = (_on_start_needs_gst_enable,)
 
 
 class CommandSingleColorExt(Command):
@@ -344,8 +967,7 @@ class CommandSingleColorExt(Command):
         'enable_repeat':    _Field([_FieldFragment(byte=8, offset=5, width=1)], bool, default=False),
     }
 
-    def _validate_fields(self):
-        if self._field_values['on_start']: assert self._field_values['gst_enable']
+    _field_checks = (_on_start_needs_gst_enable,)
 
 
 class CommandTwoColors(Command):
@@ -378,8 +1000,7 @@ class CommandSetConfig(Command):
         'release':          _Field([_FieldFragment(byte=5, offset=3, width=3)], Time, default=Time.TIME_480_MS),
     }
 
-    def _validate_fields(self):
-        if self._field_values['on_start']: assert self._field_values['gst_enable']
+    _field_checks = (_on_start_needs_gst_enable,)
 
 
 class CommandSetColor(Command):
@@ -433,9 +1054,10 @@ class CommandSetGroupId(Command):
         'group_id':         _Field([_FieldFragment(byte=8, offset=0, width=5)], int, default=0),
     }
 
-    def _validate_fields(self):
+    _field_checks = (
         # Group ID needs to be 1 or higher
-        assert self._field_values['new_group_id'] > 0
+        ("new_group_id must be 1 or higher", lambda f: f['new_group_id'] > 0),
+    )
 
 
 class CommandSetRepeatDelayTime(Command):
@@ -462,8 +1084,9 @@ class CommandSetRepeatCount(Command):
         'group_id':         _Field([_FieldFragment(byte=8, offset=0, width=5)], int, default=0),
     }
 
-    def _validate_fields(self):
-        assert self._field_values['repeat_count'] <= 255 # Max value that fits into 1 byte
+    _field_checks = (
+        ("repeat_count must fit into 1 byte", lambda f: f['repeat_count'] <= 255),
+    )
 
 
 class CommandSetGlobalSustainTime(Command):
@@ -503,3 +1126,87 @@ class CommandDoReset(Command):
         'nreset':           _Field([_FieldFragment(byte=6, offset=5, width=1)], bool),
         'group_id':         _Field([_FieldFragment(byte=8, offset=0, width=5)], int, default=0),
     }
+
+
+# Metrics installed by enable_metrics(), or None. Without metrics, encoding and decoding run
+# the original, uninstrumented methods.
+metrics = None
+_uninstrumented = {}
+
+
+# Public encoders of Command counted by the metrics
+_ENCODERS = ('encode', 'encode_packed', 'encode_int')
+
+
+def _instrumented_encoder(encoder):
+    def instrumented(self):
+        start = time.perf_counter()
+        encoded = encoder(self)
+        metrics.record_encode(type(self).__name__, time.perf_counter() - start)
+        return encoded
+    instrumented.__name__ = encoder.__name__
+    instrumented.__doc__ = encoder.__doc__
+    return instrumented
+
+
+def _instrumented_decode(encoded_bits, verify_checksum=True, lazy=False):
+    start = time.perf_counter()
+    try:
+        command = _uninstrumented['decode'](encoded_bits, verify_checksum, lazy)
+    except CommandDecodeException as e:
+        metrics.record_decode_error(e.reason or 'other', time.perf_counter() - start)
+        raise
+    cls = command.command_class if isinstance(command, CommandView) else type(command)
+    metrics.record_decode(cls.__name__, time.perf_counter() - start)
+    return command
+
+
+def _instrumented_decode_nearest(encoded_bits, max_distance=2, bit_error_rate=0.05):
+    start = time.perf_counter()
+    try:
+        command, confidence = _uninstrumented['decode_nearest'](encoded_bits, max_distance,
+                                                                bit_error_rate)
+    except CommandDecodeException as e:
+        metrics.record_decode_error(e.reason or 'other', time.perf_counter() - start)
+        raise
+    metrics.record_decode(type(command).__name__, time.perf_counter() - start)
+    return command, confidence
+
+
+def enable_metrics(new_metrics=None) -> Metrics:
+    """
+    Start collecting metrics into new_metrics (or a new Metrics) and return it.
+    """
+    global metrics
+    metrics = new_metrics or Metrics()
+    if not _uninstrumented:
+        for name in _ENCODERS:
+            _uninstrumented[name] = getattr(Command, name)
+            setattr(Command, name, _instrumented_encoder(_uninstrumented[name]))
+        _uninstrumented['decode'] = Command.decode
+        _uninstrumented['decode_nearest'] = Command.decode_nearest
+        Command.decode = staticmethod(_instrumented_decode)
+        Command.decode_nearest = staticmethod(_instrumented_decode_nearest)
+    return metrics
+
+
+def disable_metrics():
+    """
+    Stop collecting metrics and restore the uninstrumented methods.
+    """
+    global metrics
+    if _uninstrumented:
+        for name in _ENCODERS:
+            setattr(Command, name, _uninstrumented.pop(name))
+        Command.decode = staticmethod(_uninstrumented.pop('decode'))
+        Command.decode_nearest = staticmethod(_uninstrumented.pop('decode_nearest'))
+    metrics = None
+
+
+if __name__ == '__main__':
+    # Serve JSONL encode/decode requests; see pixmob_ir_service.py. Register this module
+    # under its own name first, so that the service imports it instead of a second copy of
+    # every class.
+    sys.modules['pixmob_ir_protocol'] = sys.modules[__name__]
+    from pixmob_ir_service import main
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""
+Conversion of encoded PixMob IR commands into mark/space pulse trains for IR transmitters.
+
+A pulse train is an array('H') of durations in microseconds, alternating between a mark
+(38 kHz carrier on) and a space (carrier off), starting with a mark. Each bit of an
+encoded command occupies one time slot of ~700 microseconds.
+"""
+from array import array
+
+from pixmob_ir_protocol import Command
+
+
+# Width of one IR bit time slot in microseconds
+SLOT_US = 700
+# IR carrier frequency in hertz
+CARRIER_HZ = 38000
+# Idle time between frames in microseconds. The longest run of 0's within a frame is 4 slots.
+FRAME_GAP_US = 10 * SLOT_US
+
+# Longest duration that fits into one array('H') entry
+_MAX_DURATION_US = 0xFFFF
+
+
+class PulseTrainConfig:
+    """
+    Timing of a pulse train: slot width, carrier frequency, and idle gap between frames.
+
+    When align_to_carrier is set, mark durations are rounded to a whole number of carrier
+    periods, since a transmitter can only emit complete carrier cycles.
+    """
+    def __init__(self, slot_us=SLOT_US, carrier_hz=CARRIER_HZ, gap_us=FRAME_GAP_US,
+                 align_to_carrier=False):
+        self.slot_us = slot_us
+        self.carrier_hz = carrier_hz
+        self.gap_us = gap_us
+        self.align_to_carrier = align_to_carrier
+
+    def mark_us(self, num_slots) -> int:
+        duration = num_slots * self.slot_us
+        if self.align_to_carrier:
+            period_us = 1e6 / self.carrier_hz
+            duration = round(duration / period_us) * period_us
+        return round(duration)
+
+    def space_us(self, num_slots) -> int:
+        return round(num_slots * self.slot_us)
+
+    def airtime_us(self, num_bits) -> int:
+        """
+        Time needed to transmit a frame of num_bits bits followed by the idle gap.
+        """
+        return round(num_bits * self.slot_us + self.gap_us)
+
+
+DEFAULT_CONFIG = PulseTrainConfig()
+
+
+def _packed_sequence(encoded) -> int:
+    """
+    Return an IR sequence packed into an integer, first bit being the LSB.
+
+    Accepts a Command, a list of bits, or a packed sequence (int or bytes-like).
+    """
+    if isinstance(encoded, Command):
+        return encoded.encode_int()
+    if isinstance(encoded, int):
+        return encoded
+    if isinstance(encoded, (bytes, bytearray, memoryview)):
+        return int.from_bytes(encoded, 'little')
+    return sum(1 << i for i, b in enumerate(encoded) if b)
+
+
+def _append_duration(pulses, duration):
+    """
+    Append a duration, splitting durations that do not fit into 16 bits with 0-length
+    entries of the opposite kind so that marks and spaces keep alternating.
+    """
+    while duration > _MAX_DURATION_US:
+        pulses.append(_MAX_DURATION_US)
+        pulses.append(0)
+        duration -= _MAX_DURATION_US
+    pulses.append(duration)
+
+
+def frame_pulses(encoded, config=DEFAULT_CONFIG) -> array:
+    """
+    Convert one encoded command into mark/space durations, starting and ending with a mark.
+
+    Leading and trailing 0's of the IR sequence are not part of the pulse train.
+    """
+    sequence = _packed_sequence(encoded)
+    if sequence:
+        sequence >>= (sequence & -sequence).bit_length() - 1
+    pulses = array('H')
+    while sequence:
+        # Run of 1's is a mark
+        num_ones = (~sequence & (sequence + 1)).bit_length() - 1
+        _append_duration(pulses, config.mark_us(num_ones))
+        sequence >>= num_ones
+        if not sequence:
+            break
+        # Run of 0's is a space
+        num_zeroes = (sequence & -sequence).bit_length() - 1
+        _append_duration(pulses, config.space_us(num_zeroes))
+        sequence >>= num_zeroes
+    return pulses
+
+
+def iter_pulses(commands, config=DEFAULT_CONFIG):
+    """
+    Generate one pulse train chunk per command for a stream of commands.
+
+    Each chunk ends with the idle gap as a space, so chunks can be played back to back.
+    """
+    for command in commands:
+        pulses = frame_pulses(command, config)
+        if pulses:
+            _append_duration(pulses, config.gap_us)
+        yield pulses
+
+
+def pulse_train(commands, config=DEFAULT_CONFIG) -> array:
+    """
+    Convert a sequence of commands into a single pulse train with idle gaps between frames.
+    """
+    pulses = array('H')
+    for chunk in iter_pulses(commands, config):
+        pulses.extend(chunk)
+    return pulses
+
+
+def pulses_to_bits(pulses, config=DEFAULT_CONFIG) -> list[int]:
+    """
+    Convert a single-frame pulse train back into a list of bits, rounding to whole slots.
+    """
+    encoded_bits = []
+    for i, duration in enumerate(pulses):
+        encoded_bits += [1 - i % 2] * round(duration / config.slot_us)
+    while encoded_bits and encoded_bits[-1] == 0:
+        encoded_bits.pop()
+    return encoded_bits
@@ -0,0 +1,202 @@
+"""
+Parallel rendering of large cue libraries into packed IR frames.
+
+A library is a function that builds a Cue (see pixmob_ir_show.py) from a parameter, and the
+list of parameters to build. Cues are sharded across a ProcessPoolExecutor, where workers
+build and encode the commands and send back only packed frames, which are much cheaper to
+pickle than Command objects. Results are merged in parameter order, so a render is the same
+whatever the number of workers. Cues are keyed by a hash of their content, the class and
+buffer of every command, so a cue found in the cache of a previous render is not encoded or
+sent back again, whatever changed in the builder or the data it reads.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from pixmob_ir_protocol import CommandView
+from pixmob_ir_showfile import ShowFileWriter
+
+
+class RenderedCue:
+    """
+    Encoded cue: its time, name and frames, each a (packed IR sequence, number of bits,
+    command class name, group id) tuple as taken by ShowFileWriter.add_packed(). key is the
+    content hash of the cue from cue_key().
+    """
+    __slots__ = ('time_s', 'name', 'frames', 'key')
+
+    def __init__(self, time_s, name, frames, key=None):
+        self.time_s = time_s
+        self.name = name
+        self.frames = frames
+        self.key = key
+
+    def __repr__(self):
+        name = f"{self.name!r}, " if self.name is not None else ""
+        return f"{type(self).__name__}({name}time_s={self.time_s}, frames={len(self.frames)})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class RenderCache:
+    """
+    Rendered cues by content hash, optionally kept in a JSON file between renders.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._entries = {bytes.fromhex(key): _entry_from_json(entry)
+                                 for key, entry in json.load(f).items()}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return RenderedCue(*entry, key=key)
+
+    def put(self, key, rendered):
+        self._entries[key] = (rendered.time_s, rendered.name, rendered.frames)
+
+    def prune(self, keys):
+        """
+        Drop every entry whose key is not in keys, e.g. the keys of the cues of the latest
+        render.
+        """
+        keys = set(keys)
+        self._entries = {key: entry for key, entry in self._entries.items() if key in keys}
+
+    def save(self):
+        if self.path is not None:
+            with open(self.path, 'w') as f:
+                json.dump({key.hex(): _entry_to_json(entry) for key, entry in self._entries.items()}, f)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _entry_to_json(entry):
+    time_s, name, frames = entry
+    return {
+        'time_s': time_s,
+        'name': name,
+        'frames': [[packed.hex(), num_bits, class_name, group_id]
+                   for packed, num_bits, class_name, group_id in frames],
+    }
+
+
+def _entry_from_json(entry):
+    frames = [(bytes.fromhex(packed), num_bits, class_name, group_id)
+              for packed, num_bits, class_name, group_id in entry['frames']]
+    return entry['time_s'], entry['name'], frames
+
+
+def cue_key(cue) -> bytes:
+    """
+    Return the content hash of a cue: its time, name, and the class and buffer of every
+    command.
+    """
+    h = hashlib.blake2b(repr((cue.time_s, cue.name)).encode(), digest_size=16)
+    for command in cue.commands:
+        cls = command.command_class if isinstance(command, CommandView) else type(command)
+        h.update(cls.__name__.encode())
+        h.update(bytes(command._buffer))
+    return h.digest()
+
+
+def render_cue(cue) -> RenderedCue:
+    """
+    Encode the commands of a Cue into packed frames.
+    """
+    frames = []
+    for command in cue.commands:
+        if isinstance(command, CommandView):
+            command = command.to_command()
+        frame = command.encode_int()
+        packed = frame.to_bytes((frame.bit_length() + 7) // 8, 'little')
+        group_id = getattr(command, '_field_values', {}).get('group_id', 0)
+        frames.append((packed, frame.bit_length(), type(command).__name__, group_id))
+    return RenderedCue(cue.time_s, cue.name, frames, cue_key(cue))
+
+
+# Keys of the cues already in the cache, set once per worker process
+_cached_keys = frozenset()
+
+
+def _set_cached_keys(keys):
+    global _cached_keys
+    _cached_keys = keys
+
+
+def _render_shard(make_cue, params, cached_keys=None):
+    cached_keys = _cached_keys if cached_keys is None else cached_keys
+    results = []
+    for param in params:
+        cue = make_cue(param)
+        key = cue_key(cue)
+        if key in cached_keys:
+            # Only the key goes back; the cached frames are used
+            results.append((key, None))
+        else:
+            rendered = render_cue(cue)
+            results.append((key, (rendered.time_s, rendered.name, rendered.frames)))
+    return results
+
+
+def render_library(make_cue, params, max_workers=None, cache=None, shard_size=None) -> list:
+    """
+    Build and encode the cue of every parameter, returning a RenderedCue per parameter in
+    the same order.
+
+    make_cue: Function of one parameter returning a Cue. It must be picklable (defined at
+              module level), as must the parameters.
+    max_workers: Worker processes; defaults to the number of CPUs. 0 renders in this
+                 process, which helps with debugging.
+    cache: RenderCache of earlier renders. Cues are still built, but those whose content is
+           found there are not encoded again, and newly rendered cues are added to it.
+    shard_size: Cues per worker task. Defaults to an even split into 4 tasks per worker,
+                which balances uneven cues without much scheduling overhead.
+    """
+    params = list(params)
+    cached_keys = frozenset(cache._entries) if cache is not None else frozenset()
+
+    if max_workers == 0:
+        results = _render_shard(make_cue, params, cached_keys)
+    else:
+        max_workers = max_workers or os.cpu_count() or 1
+        shard_size = shard_size or max(1, -(-len(params) // (4 * max_workers)))
+        shards = [params[i:i + shard_size] for i in range(0, len(params), shard_size)]
+        with ProcessPoolExecutor(max_workers, initializer=_set_cached_keys,
+                                 initargs=(cached_keys,)) as executor:
+            futures = [executor.submit(_render_shard, make_cue, shard) for shard in shards]
+            results = [result for future in futures for result in future.result()]
+
+    rendered = []
+    for key, entry in results:
+        cached = cache.get(key) if cache is not None else None
+        if cached is None:
+            cached = RenderedCue(*entry, key=key)
+            if cache is not None:
+                cache.put(key, cached)
+        rendered.append(cached)
+    return rendered
+
+
+def write_show_file(rendered, path):
+    """
+    Write rendered cues to a show file, every frame of a cue at the cue time, in cue order.
+    """
+    with ShowFileWriter(path) as writer:
+        for cue in rendered:
+            for frame in cue.frames:
+                writer.add_packed(cue.time_s, *frame)
@@ -0,0 +1,285 @@
+"""
+Asyncio transmit scheduler for PixMob commands.
+
+Commands are queued by priority and sent one at a time, each followed by its actual airtime
+(bit count x slot width plus the idle gap between frames), so the transport is never asked
+to send faster than the IR link can carry. A queued command that sets some state is
+superseded by a newer command that sets the same state, since only the newest value matters
+once it is sent: display commands by class and group_id, and stored settings by class and
+the fields that address them, such as the profile_id of CommandSetColor. The newer command
+takes the queue position of the one it supersedes, so commands queued in between, such as
+a CommandSetConfig playing a profile, still see the new value. Actions such as
+CommandDoReset are never superseded.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+
+from pixmob_ir_protocol import (
+    CommandSetColor,
+    CommandSetConfig,
+    CommandSetGlobalSustainTime,
+    CommandSetGroupId,
+    CommandSetGroupSel,
+    CommandSetRepeatCount,
+    CommandSetRepeatDelayTime,
+    CommandSingleColor,
+    CommandSingleColorExt,
+    CommandTwoColors,
+)
+from pixmob_ir_pulse import DEFAULT_CONFIG
+
+
+# Fields that address the state a command sets, for the command classes whose newest command
+# replaces the state set by older ones. Commands of other classes are never superseded.
+COALESCE_FIELDS = {
+    # Display commands: the newest color is what stays on
+    CommandSingleColor:             (),
+    CommandSingleColorExt:          ('group_id',),
+    CommandTwoColors:               (),
+    # Stored settings: one value per address
+    CommandSetColor:                ('group_id', 'profile_id', 'is_background'),
+    CommandSetConfig:               (),
+    CommandSetGroupSel:             ('group_id',),
+    CommandSetGroupId:              ('group_id', 'group_sel'),
+    CommandSetRepeatDelayTime:      ('group_id',),
+    CommandSetRepeatCount:          ('group_id',),
+    CommandSetGlobalSustainTime:    ('group_id',),
+}
+
+
+class Transport:
+    """
+    Interface for sending encoded frames, e.g. to a serial IR sender.
+    """
+    async def send(self, encoded_bits: list[int]):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class StreamTransport(Transport):
+    """
+    Write each frame as one line of '0'/'1' characters to a file-like object, such as an
+    open serial port or pty.
+
+    Writes run in the default executor, so a slow port does not block the event loop.
+    format_frame may be set to change the line format.
+    """
+    def __init__(self, stream, format_frame=None):
+        self.stream = stream
+        self.format_frame = format_frame or (lambda encoded_bits:
+                                             ''.join(map(str, encoded_bits)).encode() + b'\n')
+
+    def _write(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+    async def send(self, encoded_bits):
+        await asyncio.get_running_loop().run_in_executor(None, self._write,
+                                                         self.format_frame(encoded_bits))
+
+    async def close(self):
+        self.stream.close()
+
+
+class MemoryTransport(Transport):
+    """
+    In-memory fake transport that records (monotonic time, encoded bits) for every frame.
+    """
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, encoded_bits):
+        self.frames.append((time.monotonic(), encoded_bits))
+
+
+class _Cue:
+    """
+    Queued command with its queue order (negated priority, sequence number), its submit
+    time and a future that resolves once it is sent.
+    """
+    __slots__ = ('command', 'key', 'order', 'submit_time', 'future')
+
+    def __init__(self, command, key, order, submit_time, future):
+        self.command = command
+        self.key = key
+        self.order = order
+        self.submit_time = submit_time
+        self.future = future
+
+
+class TransmitScheduler:
+    """
+    Priority queue of commands sent through a transport, paced by frame airtime.
+
+    config: PulseTrainConfig giving the slot width and inter-frame gap for airtime.
+    latency_window: Number of recent cue latencies kept for latency_stats().
+    """
+    def __init__(self, transport, config=DEFAULT_CONFIG, latency_window=1024):
+        self.transport = transport
+        self.config = config
+        self._queue = []
+        self._pending = {}
+        self._counter = itertools.count()
+        self._num_queued = 0
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        # Time at which the frame on air finishes, including the idle gap after it
+        self._air_free_time = 0.0
+        self._latencies = deque(maxlen=latency_window)
+        self.num_submitted = 0
+        self.num_sent = 0
+        self.num_superseded = 0
+
+    @staticmethod
+    def coalesce_key(command):
+        """
+        Return the key under which newer commands supersede queued ones: the command class
+        and the values of its COALESCE_FIELDS, or None if the command is never superseded.
+        """
+        fields = COALESCE_FIELDS.get(type(command))
+        if fields is None:
+            return None
+        return (type(command), *(command._field_values[name] for name in fields))
+
+    def submit(self, command, priority=0, coalesce=True) -> asyncio.Future:
+        """
+        Queue a command for transmission. Higher priorities are sent first; commands with
+        equal priority are sent in submit order.
+
+        coalesce: Replace a queued command with the same coalesce_key(), if it has one.
+                  The new command takes the priority and position of the replaced one,
+                  whose future resolves to False.
+
+        Returns a future that resolves to True once the command has been sent.
+        """
+        loop = asyncio.get_running_loop()
+        key = self.coalesce_key(command) if coalesce else None
+        self.num_submitted += 1
+        previous = self._pending.get(key) if key is not None else None
+        if previous is not None:
+            # Take over the queued cue, keeping its place in the queue
+            if not previous.future.done():
+                previous.future.set_result(False)
+            previous.command = command
+            previous.submit_time = loop.time()
+            previous.future = loop.create_future()
+            self.num_superseded += 1
+            return previous.future
+
+        cue = _Cue(command, key, (-priority, next(self._counter)), loop.time(), loop.create_future())
+        self._push(cue)
+        self._idle.clear()
+        self._wakeup.set()
+        return cue.future
+
+    def start(self):
+        """
+        Start sending queued commands in a background task.
+        """
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self.run())
+        return self._task
+
+    async def stop(self):
+        """
+        Stop the background task. Queued commands stay queued, including a command that was
+        about to be sent.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def drain(self):
+        """
+        Wait until every queued command has been sent or superseded. The scheduler must be
+        running.
+        """
+        await self._idle.wait()
+
+    async def run(self):
+        """
+        Send queued commands until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            cue = self._pop()
+            if cue is None:
+                self._idle.set()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Wait for the previous frame to finish, then send and hold the air for this one
+            encoded = cue.command.encode()
+            try:
+                delay = self._air_free_time - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.transport.send(encoded)
+            except asyncio.CancelledError:
+                self._requeue(cue)
+                raise
+            self._air_free_time = loop.time() + self.config.airtime_us(len(encoded)) / 1e6
+
+            self.num_sent += 1
+            self._latencies.append(self._air_free_time - self.config.gap_us / 1e6 - cue.submit_time)
+            if not cue.future.done():
+                cue.future.set_result(True)
+
+    def _push(self, cue):
+        heapq.heappush(self._queue, (*cue.order, cue))
+        if cue.key is not None:
+            self._pending.setdefault(cue.key, cue)
+        self._num_queued += 1
+
+    def _pop(self):
+        if not self._queue:
+            return None
+        cue = heapq.heappop(self._queue)[2]
+        if cue.key is not None and self._pending.get(cue.key) is cue:
+            del self._pending[cue.key]
+        self._num_queued -= 1
+        return cue
+
+    def _requeue(self, cue):
+        """
+        Put back a cue whose send was cancelled, at its place in the queue. A newer command
+        with the same key queued since stays queued after it, as it was submitted later.
+        """
+        self._push(cue)
+        self._idle.clear()
+
+    def queue_size(self) -> int:
+        return self._num_queued
+
+    def latency_stats(self) -> dict:
+        """
+        Return statistics of the recent cue latencies in seconds, from submit() until the
+        last bit of the frame is on air.
+        """
+        latencies = sorted(self._latencies)
+        stats = {
+            'submitted': self.num_submitted,
+            'sent': self.num_sent,
+            'superseded': self.num_superseded,
+            'count': len(latencies),
+        }
+        if latencies:
+            stats.update({
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+                'max': latencies[-1],
+            })
+        return stats
@@ -0,0 +1,197 @@
+"""
+Long-running JSONL filter that encodes and decodes PixMob IR commands, for tools that would
+otherwise start a Python process per command. Run it as:
+
+    python -m pixmob_ir_protocol [--format bits|hex|int] [--stats]
+
+Each line of stdin is one JSON request, and each request gets one JSON line on stdout, in
+the same order. Requests are read in whatever batches arrive and the results of a batch are
+flushed together, so a busy pipe is served in large batches and an interactive caller gets
+every answer straight away.
+
+Encode requests name a command class (with or without the "Command" prefix) and its fields.
+Enum fields take member names or integer values:
+
+    {"id": 1, "command": "SingleColor", "fields": {"red": 252, "green": 0, "blue": 0}}
+    -> {"id": 1, "ok": true, "bits": [1, 0, 0, ...]}
+
+Decode requests give the IR sequence as a list of bits, as packed hex from
+encode_packed().hex(), or as an integer from encode_int():
+
+    {"id": 2, "hex": "0101..."}
+    -> {"id": 2, "ok": true, "command": "CommandSingleColor", "fields": {...}, "bytes": "80..."}
+
+A request that fails gets {"id": ..., "ok": false, "error": "..."} and processing goes on.
+The "id" of a request, if any, is copied to its result.
+"""
+import argparse
+import enum
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+from pixmob_ir_protocol import Command, GenericCommand
+
+
+_classes = {cls.__name__: cls for cls in set(Command._command_index.values())}
+_classes.update({name[len('Command'):]: cls for name, cls in list(_classes.items())})
+
+_FORMATS = ('bits', 'hex', 'int')
+
+
+class RequestException(Exception):
+    pass
+
+
+def _field_value(cls, name, value):
+    field = cls._fields.get(name)
+    if field is None:
+        # Let the command constructor report the unexpected field
+        return value
+    if issubclass(field.value_type, enum.Enum):
+        if isinstance(value, str):
+            try:
+                return field.value_type[value]
+            except KeyError:
+                raise RequestException(f"Invalid {field.value_type.__name__} for {name}: {value}") from None
+        return field.value_type(value)
+    return value
+
+
+def _json_value(value):
+    return value.name if isinstance(value, enum.Enum) else value
+
+
+def encode_request(request, default_format='bits') -> dict:
+    cls = _classes.get(request['command'])
+    if cls is None:
+        raise RequestException(f"Unknown command: {request['command']}")
+    fields = request.get('fields', {})
+    command = cls(**{name: _field_value(cls, name, value) for name, value in fields.items()})
+    output_format = request.get('format', default_format)
+    if output_format == 'bits':
+        return {'bits': command.encode()}
+    if output_format == 'hex':
+        return {'hex': command.encode_packed().hex()}
+    if output_format == 'int':
+        return {'int': command.encode_int()}
+    raise RequestException(f"Unknown format: {output_format}")
+
+
+def decode_request(request) -> dict:
+    if 'bits' in request:
+        encoded = request['bits']
+    elif 'hex' in request:
+        encoded = bytes.fromhex(request['hex'])
+    else:
+        encoded = request['int']
+    command = Command.decode(encoded, verify_checksum=request.get('verify_checksum', True))
+    fields = {}
+    if not isinstance(command, GenericCommand):
+        fields = {name: _json_value(value) for name, value in command._field_values.items()
+                  if not name.startswith('_')}
+    return {'command': type(command).__name__, 'fields': fields, 'bytes': bytes(command._buffer).hex()}
+
+
+class Service:
+    """
+    Handles JSONL requests and keeps counts for the --stats summary.
+    """
+    def __init__(self, default_format='bits'):
+        if default_format not in _FORMATS:
+            raise ValueError(f"Unknown format: {default_format}")
+        self.default_format = default_format
+        self.counts = Counter()
+        self.errors = Counter()
+        self.start_time = time.perf_counter()
+
+    def handle_line(self, line) -> str:
+        """
+        Handle one request line, as str or UTF-8 bytes, and return its result line.
+        """
+        result = {}
+        try:
+            if isinstance(line, bytes):
+                line = line.decode()
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise RequestException("Request must be a JSON object")
+            if 'id' in request:
+                result['id'] = request['id']
+            if 'command' in request:
+                op, body = 'encode', encode_request(request, self.default_format)
+            elif {'bits', 'hex', 'int'}.intersection(request):
+                op, body = 'decode', decode_request(request)
+            else:
+                raise RequestException("Request needs a command to encode, or bits, hex or int to decode")
+            self.counts[op] += 1
+            result['ok'] = True
+            result.update(body)
+        except Exception as e:
+            self.errors[type(e).__name__] += 1
+            result['ok'] = False
+            result['error'] = f"{type(e).__name__}: {e}"
+        return json.dumps(result, separators=(',', ':'))
+
+    def handle_batch(self, lines) -> str:
+        return ''.join(self.handle_line(line) + '\n' for line in lines if line.strip())
+
+    def run(self, stdin, stdout):
+        """
+        Serve requests from a binary stdin until end of input.
+        """
+        pending = b''
+        while True:
+            # read1() returns what is available, blocking only while there is nothing
+            chunk = stdin.read1(1 << 16) if hasattr(stdin, 'read1') else stdin.readline()
+            if not chunk:
+                break
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            if lines:
+                stdout.write(self.handle_batch(lines).encode())
+                stdout.flush()
+        if pending.strip():
+            stdout.write(self.handle_batch([pending]).encode())
+            stdout.flush()
+
+    def stats(self) -> dict:
+        elapsed_s = time.perf_counter() - self.start_time
+        num_records = sum(self.counts.values()) + sum(self.errors.values())
+        return {
+            'records': num_records,
+            'encoded': self.counts['encode'],
+            'decoded': self.counts['decode'],
+            'errors': dict(self.errors),
+            'elapsed_s': round(elapsed_s, 3),
+            'records_per_s': round(num_records / elapsed_s, 1) if elapsed_s > 0 else None,
+        }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m pixmob_ir_protocol',
+                                     description="Encode and decode PixMob IR commands as JSONL, "
+                                                 "from stdin to stdout.")
+    parser.add_argument('--format', choices=_FORMATS, default='bits',
+                        help="output format of encoded commands (default: bits)")
+    parser.add_argument('--stats', action='store_true',
+                        help="print a summary to stderr at the end of input")
+    args = parser.parse_args(argv)
+
+    service = Service(args.format)
+    try:
+        service.run(sys.stdin.buffer, sys.stdout.buffer)
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # The reader went away; keep the interpreter from failing to flush stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    if args.stats:
+        print(json.dumps(service.stats()), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+Selection of the shortest IR encoding among equivalent command forms.
+
+Some effects can be sent as more than one command. Per docs/ir_protocol.md, a 6-byte
+CommandSingleColor always uses a 0ms attack and 32ms release, and with gst_enable its
+sustain time comes from the global sustain time, so it shows the same effect as a 9-byte
+CommandSingleColorExt with those timers, 100% chance, no group and no repeat. With
+gst_enable, the sustain field of CommandSingleColorExt is overridden and may take any value.
+"""
+from pixmob_ir_protocol import (
+    Chance,
+    Command,
+    CommandSingleColor,
+    CommandSingleColorExt,
+    Time,
+)
+
+
+# IR bits of the last command byte of a frame after trailing 0's are trimmed
+_last_byte_bits = [b.bit_length() for b in Command._encoding_map]
+
+
+class _Equivalence:
+    """
+    Rule for rewriting a command of source_class as an equivalent command of target_class.
+
+    The rule applies when the command's fields match required. Fields listed in copy are
+    carried over, fixed fields are set on the target, and every value of each free field
+    gives an equivalent command.
+    """
+    def __init__(self, source_class, target_class, required, copy, fixed=None, free=None):
+        self.source_class = source_class
+        self.target_class = target_class
+        self.required = required
+        self.copy = copy
+        self.fixed = fixed or {}
+        self.free = free or {}
+
+    def affects_last_byte(self, name) -> bool:
+        """
+        Return whether a field of the target class is encoded in its last byte.
+        """
+        last_byte = self.target_class._num_bytes - 1
+        return any(fragment.byte == last_byte for fragment in self.target_class._fields[name].fragments)
+
+    def shortening(self):
+        """
+        Return the rule reduced to the forms that may have the fewest IR bits, or None if no
+        form can be shorter than the source command.
+
+        Frame bits only depend on the frame size and the last byte, and every 6-byte frame
+        is shorter than every 9-byte frame. A rule into a larger class never shortens a
+        command, a rule into a class of the same size only through fields in the last
+        byte, and free fields elsewhere need only one value.
+        """
+        target_bytes = self.target_class._num_bytes
+        source_bytes = self.source_class._num_bytes
+        if target_bytes > source_bytes:
+            return None
+        if target_bytes == source_bytes and not any(self.affects_last_byte(name)
+                                                    for name in [*self.fixed, *self.free]):
+            return None
+        free = {name: values if self.affects_last_byte(name) else values[:1]
+                for name, values in self.free.items()}
+        return _Equivalence(self.source_class, self.target_class, self.required, self.copy,
+                            self.fixed, free)
+
+    def forms(self, command):
+        field_values = command._field_values
+        if any(field_values[name] != value for name, value in self.required.items()):
+            return
+        base = {name: field_values[name] for name in self.copy}
+        base.update(self.fixed)
+        forms = [base]
+        for name, values in self.free.items():
+            forms = [dict(form, **{name: value}) for form in forms for value in values]
+        for form in forms:
+            yield self.target_class(**form)
+
+
+_SINGLE_COLOR_EXT_FIXED = {
+    'chance':           Chance.CHANCE_100_PCT,
+    'attack':           Time.TIME_0_MS,
+    'release':          Time.TIME_32_MS,
+    'group_id':         0,
+    'enable_repeat':    False,
+}
+
+# Equivalent forms of each command class
+_equivalences = {
+    CommandSingleColor: [
+        _Equivalence(CommandSingleColor, CommandSingleColorExt,
+                     required={'gst_enable': True},
+                     copy=['on_start', 'gst_enable', 'red', 'green', 'blue'],
+                     fixed=_SINGLE_COLOR_EXT_FIXED,
+                     free={'sustain': list(Time)}),
+    ],
+    CommandSingleColorExt: [
+        _Equivalence(CommandSingleColorExt, CommandSingleColor,
+                     required={'gst_enable': True, **_SINGLE_COLOR_EXT_FIXED},
+                     copy=['on_start', 'gst_enable', 'red', 'green', 'blue']),
+        _Equivalence(CommandSingleColorExt, CommandSingleColorExt,
+                     required={'gst_enable': True},
+                     copy=[name for name in CommandSingleColorExt._fields if name != 'sustain'],
+                     free={'sustain': list(Time)}),
+    ],
+}
+
+
+# Rules that may give fewer IR bits, by class, for shortest_form()
+_shortenings = {
+    cls: [shortening for shortening in map(_Equivalence.shortening, equivalences) if shortening]
+    for cls, equivalences in _equivalences.items()
+}
+
+
+def frame_bits(command) -> int:
+    """
+    Return the number of IR bits of a command's encoded frame, without encoding it.
+
+    The magic byte contributes a single bit and the last byte loses its trailing 0's.
+    """
+    buffer = command._buffer
+    return 8 * len(buffer) - 15 + _last_byte_bits[buffer[-1]]
+
+
+def equivalent_forms(command) -> list:
+    """
+    Return the command and every equivalent command the current classes allow.
+    """
+    forms = [command]
+    for equivalence in _equivalences.get(type(command), []):
+        forms.extend(form for form in equivalence.forms(command) if form not in forms)
+    return forms
+
+
+def shortest_form(command):
+    """
+    Return the equivalent form of a command with the fewest IR bits, preferring the command
+    itself on a tie.
+
+    Only forms that can be shorter are built; see _Equivalence.shortening().
+    """
+    forms = [command]
+    for shortening in _shortenings.get(type(command), []):
+        forms.extend(shortening.forms(command))
+    return min(forms, key=frame_bits)
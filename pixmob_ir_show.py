@@ -0,0 +1,349 @@
+"""
+Compilation of timed show cue lists into IR transmission schedules.
+
+A show is a list of cues, each a time and the commands of one effect (for example the
+"Eras Tour: Go Home Sequence" in pixmob_ir_protocol_examples.py). The compiler tracks which
+colors are loaded into the EEPROM color profiles, drops profile writes that would not change
+anything, points CommandSetConfig profile ranges at colors that are already loaded, and
+places every cue's commands on the IR channel so that they are on air by the cue time.
+"""
+from pixmob_ir_protocol import (
+    CommandSetColor,
+    CommandSetConfig,
+    CommandSingleColor,
+    CommandSingleColorExt,
+    CommandTwoColors,
+)
+from pixmob_ir_pulse import DEFAULT_CONFIG
+from pixmob_ir_shortest import shortest_form
+
+
+# Number of color profiles in EEPROM
+NUM_PROFILES = 16
+
+
+class ShowScheduleException(Exception):
+    pass
+
+
+class Cue:
+    """
+    Effect to be shown at time_s seconds into the show, as the commands that make it up.
+    """
+    def __init__(self, time_s, commands, name=None):
+        self.time_s = time_s
+        self.commands = list(commands)
+        self.name = name
+
+    def __repr__(self):
+        name = f"{self.name!r}, " if self.name is not None else ""
+        return f"{type(self).__name__}({name}time_s={self.time_s}, commands={len(self.commands)})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class ScheduledCommand:
+    """
+    Command of a compiled schedule, going on air at start_s for airtime_s seconds (idle gap
+    after the frame included).
+    """
+    def __init__(self, start_s, airtime_s, command, cue_index):
+        self.start_s = start_s
+        self.airtime_s = airtime_s
+        self.command = command
+        self.cue_index = cue_index
+
+    @property
+    def end_s(self):
+        return self.start_s + self.airtime_s
+
+    def __repr__(self):
+        return f"{type(self).__name__}(start_s={self.start_s:.4f}, cue={self.cue_index}, " + \
+            f"{self.command})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class MissedCue:
+    """
+    Cue whose commands could not all be on air by the cue time.
+    """
+    def __init__(self, cue_index, cue, end_s):
+        self.cue_index = cue_index
+        self.cue = cue
+        self.end_s = end_s
+
+    @property
+    def late_s(self):
+        return self.end_s - self.cue.time_s
+
+    def __repr__(self):
+        return f"{type(self).__name__}(cue={self.cue_index}, time_s={self.cue.time_s}, " + \
+            f"late_s={self.late_s:.4f})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class ShowSchedule:
+    """
+    Result of compile_show(): the scheduled commands in transmission order, the cues that
+    could not be met, and the number of commands dropped as redundant.
+    """
+    def __init__(self, entries, missed, num_dropped, config=DEFAULT_CONFIG):
+        self.entries = entries
+        self.missed = missed
+        self.num_dropped = num_dropped
+        self.config = config
+
+    def airtime_s(self) -> float:
+        return sum(entry.airtime_s for entry in self.entries)
+
+    def commands(self) -> list:
+        return [entry.command for entry in self.entries]
+
+    def verify(self):
+        """
+        Check the schedule against the encoded length of every command: frames must not
+        overlap and must fit the airtime of their encoded bits. Raises ShowScheduleException
+        otherwise.
+        """
+        end_s = None
+        for entry in self.entries:
+            airtime_s = self.config.airtime_us(len(entry.command.encode())) / 1e6
+            if entry.airtime_s < airtime_s:
+                raise ShowScheduleException(f"Airtime too short for {entry}")
+            if end_s is not None and entry.start_s < end_s - 1e-9:
+                raise ShowScheduleException(f"Overlapping frames at {entry}")
+            end_s = entry.start_s + airtime_s
+
+    def __repr__(self):
+        return f"{type(self).__name__}(commands={len(self.entries)}, " + \
+            f"airtime_s={self.airtime_s():.3f}, dropped={self.num_dropped}, missed={len(self.missed)})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+# Commands that display a color without reading or writing profiles or changing groups
+_DISPLAY_ONLY_COMMANDS = (CommandSingleColor, CommandSingleColorExt, CommandTwoColors)
+
+
+def _is_profile_write(command) -> bool:
+    """
+    Return whether a command only saves a color into a profile, without displaying it.
+    """
+    return isinstance(command, CommandSetColor) and \
+        command._field_values['skip_display'] and not command._field_values['is_background']
+
+
+def _color(command):
+    # Color bytes of the command buffer, so that colors equal after quantization compare equal
+    return command._buffer[3:6]
+
+
+class _ProfileState:
+    """
+    Colors in the profiles of every group, as (color, command that wrote it) per profile.
+
+    Group 0 addresses every device, so its profiles apply to any group without its own write.
+    """
+    def __init__(self):
+        self._groups = {0: {}}
+
+    def get(self, group_id, profile_id):
+        group = self._groups.get(group_id, self._groups[0])
+        return group.get(profile_id, self._groups[0].get(profile_id))
+
+    def color(self, group_id, profile_id):
+        entry = self.get(group_id, profile_id)
+        return None if entry is None else entry[0]
+
+    def write(self, command):
+        group_id = command._field_values['group_id']
+        profile_id = command._field_values['profile_id']
+        if group_id == 0:
+            for group in self._groups.values():
+                group.pop(profile_id, None)
+        self._groups.setdefault(group_id, {})[profile_id] = (_color(command), command)
+
+    def is_uniform(self, profile_ids) -> bool:
+        """
+        Return whether no group has its own color in any of the profiles.
+        """
+        return not any(profile_id in group for group_id, group in self._groups.items()
+                       if group_id != 0 for profile_id in profile_ids)
+
+
+class _CueCompiler:
+    """
+    Rewrites cue commands against the profile colors loaded so far.
+
+    intended holds the profiles as the uncompiled show would leave them, loaded holds the
+    profiles as the compiled commands leave them. Commands keep their order within the
+    cue; profile writes are held back until a later command could read the profile, so
+    that a write overwritten before it is read, or one that a relocated profile range makes
+    unnecessary, is never sent.
+    """
+    def __init__(self):
+        self.intended = _ProfileState()
+        self.loaded = _ProfileState()
+        self.num_dropped = 0
+
+    def _write(self, command, commands):
+        commands.append(command)
+        self.loaded.write(command)
+
+    def _flush(self, pending, commands):
+        """
+        Send the held back profile writes in their order, dropping those already loaded.
+        """
+        for (group_id, profile_id), command in pending.items():
+            if self.loaded.color(group_id, profile_id) == _color(command) and \
+                    (group_id != 0 or self.loaded.is_uniform([profile_id])):
+                self.num_dropped += 1
+            else:
+                self._write(command, commands)
+        pending.clear()
+
+    def _load_range(self, profile_ids, commands):
+        """
+        Write every profile of group 0 that is not loaded with its intended color.
+        """
+        for profile_id in profile_ids:
+            intended = self.intended.get(0, profile_id)
+            if intended is not None and self.loaded.color(0, profile_id) != intended[0]:
+                self._write(intended[1], commands)
+
+    def _find_loaded_range(self, profile_ids):
+        """
+        Return the first profile of a range that is loaded with the intended colors of
+        profile_ids, preferring the range itself, or None.
+        """
+        colors = [self.intended.color(0, profile_id) for profile_id in profile_ids]
+        if None in colors:
+            return None
+        starts = [profile_ids[0]] + [s for s in range(NUM_PROFILES - len(colors) + 1)
+                                     if s != profile_ids[0]]
+        for start in starts:
+            if all(self.loaded.color(0, start + i) == color for i, color in enumerate(colors)):
+                return start
+        return None
+
+    def compile(self, cue) -> list:
+        pending = {}
+        commands = []
+        for command in cue.commands:
+            if _is_profile_write(command):
+                self.intended.write(command)
+                key = (command._field_values['group_id'], command._field_values['profile_id'])
+                if pending.pop(key, None) is not None:
+                    # Overwritten before anything read it
+                    self.num_dropped += 1
+                pending[key] = command
+            elif isinstance(command, CommandSetConfig):
+                commands.append(self._compile_config(command, pending, commands))
+            elif isinstance(command, _DISPLAY_ONLY_COMMANDS):
+                commands.append(command)
+            else:
+                # May read profiles or change the groups that writes address
+                self._flush(pending, commands)
+                if isinstance(command, CommandSetColor) and not command._field_values['is_background']:
+                    self.intended.write(command)
+                    self.loaded.write(command)
+                commands.append(command)
+        self._flush(pending, commands)
+        return commands
+
+    def _compile_config(self, command, pending, commands):
+        lo = command._field_values['profile_id_lo']
+        hi = command._field_values['profile_id_hi']
+        profile_ids = list(range(lo, hi + 1))
+
+        # Writes to the range wait for the range to be placed, the rest are sent first
+        range_writes = {key: write for key, write in pending.items()
+                        if key[0] == 0 and key[1] in profile_ids}
+        for key in range_writes:
+            del pending[key]
+        self._flush(pending, commands)
+
+        if not profile_ids or not self.intended.is_uniform(profile_ids) or \
+                not self.loaded.is_uniform(range(NUM_PROFILES)):
+            # Per-group colors: load the writes as given
+            self._flush(range_writes, commands)
+            return command
+
+        start = self._find_loaded_range(profile_ids)
+        if start is None:
+            start = lo
+            num_commands = len(commands)
+            self._load_range(profile_ids, commands)
+            loaded = commands[num_commands:]
+            self.num_dropped += sum(all(c is not write for c in loaded)
+                                    for write in range_writes.values())
+        else:
+            self.num_dropped += len(range_writes)
+        if start != lo:
+            command = command.replace(profile_id_lo=start, profile_id_hi=start + hi - lo)
+        return command
+
+
+def compile_show(cues, config=DEFAULT_CONFIG, shortest=False) -> ShowSchedule:
+    """
+    Compile a list of Cue into a transmission schedule.
+
+    Cues are handled in time order. Profile writes (CommandSetColor with skip_display and
+    without is_background) are dropped when the profile already holds the color, and a
+    CommandSetConfig profile range is moved to profiles that already hold its colors instead
+    of writing them again.
+
+    The commands of a cue go on air back to back, finishing as close to the cue time as
+    possible, and never before the previous cue time, so that profiles used by a running
+    effect are not overwritten early. Cues whose commands cannot be on air by the cue time
+    are sent as soon as possible and reported in ShowSchedule.missed.
+
+    shortest: Replace every command with its shortest equivalent form from
+              pixmob_ir_shortest.shortest_form().
+    """
+    order = sorted(range(len(cues)), key=lambda i: cues[i].time_s)
+    compiler = _CueCompiler()
+    blocks = []
+    for i in order:
+        commands = compiler.compile(cues[i])
+        if shortest:
+            commands = [shortest_form(command) for command in commands]
+        airtimes = [config.airtime_us(len(command.encode())) / 1e6 for command in commands]
+        blocks.append((i, commands, airtimes))
+
+    # Forward pass: earliest finish of every cue, released at the previous cue time
+    earliest_end = []
+    end_s = 0.0
+    release_s = 0.0
+    for i, commands, airtimes in blocks:
+        end_s = max(end_s, release_s) + sum(airtimes)
+        earliest_end.append(end_s)
+        release_s = cues[i].time_s
+
+    # Backward pass: finish each cue as late as allowed by its time and the next cue
+    ends = [0.0] * len(blocks)
+    next_start = float('inf')
+    for k in reversed(range(len(blocks))):
+        i, commands, airtimes = blocks[k]
+        ends[k] = min(max(cues[i].time_s, earliest_end[k]), next_start)
+        next_start = ends[k] - sum(airtimes)
+
+    entries = []
+    missed = []
+    for (i, commands, airtimes), end_s in zip(blocks, ends):
+        if end_s > cues[i].time_s + 1e-9:
+            missed.append(MissedCue(i, cues[i], end_s))
+        start_s = end_s - sum(airtimes)
+        for command, airtime_s in zip(commands, airtimes):
+            entries.append(ScheduledCommand(start_s, airtime_s, command, i))
+            start_s += airtime_s
+
+    schedule = ShowSchedule(entries, missed, compiler.num_dropped, config)
+    schedule.verify()
+    return schedule
@@ -0,0 +1,215 @@
+"""
+Compact binary show files of pre-encoded IR frames, readable through mmap.
+
+A show file holds a header, a table of command class names, a sorted index of frame times,
+and one fixed-stride record per frame with its time, class id, group id and the encoded IR
+sequence packed into bytes (as returned by Command.encode_packed()). Opening a file maps it
+without reading the records, seeking to a time is a binary search over the index, and
+commands are only rebuilt from their packed bits when asked for.
+
+Layout (little endian):
+    header      magic b'PXSF', version (u16), record size (u16), number of records (u32),
+                class table size (u32)
+    classes     class names separated by '\\n', padded with 0's to a multiple of 8 bytes
+    index       time of every record in microseconds (i64), in ascending order
+    records     time in microseconds (i64), class id (u8), group id (u8), IR bits (u8),
+                packed IR sequence (9 bytes), padding (5 bytes)
+"""
+import bisect
+import mmap
+import struct
+
+from pixmob_ir_protocol import Command, CommandView
+
+
+MAGIC = b'PXSF'
+VERSION = 1
+
+_HEADER = struct.Struct('<4sHHII')
+_RECORD = struct.Struct('<qBBB9s5x')
+
+# Longest packed IR sequence: a 9-byte frame of up to 65 bits
+_MAX_PACKED_BYTES = 9
+
+
+class ShowFileException(Exception):
+    pass
+
+
+class ShowRecord:
+    """
+    Frame of a show file: its time, command class name, group id and packed IR sequence.
+
+    The encode methods match those of Command, and decode() rebuilds the command.
+    """
+    __slots__ = ('time_s', 'class_name', 'group_id', 'num_bits', 'packed')
+
+    def __init__(self, time_s, class_name, group_id, num_bits, packed):
+        self.time_s = time_s
+        self.class_name = class_name
+        self.group_id = group_id
+        self.num_bits = num_bits
+        self.packed = packed
+
+    def encode_packed(self) -> bytes:
+        return self.packed
+
+    def encode_int(self) -> int:
+        return int.from_bytes(self.packed, 'little')
+
+    def encode(self) -> list[int]:
+        frame = self.encode_int()
+        return [(frame >> i) & 1 for i in range(self.num_bits)]
+
+    def decode(self, lazy=False):
+        """
+        Rebuild the command with Command.decode(); see there for lazy.
+        """
+        return Command.decode(self.packed, lazy=lazy)
+
+    def __repr__(self):
+        return f"{type(self).__name__}(time_s={self.time_s:.6f}, {self.class_name}, " + \
+            f"group_id={self.group_id}, bits={self.num_bits})"
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class ShowFileWriter:
+    """
+    Collects timed commands and writes them as a show file on close().
+
+    Frames may be added in any order; records are sorted by time, keeping the order in which
+    frames with equal times were added.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._classes = {}
+        self._records = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def add(self, time_s, command):
+        """
+        Add a command (or CommandView) to be sent at time_s seconds.
+        """
+        if isinstance(command, CommandView):
+            command = command.to_command()
+        frame = command.encode_int()
+        group_id = getattr(command, '_field_values', {}).get('group_id', 0)
+        self.add_packed(time_s, frame.to_bytes((frame.bit_length() + 7) // 8, 'little'),
+                        frame.bit_length(), type(command).__name__, group_id)
+
+    def add_packed(self, time_s, packed, num_bits, class_name, group_id=0):
+        """
+        Add a frame that is already encoded and packed, as returned by encode_packed().
+        """
+        if len(packed) > _MAX_PACKED_BYTES:
+            raise ShowFileException(f"Packed frame too long: {len(packed)} bytes")
+        class_id = self._classes.setdefault(class_name, len(self._classes))
+        if class_id > 0xFF:
+            raise ShowFileException("Too many command classes")
+        self._records.append((round(time_s * 1e6), class_id, group_id, num_bits, bytes(packed)))
+
+    def add_schedule(self, schedule):
+        """
+        Add every command of a ShowSchedule from pixmob_ir_show.compile_show() at its start
+        time.
+        """
+        for entry in schedule.entries:
+            self.add(entry.start_s, entry.command)
+
+    def close(self):
+        records = sorted(self._records, key=lambda record: record[0])
+        classes = '\n'.join(self._classes).encode()
+        classes += bytes(-len(classes) % 8)
+        with open(self.path, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, _RECORD.size, len(records), len(classes)))
+            f.write(classes)
+            f.write(struct.pack(f"<{len(records)}q", *(record[0] for record in records)))
+            for record in records:
+                f.write(_RECORD.pack(*record))
+        self._records = []
+
+
+class ShowFile:
+    """
+    Read-only view of a show file through mmap.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._mmap) < _HEADER.size:
+                raise ShowFileException(f"Truncated show file: {path}")
+            magic, version, record_size, num_records, classes_size = _HEADER.unpack_from(self._mmap)
+            if magic != MAGIC or version != VERSION or record_size != _RECORD.size:
+                raise ShowFileException(f"Not a version {VERSION} show file: {path}")
+            offset = _HEADER.size
+            classes = bytes(self._mmap[offset:offset + classes_size]).rstrip(b'\0')
+            self.class_names = classes.decode().split('\n')
+            offset += classes_size
+            self._times = memoryview(self._mmap)[offset:offset + 8 * num_records].cast('q')
+            self._records_offset = offset + 8 * num_records
+            if len(self._mmap) < self._records_offset + num_records * _RECORD.size:
+                raise ShowFileException(f"Truncated show file: {path}")
+        except Exception:
+            self.close()
+            raise
+        self.num_records = num_records
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if getattr(self, '_times', None) is not None:
+            self._times.release()
+            self._times = None
+        if not self._mmap.closed:
+            self._mmap.close()
+
+    def __len__(self):
+        return self.num_records
+
+    def __getitem__(self, i) -> ShowRecord:
+        if i < 0:
+            i += self.num_records
+        if not 0 <= i < self.num_records:
+            raise IndexError(i)
+        time_us, class_id, group_id, num_bits, packed = \
+            _RECORD.unpack_from(self._mmap, self._records_offset + i * _RECORD.size)
+        return ShowRecord(time_us / 1e6, self.class_names[class_id], group_id, num_bits,
+                          packed[:(num_bits + 7) // 8])
+
+    def time_s(self, i) -> float:
+        return self._times[i] / 1e6
+
+    def seek(self, time_s) -> int:
+        """
+        Return the index of the first record at or after time_s.
+        """
+        return bisect.bisect_left(self._times, round(time_s * 1e6))
+
+    def records(self, start_s=None, end_s=None):
+        """
+        Generate the records from start_s up to but not including end_s, in time order.
+        """
+        start = 0 if start_s is None else self.seek(start_s)
+        end = self.num_records if end_s is None else self.seek(end_s)
+        for i in range(start, end):
+            yield self[i]
+
+    def commands(self, start_s=None, end_s=None, lazy=False):
+        """
+        Generate (time in seconds, command) from start_s up to but not including end_s.
+        """
+        for record in self.records(start_s, end_s):
+            yield record.time_s, record.decode(lazy)
@@ -0,0 +1,422 @@
+"""
+Vectorized simulation of the LED phase FSM (see docs/operation.md) for a crowd of devices.
+
+Every device has its own group, EEPROM (color profiles, group ids, repeat settings, on-start
+config) and MCU state (cfg1, cfg2, last_rgb, bg_rgb, gst), held in NumPy arrays with one entry
+per device. Time advances in 16ms ticks. Devices only do work when one of their LED phases
+ends or a command reaches them, so a long show is simulated phase by phase rather than tick
+by tick, and colors are only computed at the requested sample times.
+"""
+import enum
+
+import numpy as np
+
+from pixmob_ir_eeprom import NUM_PROFILES, EepromImage
+from pixmob_ir_protocol import (
+    CommandDoReset,
+    CommandIdentFWVersion,
+    CommandSetColor,
+    CommandSetConfig,
+    CommandSetGlobalSustainTime,
+    CommandSetGroupId,
+    CommandSetGroupSel,
+    CommandSetRepeatCount,
+    CommandSetRepeatDelayTime,
+    CommandSingleColor,
+    CommandSingleColorExt,
+    CommandTwoColors,
+    CommandView,
+)
+
+
+# Length of a timer increment in seconds
+TICK_S = 0.016
+
+# Timer values in ticks of the 3-bit Time, GlobalSustainTime and Chance keys
+_TIME_TICKS = np.array([0, 2, 6, 12, 30, 60, 150, 240], dtype=np.int64)
+_GST_TICKS = np.array([4, 7, 10, 13, 30, 60, 150, 240], dtype=np.int64)
+_CHANCE = np.array([1.0, 0.88, 0.67, 0.50, 0.32, 0.16, 0.10, 0.04])
+
+# Timers of effects with fixed timing: Display Single Color and the brief color display of
+# other commands use a 0ms attack, 32ms release and 384ms (or global) sustain
+_BRIEF_ATTACK = 0
+_BRIEF_SUSTAIN = 24
+_BRIEF_RELEASE = 2
+# Color 1 of Display Two Colors is shown for about 25ms before color 2
+_TWO_COLORS_FIRST = 2
+# Idle time in Init before the LEDs turn off and the MCU sleeps
+_SLEEP_TICKS = 3750
+# Power-on value of MCU:gst
+_DEFAULT_GST = 0x1E
+
+# Factory default color profiles as 0xRRGGBB (firmware version 0x08)
+_FACTORY_PROFILES = [(red << 16) | (green << 8) | blue for red, green, blue in
+                     map(EepromImage.factory(0x08).profile_rgb, range(NUM_PROFILES))]
+
+_NEVER = np.iinfo(np.int64).max
+
+
+class Phase(enum.IntEnum):
+    INIT            = 0
+    ATTACK          = 1
+    SUSTAIN         = 2
+    RELEASE         = 3
+    REPEAT_DELAY    = 4
+
+
+class _Cfg:
+    """
+    Configuration structure of every device: color, timers in ticks, profile range and mode.
+    """
+    def __init__(self, num_devices):
+        self.rgb = np.zeros(num_devices, dtype=np.uint32)
+        self.attack = np.zeros(num_devices, dtype=np.int64)
+        self.sustain = np.zeros(num_devices, dtype=np.int64)
+        self.release = np.zeros(num_devices, dtype=np.int64)
+        self.profile_lo = np.zeros(num_devices, dtype=np.int64)
+        self.profile_hi = np.zeros(num_devices, dtype=np.int64)
+        self.dynamic = np.zeros(num_devices, dtype=bool)
+        self.random = np.zeros(num_devices, dtype=bool)
+        self.rpen = np.zeros(num_devices, dtype=bool)
+
+    def copy_from(self, other, idx, other_idx=None):
+        other_idx = idx if other_idx is None else other_idx
+        for name, array in vars(self).items():
+            array[idx] = getattr(other, name)[other_idx]
+
+    def set(self, idx, rgb, attack, sustain, release, rpen=False, dynamic=False, random=False,
+            profile_lo=0, profile_hi=0):
+        self.rgb[idx] = rgb
+        self.attack[idx] = attack
+        self.sustain[idx] = sustain
+        self.release[idx] = release
+        self.rpen[idx] = rpen
+        self.dynamic[idx] = dynamic
+        self.random[idx] = random
+        self.profile_lo[idx] = profile_lo
+        self.profile_hi[idx] = profile_hi
+
+
+class CrowdSimulator:
+    """
+    State of num_devices devices receiving the same IR commands.
+
+    group_ids: Group id of every device (or one for all), stored at group sel 0. Devices
+               default to the factory group id 1.
+    firmware_version: Firmware version of every device, for CommandIdentFWVersion.
+    seed: Seed of the random generator used for chance draws and random profiles.
+    """
+    def __init__(self, num_devices, group_ids=1, firmware_version=0x08, seed=None):
+        n = num_devices
+        self.num_devices = n
+        self.rng = np.random.default_rng(seed)
+        self.firmware_version = np.broadcast_to(np.asarray(firmware_version, dtype=np.int64), (n,))
+
+        # EEPROM
+        self.group_sel = np.zeros(n, dtype=np.int64)
+        self.group_sel_ids = np.ones((n, 8), dtype=np.int64)
+        self.group_sel_ids[:, 0] = group_ids
+        self.profiles = np.tile(np.array(_FACTORY_PROFILES, dtype=np.uint32), (n, 1))
+        self.repeat_delay = np.zeros(n, dtype=np.int64)
+        self.repeat_count = np.ones(n, dtype=np.int64)
+        self.on_start = np.zeros(n, dtype=bool)
+
+        # MCU
+        self.group_id = self.group_sel_ids[:, 0].copy()
+        self.gst = np.full(n, _DEFAULT_GST, dtype=np.int64)
+        # Colors are held as 0xRRGGBB, which indexes much faster than rows of 3 bytes
+        self.bg_rgb = np.zeros(n, dtype=np.uint32)
+        self.last_rgb = np.zeros(n, dtype=np.uint32)
+        self.cfg1 = _Cfg(n)
+        self.cfg2 = _Cfg(n)
+        self.cfg2.set(slice(None), 0, 30, 30, 30, dynamic=True, random=True, profile_lo=0, profile_hi=7)
+        self.last_profile = np.full(n, -1, dtype=np.int64)
+        self.num_plays = np.zeros(n, dtype=np.int64)
+        # Init with a finite end starts the next play; from_cfg2 marks an on-start cycle
+        self.from_cfg2 = np.zeros(n, dtype=bool)
+        self.phase = np.full(n, Phase.INIT, dtype=np.uint8)
+        self.phase_start = np.zeros(n, dtype=np.int64)
+        self.phase_end = np.full(n, _NEVER, dtype=np.int64)
+
+        self.tick = 0
+        self._handlers = {
+            CommandSingleColor:             self._single_color,
+            CommandSingleColorExt:          self._single_color_ext,
+            CommandTwoColors:               self._two_colors,
+            CommandSetConfig:               self._set_config,
+            CommandSetColor:                self._set_color,
+            CommandSetGroupSel:             self._set_group_sel,
+            CommandSetGroupId:              self._set_group_id,
+            CommandSetRepeatDelayTime:      self._set_repeat_delay,
+            CommandSetRepeatCount:          self._set_repeat_count,
+            CommandSetGlobalSustainTime:    self._set_gst,
+            CommandIdentFWVersion:          self._ident_fw_version,
+            CommandDoReset:                 self._do_reset,
+        }
+
+    # Time and LED phases
+
+    def advance(self, tick):
+        """
+        Run the LED phase FSM of every device up to the given tick.
+        """
+        while True:
+            idx = np.flatnonzero(self.phase_end <= tick)
+            if idx.size == 0:
+                break
+            end = self.phase_end[idx]
+            phase = self.phase[idx]
+            for p, step in ((Phase.INIT, self._end_init),
+                            (Phase.ATTACK, self._end_attack),
+                            (Phase.SUSTAIN, self._end_sustain),
+                            (Phase.RELEASE, self._end_release),
+                            (Phase.REPEAT_DELAY, self._end_repeat_delay)):
+                mask = phase == p
+                if mask.any():
+                    step(idx[mask], end[mask])
+        self.tick = max(self.tick, tick)
+
+    def _enter_phase(self, idx, phase, start, duration):
+        self.phase[idx] = phase
+        self.phase_start[idx] = start
+        self.phase_end[idx] = start + duration
+
+    def _start_play(self, idx, start):
+        """
+        Init phase: load the next profile color for dynamic configs and start the attack.
+        """
+        dynamic = idx[self.cfg1.dynamic[idx]]
+        if dynamic.size:
+            lo = self.cfg1.profile_lo[dynamic]
+            hi = np.maximum(self.cfg1.profile_hi[dynamic], lo)
+            sequential = self.last_profile[dynamic] + 1
+            sequential = np.where((sequential < lo) | (sequential > hi), lo, sequential)
+            random = lo + (self.rng.random(dynamic.size) * (hi - lo + 1)).astype(np.int64)
+            profile = np.where(self.cfg1.random[dynamic], random, sequential)
+            self.last_profile[dynamic] = profile
+            self.cfg1.rgb[dynamic] = self.profiles[dynamic, profile]
+        self._enter_phase(idx, Phase.ATTACK, start, self.cfg1.attack[idx])
+
+    def _end_init(self, idx, end):
+        cycle = idx[self.from_cfg2[idx]]
+        self.cfg1.copy_from(self.cfg2, cycle)
+        self.num_plays[cycle] = 0
+        self._start_play(idx, end)
+
+    def _end_attack(self, idx, end):
+        self._enter_phase(idx, Phase.SUSTAIN, end, self.cfg1.sustain[idx])
+
+    def _end_sustain(self, idx, end):
+        # A zero release leaves the color on as the background color
+        hold = idx[self.cfg1.release[idx] == 0]
+        self.bg_rgb[hold] = self.cfg1.rgb[hold]
+        self._enter_phase(idx, Phase.RELEASE, end, self.cfg1.release[idx])
+
+    def _end_release(self, idx, end):
+        self.last_rgb[idx] = self.bg_rgb[idx]
+        self.num_plays[idx] += 1
+        repeat = self.cfg1.rpen[idx]
+        self._enter_phase(idx[repeat], Phase.REPEAT_DELAY, end[repeat], self.repeat_delay[idx[repeat]])
+        self._wait(idx[~repeat], end[~repeat])
+
+    def _end_repeat_delay(self, idx, end):
+        again = self.num_plays[idx] < self.repeat_count[idx]
+        self._start_play(idx[again], end[again])
+        self._wait(idx[~again], end[~again])
+
+    def _wait(self, idx, end):
+        """
+        Enter Init after an effect: continue the on-start cycle one tick later, or idle.
+        """
+        cycle = self.on_start[idx]
+        self.from_cfg2[idx] = cycle
+        self._enter_phase(idx, Phase.INIT, end, np.where(cycle, 1, _NEVER - end))
+
+    def rgb(self, tick=None) -> np.ndarray:
+        """
+        Return the displayed color of every device at a tick (default: the current tick),
+        as an array of shape (num_devices, 3).
+        """
+        color = self._color(tick)
+        return np.stack([(color >> 16) & 0xFF, (color >> 8) & 0xFF, color & 0xFF],
+                        axis=1).astype(np.uint8)
+
+    def _color(self, tick=None):
+        if tick is not None:
+            self.advance(tick)
+        tick = self.tick
+        phase = self.phase
+        color = self.cfg1.rgb.copy()
+        idle = (phase == Phase.INIT) | (phase == Phase.REPEAT_DELAY)
+        np.copyto(color, self.bg_rgb, where=idle)
+        asleep = idle & (self.phase_end == _NEVER) & (tick - self.phase_start >= _SLEEP_TICKS)
+        np.copyto(color, 0, where=asleep)
+
+        # Fade only the devices in attack (last color to cfg1) or release (cfg1 to background)
+        for fading, src, dst in ((phase == Phase.ATTACK, self.last_rgb, self.cfg1.rgb),
+                                 (phase == Phase.RELEASE, self.cfg1.rgb, self.bg_rgb)):
+            idx = np.flatnonzero(fading)
+            if idx.size == 0:
+                continue
+            start = self.phase_start[idx]
+            duration = np.maximum(self.phase_end[idx] - start, 1)
+            progress = np.clip((tick - start) / duration, 0.0, 1.0).astype(np.float32)
+            mixed = np.zeros(idx.size, dtype=np.uint32)
+            for shift in (16, 8, 0):
+                a = ((src[idx] >> shift) & 0xFF).astype(np.float32)
+                b = ((dst[idx] >> shift) & 0xFF).astype(np.float32)
+                mixed |= np.rint(a + (b - a) * progress).astype(np.uint32) << shift
+            color[idx] = mixed
+        return color
+
+    # Commands
+
+    def apply(self, command, tick=None):
+        """
+        Apply a received command to every device it addresses at a tick (default: now).
+        """
+        if tick is not None:
+            self.advance(tick)
+        if isinstance(command, CommandView):
+            command = command.to_command()
+        handler = self._handlers.get(type(command))
+        if handler is None:
+            return
+        # Field values as received, with the low bits that are not sent on air cleared
+        fields = command._unpack(command._buffer)
+        idx = np.arange(self.num_devices)
+        group_id = fields.get('group_id', 0)
+        if group_id:
+            idx = idx[self.group_id == group_id]
+        if 'chance' in fields:
+            idx = idx[self.rng.random(idx.size) < _CHANCE[int(fields['chance'])]]
+        # A command received without onstrt disables the on-start effect
+        if not fields.get('on_start', True):
+            self.on_start[idx] = False
+        handler(idx, fields)
+
+    def _display(self, idx, start=None):
+        """
+        Start displaying cfg1 now, fading from the color currently displayed.
+        """
+        start = self.tick if start is None else start
+        self.last_rgb[idx] = self._color()[idx]
+        self.num_plays[idx] = 0
+        self.from_cfg2[idx] = False
+        self._start_play(idx, start)
+
+    def _brief_sustain(self, idx, fields):
+        return np.where(fields['gst_enable'], self.gst[idx], _BRIEF_SUSTAIN)
+
+    def _display_brief(self, idx, fields, rgb):
+        self.cfg1.set(idx, rgb, _BRIEF_ATTACK, self._brief_sustain(idx, fields), _BRIEF_RELEASE)
+        self._display(idx)
+
+    def _single_color(self, idx, fields):
+        self._display_brief(idx, fields, _rgb(fields))
+
+    def _single_color_ext(self, idx, fields):
+        sustain_key = int(fields['sustain'])
+        release_key = int(fields['release'])
+        sustain = np.full(idx.size, _TIME_TICKS[sustain_key])
+        if fields['gst_enable'] or (sustain_key == 0b111 and release_key != 0):
+            sustain = self.gst[idx]
+        self.cfg1.set(idx, _rgb(fields), _TIME_TICKS[int(fields['attack'])], sustain,
+                      _TIME_TICKS[release_key], rpen=fields['enable_repeat'])
+        self._display(idx)
+
+    def _two_colors(self, idx, fields):
+        first = _pack_rgb(fields['red1'], fields['green1'], fields['blue1'])
+        second = _pack_rgb(fields['red2'], fields['green2'], fields['blue2'])
+        # Color 1 shows as the attack's start color until the attack towards color 2 begins
+        self.cfg1.set(idx, second, _BRIEF_RELEASE, self._brief_sustain(idx, fields), _BRIEF_RELEASE)
+        self.last_rgb[idx] = first
+        self.num_plays[idx] = 0
+        self.from_cfg2[idx] = False
+        self._enter_phase(idx, Phase.ATTACK, self.tick + _TWO_COLORS_FIRST, _BRIEF_RELEASE)
+
+    def _set_config(self, idx, fields):
+        self.cfg1.set(idx, 0, _TIME_TICKS[int(fields['attack'])], _TIME_TICKS[int(fields['sustain'])],
+                      _TIME_TICKS[int(fields['release'])], dynamic=True, random=fields['is_random'],
+                      profile_lo=fields['profile_id_lo'], profile_hi=fields['profile_id_hi'])
+        if fields['on_start']:
+            self.cfg2.copy_from(self.cfg1, idx)
+            self.on_start[idx] = True
+        self._display(idx)
+
+    def _set_color(self, idx, fields):
+        rgb = _rgb(fields)
+        if fields['is_background']:
+            self.bg_rgb[idx] = rgb
+        else:
+            self.profiles[idx, fields['profile_id']] = rgb
+        if not fields['skip_display']:
+            self._display_brief(idx, fields, rgb)
+
+    def _set_group_sel(self, idx, fields):
+        self.group_sel[idx] = fields['group_sel']
+        self.group_id[idx] = self.group_sel_ids[idx, fields['group_sel']]
+        if not fields['skip_display']:
+            self._display_brief(idx, fields, _rgb(fields))
+
+    def _set_group_id(self, idx, fields):
+        # The cached group id only changes with the next group sel
+        if fields['new_group_id'] != 0:
+            self.group_sel_ids[idx, fields['group_sel']] = fields['new_group_id']
+        if not fields['skip_display']:
+            self._display_brief(idx, fields, _rgb(fields))
+
+    def _set_repeat_delay(self, idx, fields):
+        self.repeat_delay[idx] = _TIME_TICKS[int(fields['repeat_delay'])]
+
+    def _set_repeat_count(self, idx, fields):
+        self.repeat_count[idx] = fields['repeat_count']
+
+    def _set_gst(self, idx, fields):
+        self.gst[idx] = _GST_TICKS[int(fields['global_sustain'])]
+
+    def _ident_fw_version(self, idx, fields):
+        idx = idx[self.firmware_version[idx] == fields['firmware_version']]
+        self._display_brief(idx, fields, _rgb(fields))
+
+    def _do_reset(self, idx, fields):
+        for cfg in (self.cfg1, self.cfg2):
+            cfg.set(idx, 0, 0, 0, 0)
+        self.on_start[idx] = False
+        if not fields['nreset']:
+            self.bg_rgb[idx] = 0
+            self.repeat_delay[idx] = 0
+            self.repeat_count[idx] = 0
+            self.gst[idx] = _DEFAULT_GST
+        self.last_rgb[idx] = 0
+        self.from_cfg2[idx] = False
+        self._enter_phase(idx, Phase.INIT, self.tick, _NEVER - self.tick)
+
+    # Shows
+
+    def run(self, timed_commands, sample_interval_s=1.0, end_s=None):
+        """
+        Apply (time in seconds, command) pairs in time order and generate (time in seconds,
+        colors) samples every sample_interval_s, until end_s or the last command.
+
+        Samples are computed on demand, so a long show does not keep every sample in memory.
+        """
+        timed_commands = sorted(timed_commands, key=lambda x: x[0])
+        if end_s is None:
+            end_s = timed_commands[-1][0] if timed_commands else 0.0
+        sample_ticks = np.arange(0, end_s / TICK_S + 1e-9, sample_interval_s / TICK_S)
+        i = 0
+        for sample_tick in np.rint(sample_ticks).astype(np.int64):
+            while i < len(timed_commands) and round(timed_commands[i][0] / TICK_S) <= sample_tick:
+                time_s, command = timed_commands[i]
+                self.apply(command, round(time_s / TICK_S))
+                i += 1
+            yield sample_tick * TICK_S, self.rgb(sample_tick)
+
+
+def _pack_rgb(red, green, blue):
+    return (red << 16) | (green << 8) | blue
+
+
+def _rgb(fields):
+    return _pack_rgb(fields['red'], fields['green'], fields['blue'])
@@ -0,0 +1,208 @@
+"""
+Incremental decoding of PixMob commands from a continuous IR bit stream.
+
+A live receiver does not segment frames: frames may run together, be cut short, or be
+surrounded by noise. StreamDecoder hunts for frame starts (the single 1 bit of the 0x80
+magic byte) and accepts a frame once its bytes are in the encoding map and its checksum
+matches. Bits before an accepted frame or a rejected start are dropped and never looked at
+again, so the decoder only ever holds the bits of the frame it is trying to match.
+"""
+from pixmob_ir_protocol import Command, CommandDecodeException
+
+
+# Frame sizes in bytes, larger first since a valid 9-byte frame is the stronger match
+# (more bytes checked against the encoding map)
+_FRAME_SIZES = (9, 6)
+# IR bits of a frame: the start bit, then 8 bits for each byte after the magic byte
+_FRAME_BITS = {num_bytes: 1 + 8 * (num_bytes - 1) for num_bytes in _FRAME_SIZES}
+# Bits taken from the input at a time
+_CHUNK_BITS = 64
+
+# Encoded bytes that can end a frame whose last 8 received bits are b, as (byte, bit length),
+# longest first. Trailing 0's of the last byte are trimmed, so the next frame may start
+# within those 8 bits.
+_last_byte_table = [
+    tuple(sorted(((e, e.bit_length()) for e in Command._encoding_map
+                  if b & ((1 << e.bit_length()) - 1) == e), key=lambda x: -x[1]))
+    for b in range(256)
+]
+
+# Sentinels for _match_frame() when a frame start cannot be decided yet or is invalid
+_NEED_MORE = object()
+_INVALID = object()
+
+
+class StreamDecoder:
+    """
+    Stateful decoder that yields commands as soon as their frame completes in the stream.
+
+    verify_checksum: Accept only frames with a matching checksum. Without the checksum, the
+                     encoding map alone is used to find frame boundaries.
+
+    A 6-byte frame is only returned once a 9-byte frame at the same start is ruled out,
+    which usually takes a few more bits (an idle line is never a valid byte).
+    """
+    def __init__(self, verify_checksum=True):
+        self.verify_checksum = verify_checksum
+        # Bits received but not consumed yet, first bit received being the LSB
+        self._bits = 0
+        self._num_bits = 0
+        # Statistics for monitoring the link quality
+        self.num_frames = 0
+        self.num_bits = 0
+        self.num_frame_bits = 0
+
+    def feed(self, bits):
+        """
+        Add received bits to the stream and generate the commands of every completed frame.
+
+        bits: IR bits as a list (or bytes) of 0/1 values, in the order they were received.
+
+        This is a generator: the bits are only processed while it is being iterated.
+        """
+        bits = bytes(bits)
+        for i in range(0, len(bits), _CHUNK_BITS):
+            chunk = bits[i:i + _CHUNK_BITS]
+            value = int(chunk[::-1].translate(Command._bit_chars), 2)
+            self.num_bits += len(chunk)
+            yield from self._push(value, len(chunk))
+
+    def feed_packed(self, data, num_bits=None):
+        """
+        Like feed(), with the bits packed into bytes, first bit being the LSB of the first byte.
+
+        num_bits: Number of valid bits in data. Defaults to all bits, including trailing 0's.
+        """
+        data = bytes(data)
+        if num_bits is None:
+            num_bits = 8 * len(data)
+        for i in range(0, num_bits, _CHUNK_BITS):
+            chunk_bits = min(_CHUNK_BITS, num_bits - i)
+            value = int.from_bytes(data[i // 8:(i + chunk_bits + 7) // 8], 'little')
+            self.num_bits += chunk_bits
+            yield from self._push(value & ((1 << chunk_bits) - 1), chunk_bits)
+
+    def flush(self):
+        """
+        Decode a frame left at the end of the stream and reset the decoder.
+
+        The trailing 0's of a frame are not transmitted, so the last frame of a stream
+        only completes once the idle line after it is fed or the stream is flushed.
+        """
+        # Frames end with a 1 bit, so the padding is never part of a frame
+        yield from self._push(0, _FRAME_BITS[max(_FRAME_SIZES)])
+        self.reset()
+
+    def reset(self):
+        """
+        Drop any partially received frame.
+        """
+        self._bits = 0
+        self._num_bits = 0
+
+    def stats(self) -> dict:
+        """
+        Return the number of frames and bits received, and of bits that were not part of a frame.
+        """
+        return {
+            'frames': self.num_frames,
+            'bits': self.num_bits,
+            'dropped_bits': self.num_bits - self.num_frame_bits - self._num_bits,
+            'pending_bits': self._num_bits,
+        }
+
+    def _consume(self, num_bits):
+        self._bits >>= num_bits
+        self._num_bits -= num_bits
+
+    def _push(self, value, num_bits):
+        self._bits |= value << self._num_bits
+        self._num_bits += num_bits
+
+        while self._bits:
+            # Skip to the next frame start
+            self._consume((self._bits & -self._bits).bit_length() - 1)
+
+            command = self._match()
+            if command is _NEED_MORE:
+                return
+            if command is _INVALID:
+                self._consume(1)
+                continue
+            self.num_frames += 1
+            yield command
+
+        # Only 0's left, which cannot be part of a frame
+        self._num_bits = 0
+
+    def _match(self):
+        """
+        Match a frame starting at the first pending bit and consume it.
+
+        Returns the decoded command, _NEED_MORE if more bits are needed to decide, or
+        _INVALID if no frame starts at this bit.
+        """
+        results = [_match_frame(self._bits, self._num_bits, num_bytes, self.verify_checksum)
+                   for num_bytes in _FRAME_SIZES]
+        if _NEED_MORE in results:
+            # Wait until every frame size is decided
+            return _NEED_MORE
+        results = [result for result in results if result is not _INVALID]
+        if not results:
+            return _INVALID
+
+        if len(results) > 1:
+            # Both sizes are valid: the 9-byte frame may be a 6-byte frame running into the
+            # start of the next frame. Prefer the 6-byte frame if another frame follows it.
+            frame_bits = results[-1][1]
+            next_bits = self._bits >> frame_bits
+            if next_bits:
+                num_zeroes = (next_bits & -next_bits).bit_length() - 1
+                next_results = [_match_frame(next_bits >> num_zeroes,
+                                             self._num_bits - frame_bits - num_zeroes,
+                                             num_bytes, self.verify_checksum)
+                                for num_bytes in _FRAME_SIZES]
+                if _NEED_MORE in next_results:
+                    return _NEED_MORE
+                if any(result is not _INVALID for result in next_results):
+                    results.pop(0)
+
+        command, frame_bits = results[0]
+        self._consume(frame_bits)
+        self.num_frame_bits += frame_bits
+        return command
+
+
+def _match_frame(bits, num_bits, num_bytes, verify_checksum):
+    """
+    Check for a frame of num_bytes bytes starting at the first of num_bits bits.
+
+    Returns the decoded command and the frame length in bits, _NEED_MORE, or _INVALID.
+    """
+    decoding_table = Command._decoding_table
+    num_available = (num_bits - 1) // 8
+
+    # Every complete byte received so far must be in the encoding map
+    encoded_bytes = []
+    for i in range(1, min(num_bytes - 1, num_available + 1)):
+        b = (bits >> (8 * i - 7)) & 0xFF
+        if decoding_table[b] is None:
+            return _INVALID
+        encoded_bytes.append(b)
+    if num_available < num_bytes - 1:
+        return _NEED_MORE
+
+    # The last byte may be shorter than 8 bits; try every encoded byte it may end with
+    last_byte = (bits >> (8 * num_bytes - 15)) & 0xFF
+    checksum = encoded_bytes[0]
+    data_sum = sum(encoded_bytes[1:])
+    for e, e_bits in _last_byte_table[last_byte]:
+        if verify_checksum and Command._encoding_map[((data_sum + e) >> 2) & 0x3F] != checksum:
+            continue
+        frame_bits = _FRAME_BITS[num_bytes] - 8 + e_bits
+        try:
+            command = Command._decode(bits & ((1 << frame_bits) - 1), verify_checksum=verify_checksum)
+        except CommandDecodeException:
+            continue
+        return command, frame_bits
+    return _INVALID
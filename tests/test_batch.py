@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+import pytest
+
+import pixmob_ir_batch
+from pixmob_ir_protocol import (
+    Chance,
+    Command,
+    CommandSetConfig,
+    CommandSetGroupId,
+    CommandSingleColor,
+    CommandSingleColorExt,
+    FieldValueException,
+    Time,
+)
+
+
+def _random_ext_commands(count, seed=0):
+    rng = random.Random(seed)
+    return list({CommandSingleColorExt(red=rng.randrange(64) * 4, green=rng.randrange(64) * 4,
+                                       blue=rng.randrange(64) * 4, group_id=rng.randrange(32),
+                                       chance=Chance(rng.randrange(8)), attack=Time(rng.randrange(8)))
+                 for _ in range(count)})
+
+
+def _scalar_decode(packed):
+    try:
+        return Command.decode(packed)
+    except Exception:
+        return None
+
+
+def test_decode_batch_matches_scalar_decode():
+    # Valid frames, and frames whose fields fail the class checks: on_start without
+    # gst_enable, and a new group id of 0
+    rng = random.Random(0)
+    commands = _random_ext_commands(500)
+    for i in range(50):
+        config = CommandSetConfig(profile_id_lo=i % 16, profile_id_hi=i % 4, is_random=bool(i % 2))
+        commands.append(CommandSetConfig._from_buffer(
+            config._buffer[:2] + (config._buffer[2] | rng.choice([0x01, 0x11]),) + config._buffer[3:],
+            validate=False))
+        group_id = CommandSetGroupId(group_sel=i % 8, new_group_id=1 + i % 31)
+        commands.append(CommandSetGroupId._from_buffer(
+            group_id._buffer[:6] + (group_id._buffer[6] & (0 if i % 2 else 0xFF),) + group_id._buffer[7:],
+            validate=False))
+    frames = [command.encode_packed() for command in commands]
+    expected = [_scalar_decode(frame) for frame in frames]
+    assert sum(command is None for command in expected) > 25
+
+    bits = np.zeros((len(frames), 72), dtype=np.uint8)
+    lengths = np.zeros(len(frames), dtype=np.int64)
+    for i, command in enumerate(commands):
+        encoded = command.encode()
+        bits[i, :len(encoded)] = encoded
+        lengths[i] = len(encoded)
+    result = pixmob_ir_batch.decode_batch(bits, lengths)
+    assert pixmob_ir_batch.to_commands(result) == expected
+    invalid = [command is None for command in expected]
+    assert (result['error'][invalid] == pixmob_ir_batch.DecodeError.INVALID_FIELDS).all()
+
+
+def test_pack_batch_raises_constructor_errors():
+    with pytest.raises(FieldValueException):
+        pixmob_ir_batch.pack_batch(CommandSingleColor, red=[0, 4], green=0, blue=0,
+                                   on_start=[False, True], gst_enable=False)
+    with pytest.raises(ValueError):
+        pixmob_ir_batch.pack_batch(CommandSingleColorExt, red=0, green=0, blue=0, attack=[1, 9])
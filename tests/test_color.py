@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from pixmob_ir_color import ColorQuantizer, color_bits, quantize_colors, quantizer_for
+from pixmob_ir_protocol import Command, CommandSetGroupSel, CommandSingleColor, CommandSingleColorExt
+
+
+@pytest.mark.parametrize('cls, step', [(CommandSingleColor, 4), (CommandSingleColorExt, 4),
+                                       (CommandSetGroupSel, 16)])
+def test_colors_round_to_encodable_values(cls, step):
+    assert color_bits(cls) == {4: 6, 16: 4}[step]
+    rgb = np.arange(256, dtype=np.uint8).reshape(-1, 1).repeat(3, axis=1)
+    quantized, error = quantize_colors(cls, rgb)
+    assert (quantized % step == 0).all()
+    assert (error == quantized.astype(np.float32) - rgb).all()
+    in_range = rgb <= 256 - step
+    assert (np.abs(error[in_range]) <= step / 2).all()
+    # Float input gives the same colors as the lookup tables
+    assert (quantize_colors(cls, rgb.astype(np.float64))[0] == quantized).all()
+
+    # Quantized colors are encoded without losing bits
+    red = int(quantized[130, 0])
+    fields = {'red': red, 'green': 0, 'blue': 0}
+    if cls is CommandSetGroupSel:
+        fields['group_sel'] = 0
+    assert Command.decode(cls(**fields).encode())._field_values['red'] == red
+
+
+def test_gamma_maps_input_levels():
+    quantizer = ColorQuantizer(gamma=2.2)
+    target = quantizer.target(np.array([0, 128, 255], dtype=np.uint8))
+    assert target == pytest.approx([0, 255 * (128 / 255) ** 2.2, 255], abs=1e-3)
+
+
+def test_dither_averages_to_the_target():
+    quantizer = quantizer_for(CommandSingleColor, dither=True)
+    frame = np.full((4, 3), 130, dtype=np.uint8)
+    frames = [quantizer.quantize(frame)[0] for _ in range(100)]
+    assert np.mean(frames) == pytest.approx(130, abs=0.05)
+    assert len(np.unique(frames)) == 2
+
+    quantizer.reset()
+    assert (quantizer.quantize(frame)[0] == frames[0]).all()
+    # Without dithering the same color is sent every frame
+    assert (ColorQuantizer().quantize(frame)[0] == 128).all()
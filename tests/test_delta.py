@@ -0,0 +1,57 @@
+import numpy as np
+
+from pixmob_ir_delta import NUM_GROUPS, DeltaEncoder
+
+
+def _group_ids(commands):
+    return [command._field_values['group_id'] for command in commands]
+
+
+def _frame(rgb=(0, 0, 0)):
+    return np.tile(np.array(rgb, dtype=np.uint8), (NUM_GROUPS, 1))
+
+
+def test_shared_color_collapses_to_group_0():
+    encoder = DeltaEncoder(frame_rate=1)
+    frame = _frame((252, 0, 0))
+    commands = encoder.encode_frame(frame)
+    assert _group_ids(commands) == [0]
+    assert commands[0]._field_values['red'] == 252
+
+    # Most groups turn blue: group 0 sets them all, then the others get their own color,
+    # largest change first
+    frame[4] = (0, 252, 0)
+    frame[6:] = (0, 0, 252)
+    assert _group_ids(encoder.encode_frame(frame)) == [0, 5, 1, 2, 3, 4, 6]
+    assert encoder.encode_frame(frame) == []
+
+
+def test_changes_within_the_threshold_are_suppressed():
+    encoder = DeltaEncoder(frame_rate=1, threshold=8)
+    frame = _frame((128, 0, 0))
+    encoder.encode_frame(frame)
+    frame[3] = (136, 0, 0)
+    assert encoder.encode_frame(frame) == []
+    assert encoder.stats()['suppressed'] == 1
+    frame[3] = (140, 0, 0)
+    assert _group_ids(encoder.encode_frame(frame)) == [4]
+
+
+def test_updates_beyond_the_airtime_are_deferred_or_dropped():
+    encoder = DeltaEncoder(frame_rate=30)
+    frame = np.array([[8 * i, 0, 0] for i in range(NUM_GROUPS)], dtype=np.uint8)
+    assert len(encoder.encode_frame(frame)) == 1
+    assert encoder.stats()['deferred'] == NUM_GROUPS - 1
+
+    # A deferred group changes color: its older update is dropped, and it is sent first
+    # as the largest change
+    frame[20] = (0, 0, 252)
+    assert _group_ids(encoder.encode_frame(frame)) == [21]
+    stats = encoder.stats()
+    assert stats['dropped'] == 1
+    assert stats['deferred'] == 2 * (NUM_GROUPS - 1) - 1
+    assert stats['pending'] == NUM_GROUPS - 2
+
+    commands = [command for _, commands in encoder.stream([frame] * 100) for command in commands]
+    assert sorted(_group_ids(commands)) == [i for i in range(1, NUM_GROUPS) if i != 21]
+    assert encoder.stats()['pending'] == 0
@@ -0,0 +1,67 @@
+import random
+
+import numpy as np
+import pytest
+
+from pixmob_ir_bench import random_field_values
+from pixmob_ir_demod import demodulate
+from pixmob_ir_protocol import Command
+from pixmob_ir_pulse import SLOT_US, frame_pulses, pulse_train
+
+
+def _commands(count=40, seed=0):
+    rng = random.Random(seed)
+    return [cls(**fields) for cls in Command._commands
+            for fields in random_field_values(cls, count // len(Command._commands) + 1, rng)]
+
+
+def _edge_times(pulses, drift=1.0, bias_us=0.0, jitter_us=0.0, seed=0):
+    """
+    Edge times in seconds of a pulse train as captured by a receiver whose clock runs drift
+    times slower, with marks stretched by bias_us and Gaussian jitter on every duration.
+    """
+    durations = np.array(pulses, dtype=np.float64) * drift
+    durations[0::2] += bias_us
+    durations[1::2] -= bias_us
+    durations += np.random.default_rng(seed).normal(0, jitter_us, len(durations))
+    return np.concatenate([[0.001], 0.001 + np.cumsum(durations) / 1e6])
+
+
+@pytest.mark.parametrize('drift, bias_us, jitter_us', [
+    (1.0, 0.0, 0.0),
+    (1.06, 0.0, 20.0),
+    (0.95, 90.0, 20.0),
+])
+def test_frames_round_trip_through_edges(drift, bias_us, jitter_us):
+    commands = _commands()
+    frames = demodulate(_edge_times(pulse_train(commands), drift, bias_us, jitter_us))
+    assert [frame.command for frame in frames] == commands
+    assert [frame.encoded_bits for frame in frames] == \
+        [command.encode() for command in commands]
+    assert all(frame.slot_us == pytest.approx(SLOT_US * drift, rel=0.01) for frame in frames)
+    assert np.mean([frame.bias_us for frame in frames]) == pytest.approx(bias_us, abs=10)
+    assert all(frame.num_glitches == 0 and frame.max_error < 0.25 for frame in frames)
+    assert all(a.end_us < b.start_us for a, b in zip(frames, frames[1:]))
+
+
+def test_glitches_are_counted():
+    command = _commands()[0]
+    pulses = list(frame_pulses(command))
+    i = max(range(0, len(pulses), 2), key=pulses.__getitem__)
+    assert pulses[i] >= 2 * SLOT_US
+    # Cut the longest mark after its first slot with a 40us dropout
+    pulses[i:i + 1] = [SLOT_US - 20, 40, pulses[i] - SLOT_US - 20]
+    frames = demodulate(_edge_times(pulses + [10 * SLOT_US]))
+    assert len(frames) == 1
+    assert frames[0].num_glitches == 1
+    assert frames[0].max_error > 0
+    assert frames[0].command == command
+
+
+def test_undecodable_frames_keep_their_error():
+    command = _commands()[0]
+    pulses = list(frame_pulses(command))
+    pulses[-1] += 3 * SLOT_US
+    frames = demodulate(_edge_times(pulses + [10 * SLOT_US]))
+    assert frames[0].command is None
+    assert frames[0].error
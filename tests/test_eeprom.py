@@ -0,0 +1,39 @@
+import pytest
+
+from pixmob_ir_eeprom import EepromImage
+from pixmob_ir_protocol import (
+    CommandSetColor,
+    CommandSetConfig,
+    CommandSetGroupId,
+    CommandSetGroupSel,
+    CommandSetRepeatCount,
+    Time,
+)
+
+
+def test_apply_stores_colors_as_sent():
+    image = EepromImage.factory()
+    image.apply(CommandSetColor(profile_id=1, red=255, green=1, blue=3))
+    assert image.get('profile_1') == bytes([0x00, 0xFC, 0x00, 0xFC])
+    assert image.profile_rgb(1) == (0xFC, 0x00, 0x00)
+
+
+@pytest.mark.parametrize('commands', [
+    [CommandSetColor(profile_id=1, red=255, green=1, blue=3)],
+    [CommandSetColor(profile_id=i, red=17 * i, green=255 - 17 * i, blue=7 * i) for i in range(16)],
+    [CommandSetRepeatCount(repeat_count=200), CommandSetGroupId(group_sel=3, new_group_id=7),
+     CommandSetGroupSel(group_sel=3)],
+    [CommandSetConfig(on_start=True, gst_enable=True, profile_id_lo=0, profile_id_hi=7,
+                      is_random=True, attack=Time.TIME_96_MS)],
+])
+def test_apply_then_plan_round_trips(commands):
+    target = EepromImage.factory()
+    for command in commands:
+        assert target.apply(command)
+
+    image = EepromImage.factory()
+    plan = image.plan(target)
+    for command in plan:
+        image.apply(command)
+    assert image == target
+    assert image.plan(target) == []
@@ -0,0 +1,49 @@
+import pixmob_ir_protocol
+from pixmob_ir_protocol import (
+    Command,
+    CommandDecodeException,
+    CommandSingleColor,
+    CommandSingleColorExt,
+    disable_metrics,
+    enable_metrics,
+)
+from pixmob_ir_stream import StreamDecoder
+
+
+def test_metrics_count_each_public_call():
+    original = Command.encode_int, Command.decode
+    command = CommandSingleColor(red=8, green=0, blue=0)
+    packed = command.encode_packed()
+    metrics = enable_metrics()
+    try:
+        command.encode()
+        command.encode()
+        command.encode_packed()
+        command.encode_int()
+        Command.decode(packed)
+        try:
+            Command.decode([1, 0, 1])
+        except CommandDecodeException:
+            pass
+        assert metrics.encode_counts == {'CommandSingleColor': 4}
+        assert metrics.decode_counts == {'CommandSingleColor': 1}
+        assert metrics.decode_errors == {'invalid_size': 1}
+        assert 'pixmob_ir_decode_errors_total{reason="invalid_size"} 1' in metrics.to_prometheus()
+    finally:
+        disable_metrics()
+    assert (Command.encode_int, Command.decode) == original
+    assert pixmob_ir_protocol.metrics is None
+
+
+def test_stream_trials_are_not_counted():
+    commands = [CommandSingleColorExt(red=4 * i, green=0, blue=0, group_id=i % 32) if i % 2 else
+                CommandSingleColor(red=4 * i, green=0, blue=0) for i in range(50)]
+    bits = [bit for command in commands for bit in command.encode() + [0] * 5]
+    metrics = enable_metrics()
+    try:
+        assert list(StreamDecoder().feed(bits)) == commands
+        assert metrics.decode_counts == {}
+        assert metrics.decode_errors == {}
+        assert metrics.generic_fallbacks == 0
+    finally:
+        disable_metrics()
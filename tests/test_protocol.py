@@ -0,0 +1,80 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from pixmob_ir_protocol import (
+    Command,
+    CommandDecodeException,
+    CommandLayoutException,
+    CommandSetConfig,
+    CommandSingleColor,
+    FieldValueException,
+    Time,
+)
+
+
+def test_commands_are_immutable():
+    command = CommandSingleColor(red=252, green=0, blue=0)
+    with pytest.raises(TypeError):
+        command._field_values['red'] = 0
+    with pytest.raises(AttributeError):
+        command.__init__(red=0, green=0, blue=0)
+    with pytest.raises(AttributeError):
+        command.red = 0
+    assert command._field_values['red'] == 252
+
+
+def test_pickled_commands_keep_their_fields():
+    command = CommandSingleColor(red=255, green=0, blue=0)
+    restored = pickle.loads(pickle.dumps(command))
+    assert restored == command and hash(restored) == hash(command)
+    assert restored._field_values['red'] == 255
+
+
+def test_decode_nearest_weighs_only_valid_commands():
+    command = CommandSetConfig(profile_id_lo=1, profile_id_hi=0, is_random=False,
+                               attack=Time.TIME_32_MS, sustain=Time.TIME_96_MS)
+    encoded_bytes = Command._read_frame(command.encode())
+    flip_odds = 0.05 / (1 - 0.05)
+    total_weight = 0
+    for distance, data_bytes in Command._nearest_frames(encoded_bytes, 2):
+        try:
+            Command._from_decoded([encoded_bytes[0], 0]
+                                  + [Command._decoding_table[b] for b in data_bytes])
+        except CommandDecodeException:
+            continue
+        total_weight += flip_odds ** distance
+    decoded, confidence = Command.decode_nearest(command.encode())
+    assert decoded == command
+    assert confidence == pytest.approx(1 / total_weight)
+
+
+def test_invalid_fields_raise_real_exceptions():
+    # on_start without gst_enable, which the field checks reject
+    with pytest.raises(FieldValueException):
+        CommandSingleColor(red=0, green=0, blue=0, on_start=True, gst_enable=False)
+    buffer = CommandSingleColor._pack({'on_start': True, 'gst_enable': False,
+                                       'red': 0, 'green': 0, 'blue': 0})
+    encoded = CommandSingleColor._from_buffer(buffer, validate=False).encode_int()
+    with pytest.raises(CommandDecodeException) as e:
+        Command.decode(encoded)
+    assert e.value.reason == 'invalid_fields'
+
+
+def test_layout_conflicts_raise():
+    with pytest.raises(CommandLayoutException):
+        class CommandConflict(Command):
+            _num_bytes  = 6
+            _flags_type = 0b000
+            _fields = {}
+    assert Command._command_index[(6, 0b000, None)] is CommandSingleColor
+
+
+def test_decode_accepts_any_sequence_of_bits():
+    command = CommandSingleColor(red=252, green=0, blue=0)
+    encoded = command.encode()
+    assert Command.decode(np.array(encoded)) == command
+    assert Command.decode(np.array(encoded, dtype=bool)) == command
+    assert Command.decode(bit for bit in encoded) == command
+    assert Command.decode_nearest(np.array(encoded))[0] == command
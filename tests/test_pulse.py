@@ -0,0 +1,62 @@
+import random
+
+from pixmob_ir_bench import random_field_values
+from pixmob_ir_protocol import Command, CommandSingleColor
+from pixmob_ir_pulse import (
+    DEFAULT_CONFIG,
+    PulseTrainConfig,
+    frame_pulses,
+    iter_pulses,
+    pulse_train,
+    pulses_to_bits,
+)
+
+
+def _commands(count_per_class=10, seed=0):
+    rng = random.Random(seed)
+    return [cls(**fields) for cls in Command._commands
+            for fields in random_field_values(cls, count_per_class, rng)]
+
+
+def test_frame_pulses_round_trip():
+    for command in _commands():
+        pulses = frame_pulses(command)
+        assert len(pulses) % 2 == 1
+        assert pulses_to_bits(pulses) == command.encode()
+        assert frame_pulses(command.encode()) == pulses
+        assert frame_pulses(command.encode_packed()) == pulses
+
+
+def test_long_durations_are_split():
+    config = PulseTrainConfig(slot_us=30000, gap_us=100000)
+    # 0b111 0 1: a 3-slot mark, then a 1-slot space and mark
+    pulses = frame_pulses(0b10111, config)
+    assert list(pulses) == [0xFFFF, 0, 90000 - 0xFFFF, 30000, 30000]
+    assert pulses_to_bits(pulses, config) == [1, 1, 1, 0, 1]
+
+    chunk = next(iter_pulses([0b1], config))
+    assert list(chunk) == [30000, 0xFFFF, 0, 100000 - 0xFFFF]
+
+
+def test_marks_align_to_carrier_periods():
+    config = PulseTrainConfig(align_to_carrier=True)
+    period_us = 1e6 / config.carrier_hz
+    command = CommandSingleColor(red=252, green=0, blue=0)
+    pulses = frame_pulses(command, config)
+    for mark in pulses[0::2]:
+        assert abs(mark / period_us - round(mark / period_us)) < 0.05
+    for space in pulses[1::2]:
+        assert space % config.slot_us == 0
+    assert pulses_to_bits(pulses, config) == command.encode()
+
+
+def test_chunks_end_with_the_gap():
+    commands = _commands(1)
+    chunks = list(iter_pulses(commands))
+    for chunk, command in zip(chunks, commands):
+        assert len(chunk) % 2 == 0
+        assert chunk[-1] == DEFAULT_CONFIG.gap_us
+        assert pulses_to_bits(chunk) == command.encode()
+    assert pulse_train(commands) == sum(chunks[1:], chunks[0])
+    # An empty sequence has no frame and no gap
+    assert list(next(iter_pulses([0]))) == []
@@ -0,0 +1,44 @@
+from pixmob_ir_protocol import CommandSetColor
+from pixmob_ir_render import RenderCache, render_library
+from pixmob_ir_show import Cue
+
+
+PALETTE = [(252, 0, 0), (0, 252, 0)]
+
+
+def make_cue(i):
+    red, green, blue = PALETTE[i % len(PALETTE)]
+    return Cue(i * 0.5, [CommandSetColor(red=red, green=green, blue=blue, profile_id=i % 16)], name=f"cue {i}")
+
+
+def test_cache_follows_cue_content(tmp_path):
+    global PALETTE
+    path = tmp_path / 'cache.json'
+    cache = RenderCache(path)
+    first = render_library(make_cue, range(6), max_workers=0, cache=cache)
+    cache.save()
+
+    cache = RenderCache(path)
+    again = render_library(make_cue, range(6), max_workers=0, cache=cache)
+    assert (cache.hits, cache.misses) == (6, 0)
+    assert [r.frames for r in again] == [r.frames for r in first]
+
+    PALETTE = [(0, 0, 252), (0, 252, 0)]
+    try:
+        cache = RenderCache(path)
+        changed = render_library(make_cue, range(6), max_workers=0, cache=cache)
+        assert (cache.hits, cache.misses) == (3, 3)
+        uncached = render_library(make_cue, range(6), max_workers=0)
+        assert [r.frames for r in changed] == [r.frames for r in uncached]
+    finally:
+        PALETTE = [(252, 0, 0), (0, 252, 0)]
+
+
+def test_workers_match_inline_render():
+    cache = RenderCache()
+    render_library(make_cue, range(0, 8, 2), max_workers=0, cache=cache)
+    inline = render_library(make_cue, range(8), max_workers=0)
+    parallel = render_library(make_cue, range(8), max_workers=2, cache=cache)
+    assert [(r.time_s, r.name, r.frames, r.key) for r in parallel] == \
+        [(r.time_s, r.name, r.frames, r.key) for r in inline]
+    assert cache.hits == 4
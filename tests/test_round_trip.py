@@ -0,0 +1,111 @@
+"""
+Round trips of every command class through the scalar and batch codecs.
+
+Classes whose field space (see pixmob_ir_bench.field_space()) holds at most
+EXHAUSTIVE_LIMIT commands are checked in full. Every class is also checked on seeded random
+commands, taking every value of each field at least once.
+"""
+import random
+
+import numpy as np
+import pytest
+
+import pixmob_ir_batch
+from pixmob_ir_bench import field_space, field_space_size
+from pixmob_ir_protocol import (
+    Command,
+    CommandSetConfig,
+    CommandSetRepeatCount,
+    CommandSingleColor,
+    CommandView,
+    FieldValueException,
+)
+
+
+EXHAUSTIVE_LIMIT = 1 << 20
+
+_exhaustive_classes = [cls for cls in Command._commands if field_space_size(cls) <= EXHAUSTIVE_LIMIT]
+
+
+def _ids(classes):
+    return [cls.__name__ for cls in classes]
+
+
+def _build(cls, field_values):
+    try:
+        return cls(**field_values)
+    except FieldValueException:
+        # Rejected by the class's field checks
+        return None
+
+
+def _check_round_trip(command):
+    for encoded in (command.encode(), command.encode_packed(), command.encode_int()):
+        decoded = Command.decode(encoded)
+        assert decoded == command
+        assert decoded._buffer == command._buffer
+    view = Command.decode(command.encode_packed(), lazy=True)
+    assert isinstance(view, CommandView)
+    assert view.to_command() == command
+
+
+def test_field_spaces_cover_every_field_value():
+    assert [int(value) for value in field_space(CommandSetConfig)['profile_id_hi']] == list(range(16))
+    assert field_space(CommandSetRepeatCount)['repeat_count'] == list(range(256))
+    assert field_space(CommandSingleColor)['red'] == list(range(0, 256, 4))
+    assert {CommandSingleColor, CommandSetConfig}.issubset(_exhaustive_classes)
+
+
+@pytest.mark.parametrize('cls', _exhaustive_classes, ids=_ids(_exhaustive_classes))
+def test_exhaustive_round_trip(cls):
+    space = field_space(cls)
+    grids = np.meshgrid(*(np.array([int(value) for value in values], dtype=np.int64)
+                          for values in space.values()), indexing='ij')
+    columns = {name: grid.reshape(-1) for name, grid in zip(space, grids)}
+    valid = pixmob_ir_batch._validate_rows(cls, columns, raise_errors=False)
+    columns = {name: column[valid] for name, column in columns.items()}
+    buffers = pixmob_ir_batch.pack_batch(cls, **columns)
+
+    # Batch codec
+    encoded_bits, lengths = pixmob_ir_batch.encode_buffers(buffers)
+    result = pixmob_ir_batch.decode_batch(encoded_bits, lengths)
+    assert (result['error'] == pixmob_ir_batch.DecodeError.NONE).all()
+    assert (result['class_id'] == Command._commands.index(cls)).all()
+    for name, column in columns.items():
+        assert (result[name] == column).all(), name
+
+    # Scalar codec: every frame decodes to its buffer and encodes back to the same frame
+    packed = np.packbits(encoded_bits, axis=1, bitorder='little')
+    decode = Command.decode
+    for buffer, frame, num_bits in zip(map(tuple, buffers.tolist()), packed, lengths.tolist()):
+        frame = int.from_bytes(frame.tobytes(), 'little')
+        assert frame.bit_length() == num_bits
+        command = decode(frame)
+        assert type(command) is cls and command._buffer == buffer
+        assert command.encode_int() == frame
+
+
+@pytest.mark.parametrize('cls', Command._commands, ids=_ids(Command._commands))
+def test_random_round_trip(cls):
+    rng = random.Random(cls.__name__)
+    space = field_space(cls)
+    field_sets = []
+    # Every value of each field, with random values of the other fields
+    for name, values in space.items():
+        for value in values:
+            field_values = {other: rng.choice(other_values) for other, other_values in space.items()}
+            field_values[name] = value
+            field_sets.append(field_values)
+    field_sets.extend({name: rng.choice(values) for name, values in space.items()} for _ in range(500))
+
+    commands = [command for command in (_build(cls, f) for f in field_sets) if command is not None]
+    assert commands
+    for command in commands:
+        _check_round_trip(command)
+
+    # The batch codec agrees with the scalar one
+    encoded_bits, lengths = pixmob_ir_batch.encode_batch(cls, commands)
+    for command, bits, length in zip(commands, encoded_bits, lengths):
+        assert bits[:length].tolist() == command.encode()
+    decoded = pixmob_ir_batch.to_commands(pixmob_ir_batch.decode_batch(encoded_bits, lengths))
+    assert decoded == commands
@@ -0,0 +1,108 @@
+import asyncio
+
+from pixmob_ir_protocol import Command, CommandSetColor, CommandSetConfig, CommandSingleColor
+from pixmob_ir_pulse import DEFAULT_CONFIG
+from pixmob_ir_scheduler import MemoryTransport, TransmitScheduler
+
+
+def _color(red):
+    return CommandSingleColor(red=red, green=0, blue=0)
+
+
+def _profile(profile_id, red=0, blue=0):
+    return CommandSetColor(red=red, green=0, blue=blue, profile_id=profile_id,
+                           skip_display=True, is_background=False, group_id=0)
+
+
+def _sent(transport):
+    return [Command.decode(encoded_bits) for _, encoded_bits in transport.frames]
+
+
+def _run(scenario):
+    async def main():
+        transport = MemoryTransport()
+        scheduler = TransmitScheduler(transport)
+        await scenario(scheduler, transport)
+        await scheduler.stop()
+        return scheduler, transport
+    return asyncio.run(main())
+
+
+def test_frames_are_paced_by_airtime():
+    commands = [_color(4 * i) for i in range(5)]
+
+    async def scenario(scheduler, transport):
+        futures = [scheduler.submit(command, coalesce=False) for command in commands]
+        scheduler.start()
+        await scheduler.drain()
+        assert all(future.result() for future in futures)
+
+    scheduler, transport = _run(scenario)
+    assert _sent(transport) == commands
+    for (start, _), (end, encoded_bits) in zip(transport.frames, transport.frames[1:]):
+        airtime_s = DEFAULT_CONFIG.airtime_us(len(encoded_bits)) / 1e6
+        assert end - start >= airtime_s * 0.99
+    assert scheduler.latency_stats()['sent'] == 5
+
+
+def test_higher_priorities_are_sent_first():
+    async def scenario(scheduler, transport):
+        scheduler.submit(_color(4), coalesce=False)
+        scheduler.submit(_color(8), priority=1, coalesce=False)
+        scheduler.submit(_color(12), coalesce=False)
+        scheduler.start()
+        await scheduler.drain()
+
+    _, transport = _run(scenario)
+    assert _sent(transport) == [_color(8), _color(4), _color(12)]
+
+
+def test_superseding_command_keeps_the_queue_position():
+    red, blue = _profile(0, red=252), _profile(0, blue=252)
+    config = CommandSetConfig(profile_id_lo=0, profile_id_hi=0, is_random=False)
+
+    async def scenario(scheduler, transport):
+        red_future = scheduler.submit(red)
+        scheduler.submit(config)
+        blue_future = scheduler.submit(blue)
+        assert scheduler.queue_size() == 2
+        scheduler.start()
+        await scheduler.drain()
+        assert red_future.result() is False and blue_future.result() is True
+
+    scheduler, transport = _run(scenario)
+    assert _sent(transport) == [blue, config]
+    assert scheduler.num_superseded == 1
+
+
+def test_drain_waits_for_every_command():
+    async def scenario(scheduler, transport):
+        scheduler.start()
+        await scheduler.drain()
+        scheduler.submit(_color(4), coalesce=False)
+        scheduler.submit(_color(8), coalesce=False)
+        await scheduler.drain()
+        assert scheduler.queue_size() == 0
+
+    _, transport = _run(scenario)
+    assert len(transport.frames) == 2
+
+
+def test_stop_keeps_the_command_being_sent_queued():
+    async def scenario(scheduler, transport):
+        futures = [scheduler.submit(_color(4 * i), coalesce=False) for i in range(3)]
+        scheduler.start()
+        # Stop while the second frame waits for the first one's airtime
+        while not transport.frames:
+            await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        await scheduler.stop()
+        assert len(transport.frames) == 1 and scheduler.queue_size() == 2
+        assert not futures[1].done()
+
+        scheduler.start()
+        await scheduler.drain()
+        assert all(future.result() for future in futures)
+
+    _, transport = _run(scenario)
+    assert _sent(transport) == [_color(0), _color(4), _color(8)]
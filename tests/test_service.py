@@ -0,0 +1,27 @@
+import io
+import json
+
+from pixmob_ir_protocol import CommandSingleColor
+from pixmob_ir_service import Service
+
+
+def _run(data, default_format='bits'):
+    stdout = io.BytesIO()
+    Service(default_format).run(io.BufferedReader(io.BytesIO(data)), stdout)
+    return [json.loads(line) for line in stdout.getvalue().decode().splitlines()]
+
+
+def test_encode_decode_round_trip():
+    command = CommandSingleColor(red=252, green=0, blue=0)
+    encode = {'id': 1, 'command': 'SingleColor', 'fields': {'red': 252, 'green': 0, 'blue': 0}}
+    decode = {'id': 2, 'hex': command.encode_packed().hex()}
+    results = _run((json.dumps(encode) + '\n' + json.dumps(decode) + '\n').encode(), 'hex')
+    assert results[0] == {'id': 1, 'ok': True, 'hex': command.encode_packed().hex()}
+    assert results[1]['ok'] and results[1]['command'] == 'CommandSingleColor'
+    assert results[1]['fields']['red'] == 252
+
+
+def test_invalid_utf8_line_is_an_error_record():
+    results = _run(b'{"id": 1, "int": 1}\n\xff\xfe\n{"id": 3, "command": "DoReset", "fields": {"nreset": true}}')
+    assert [result['ok'] for result in results] == [False, False, True]
+    assert results[1]['error'].startswith('UnicodeDecodeError')
@@ -0,0 +1,29 @@
+import random
+
+import pytest
+
+from pixmob_ir_bench import random_field_values
+from pixmob_ir_protocol import Chance, CommandSingleColor, CommandSingleColorExt, Time
+from pixmob_ir_shortest import equivalent_forms, frame_bits, shortest_form
+
+
+def _applicable_ext(red, sustain):
+    return CommandSingleColorExt(red=red, green=0, blue=0, gst_enable=True, sustain=sustain,
+                                 chance=Chance.CHANCE_100_PCT, attack=Time.TIME_0_MS,
+                                 release=Time.TIME_32_MS)
+
+
+def test_ext_with_single_color_timers_becomes_single_color():
+    command = _applicable_ext(252, Time.TIME_960_MS)
+    shortest = shortest_form(command)
+    assert shortest == CommandSingleColor(red=252, green=0, blue=0, gst_enable=True)
+    assert frame_bits(shortest) == len(shortest.encode()) < len(command.encode())
+
+
+@pytest.mark.parametrize('cls', [CommandSingleColor, CommandSingleColorExt])
+def test_shortest_form_is_shortest_equivalent_form(cls):
+    commands = [cls(**fields) for fields in random_field_values(cls, 500, random.Random(0))]
+    commands += [_applicable_ext(4 * i, Time(i % 8)) for i in range(64)]
+    for command in commands:
+        if type(command) is cls:
+            assert shortest_form(command) == min(equivalent_forms(command), key=frame_bits)
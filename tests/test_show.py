@@ -0,0 +1,62 @@
+import pytest
+
+from pixmob_ir_protocol import CommandSetColor, CommandSetConfig, CommandSingleColor
+from pixmob_ir_show import Cue, ScheduledCommand, ShowSchedule, ShowScheduleException, compile_show
+
+
+def _write(profile_id, red=0, green=0, blue=0, group_id=0):
+    return CommandSetColor(red=red, green=green, blue=blue, profile_id=profile_id,
+                           skip_display=True, is_background=False, group_id=group_id)
+
+
+def _config(lo, hi):
+    return CommandSetConfig(profile_id_lo=lo, profile_id_hi=hi, is_random=False)
+
+
+def test_configs_read_the_profiles_written_before_them():
+    red, blue = _write(0, red=252), _write(0, blue=252)
+    schedule = compile_show([Cue(1.0, [red, _config(0, 0), blue, _config(0, 0)])])
+    assert schedule.commands() == [red, _config(0, 0), blue, _config(0, 0)]
+    assert schedule.num_dropped == 0
+
+
+def test_redundant_profile_writes_are_dropped():
+    red, blue = _write(1, red=252), _write(1, blue=252)
+    schedule = compile_show([
+        Cue(1.0, [red, blue, _config(1, 1)]),
+        Cue(2.0, [blue, _config(1, 1)]),
+    ])
+    assert schedule.commands() == [blue, _config(1, 1), _config(1, 1)]
+    assert schedule.num_dropped == 2
+
+
+def test_group_0_writes_reset_other_groups():
+    red, blue_5 = _write(2, red=252), _write(2, blue=252, group_id=5)
+    schedule = compile_show([Cue(1.0, [red, blue_5]), Cue(2.0, [red])])
+    assert schedule.commands() == [red, blue_5, red]
+
+
+def test_profile_ranges_move_to_loaded_colors():
+    schedule = compile_show([
+        Cue(1.0, [_write(0, red=252), _write(1, blue=252), _config(0, 1)]),
+        Cue(3.0, [_write(4, red=252), _write(5, blue=252), _config(4, 5)]),
+    ])
+    assert schedule.commands()[3:] == [_config(0, 1)]
+    assert schedule.num_dropped == 2
+
+
+def test_cues_finish_by_their_time_or_are_missed():
+    commands = [CommandSingleColor(red=4 * i, green=0, blue=0) for i in range(10)]
+    schedule = compile_show([Cue(2.0, commands[:2]), Cue(0.1, commands)])
+    assert [missed.cue_index for missed in schedule.missed] == [1]
+    assert schedule.missed[0].late_s > 0
+    assert schedule.entries[-1].end_s == pytest.approx(2.0)
+    assert [entry.cue_index for entry in schedule.entries] == [1] * 10 + [0] * 2
+
+
+def test_verify_raises_on_overlapping_frames():
+    command = CommandSingleColor(red=252, green=0, blue=0)
+    schedule = ShowSchedule([ScheduledCommand(0.0, 0.1, command, 0),
+                             ScheduledCommand(0.01, 0.1, command, 0)], [], 0)
+    with pytest.raises(ShowScheduleException):
+        schedule.verify()
@@ -0,0 +1,62 @@
+import pytest
+
+from pixmob_ir_protocol import CommandSetColor, CommandSingleColor, CommandSingleColorExt, CommandView
+from pixmob_ir_show import Cue, compile_show
+from pixmob_ir_showfile import ShowFile, ShowFileException, ShowFileWriter
+
+
+def _timed_commands():
+    return [
+        (2.5, CommandSingleColorExt(red=0, green=252, blue=0, group_id=7)),
+        (0.0, CommandSingleColor(red=252, green=0, blue=0)),
+        (1.0, CommandSetColor(red=0, green=0, blue=252, profile_id=3, skip_display=True,
+                              is_background=False, group_id=2)),
+        (1.0, CommandSingleColor(red=0, green=0, blue=4)),
+    ]
+
+
+def _write(path, timed_commands):
+    with ShowFileWriter(path) as writer:
+        for time_s, command in timed_commands:
+            writer.add(time_s, command)
+    return path
+
+
+def test_show_file_round_trip(tmp_path):
+    timed_commands = _timed_commands()
+    expected = sorted(timed_commands, key=lambda timed: timed[0])
+    with ShowFile(_write(tmp_path / 'show.pxsf', timed_commands)) as show:
+        assert len(show) == 4
+        assert list(show.commands()) == expected
+        record = show[1]
+        assert (record.class_name, record.group_id) == ('CommandSetColor', 2)
+        assert record.encode() == expected[1][1].encode()
+        assert record.encode_packed() == expected[1][1].encode_packed()
+        assert isinstance(record.decode(lazy=True), CommandView)
+        assert show[-1].decode() == expected[-1][1]
+
+        assert show.seek(0.5) == 1 and show.seek(1.0) == 1 and show.seek(3.0) == 4
+        assert [r.time_s for r in show.records(1.0, 2.5)] == [1.0, 1.0]
+        assert [r.time_s for r in show.records(start_s=1.5)] == [2.5]
+        with pytest.raises(IndexError):
+            show[4]
+
+
+def test_show_file_from_schedule(tmp_path):
+    commands = [CommandSingleColor(red=4 * i, green=0, blue=0) for i in range(3)]
+    schedule = compile_show([Cue(1.0, commands)])
+    with ShowFileWriter(tmp_path / 'show.pxsf') as writer:
+        writer.add_schedule(schedule)
+    with ShowFile(tmp_path / 'show.pxsf') as show:
+        assert [command for _, command in show.commands()] == commands
+        assert show.time_s(0) == pytest.approx(schedule.entries[0].start_s, abs=1e-6)
+
+
+def test_invalid_show_files_are_rejected(tmp_path):
+    data = _write(tmp_path / 'show.pxsf', _timed_commands()).read_bytes()
+    for name, content in [('magic', b'XXXX' + data[4:]), ('records', data[:-10]),
+                          ('header', data[:8])]:
+        path = tmp_path / f'{name}.pxsf'
+        path.write_bytes(content)
+        with pytest.raises(ShowFileException):
+            ShowFile(path)
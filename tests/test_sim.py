@@ -0,0 +1,17 @@
+import numpy as np
+
+from pixmob_ir_protocol import CommandSetGroupSel, CommandSingleColorExt, Time
+from pixmob_ir_sim import CrowdSimulator
+
+
+def test_colors_are_displayed_as_sent_on_air():
+    sim = CrowdSimulator(4, seed=0)
+    sim.apply(CommandSingleColorExt(red=255, green=3, blue=130, attack=Time.TIME_0_MS,
+                                    sustain=Time.TIME_3840_MS, release=Time.TIME_0_MS), tick=0)
+    assert (sim.rgb(10) == np.array([0xFC, 0x00, 0x80], dtype=np.uint8)).all()
+
+
+def test_group_sel_colors_keep_their_4_encoded_bits():
+    sim = CrowdSimulator(4, seed=0)
+    sim.apply(CommandSetGroupSel(group_sel=0, red=0xFF, green=0x7F, blue=0x1F), tick=0)
+    assert (sim.rgb(1) == np.array([0xF0, 0x70, 0x10], dtype=np.uint8)).all()
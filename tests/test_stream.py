@@ -0,0 +1,89 @@
+import random
+
+import numpy as np
+
+from pixmob_ir_bench import random_field_values
+from pixmob_ir_protocol import Command
+from pixmob_ir_stream import StreamDecoder
+
+
+def _commands(count_per_class=20, seed=0):
+    rng = random.Random(seed)
+    commands = [cls(**fields) for cls in Command._commands
+                for fields in random_field_values(cls, count_per_class, rng)]
+    rng.shuffle(commands)
+    return commands
+
+
+def _decode(bits, chunk_sizes=None):
+    decoder = StreamDecoder()
+    commands = []
+    if chunk_sizes is None:
+        commands += decoder.feed(bits)
+    else:
+        i = 0
+        for size in chunk_sizes:
+            commands += decoder.feed(bits[i:i + size])
+            i += size
+    stats = decoder.stats()
+    commands += decoder.flush()
+    return commands, stats
+
+
+def test_back_to_back_frames():
+    commands = _commands()
+    bits = [bit for command in commands for bit in command.encode()]
+    decoded, stats = _decode(bits)
+    assert decoded == commands
+    assert stats['dropped_bits'] == 0
+
+
+def test_noise_bursts_and_truncated_frames_are_skipped():
+    rng = random.Random(1)
+    commands = _commands()
+    bits = []
+    for command in commands:
+        if rng.random() < 0.3:
+            noise = [rng.randrange(2) for _ in range(rng.randrange(1, 40))] + [0] * 12
+        elif rng.random() < 0.3:
+            # Frame cut short by a dropout
+            noise = command.encode()[:rng.randrange(8, 40)] + [0] * 12
+        else:
+            noise = [0] * rng.randrange(3)
+        bits += noise + command.encode() + [0] * 12
+    decoded, stats = _decode(bits)
+    assert decoded == commands
+    assert stats['bits'] == len(bits)
+    assert stats['frames'] == len(commands)
+    assert stats['dropped_bits'] == len(bits) - sum(len(c.encode()) for c in commands)
+    assert stats['pending_bits'] == 0
+
+
+def test_chunk_boundaries_do_not_matter():
+    rng = random.Random(2)
+    commands = _commands(5)
+    bits = [bit for command in commands for bit in command.encode() + [0] * rng.randrange(3)]
+    chunk_sizes = []
+    while sum(chunk_sizes) < len(bits):
+        chunk_sizes.append(rng.choice([1, 7, 63, 64, 65, 200]))
+    assert _decode(bits, chunk_sizes)[0] == commands
+    assert _decode(bits, [1] * len(bits))[0] == commands
+
+
+def test_feed_packed_matches_feed():
+    commands = _commands(5)
+    bits = [bit for command in commands for bit in command.encode()]
+    data = np.packbits(np.array(bits, dtype=np.uint8), bitorder='little').tobytes()
+    decoder = StreamDecoder()
+    decoded = list(decoder.feed_packed(data, len(bits))) + list(decoder.flush())
+    assert decoded == commands
+    assert decoder.num_bits == len(bits)
+
+
+def test_pending_frame_is_reported_until_flushed():
+    command = _commands(1)[0]
+    decoder = StreamDecoder()
+    assert list(decoder.feed(command.encode())) == []
+    assert decoder.stats()['pending_bits'] == len(command.encode())
+    assert list(decoder.flush()) == [command]
+    assert decoder.stats()['pending_bits'] == 0